@@ -2,9 +2,8 @@
 import logging
 from sqlmodel import Session, select, col
 from database import engine
-from models import DailyOperation, Employee, Event
+from models import Attendance, Employee, Event
 from datetime import datetime
-import json
 
 # Setup Logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
@@ -12,75 +11,52 @@ logger = logging.getLogger(__name__)
 
 def backfill_events():
     with Session(engine) as session:
-        # Fetch all processed daily operations
-        ops = session.exec(select(DailyOperation)).all()
-        logger.info(f"Found {len(ops)} daily operations to scan.")
+        # Faltas/atestados registrados na presença diária (tabela Attendance)
+        rows = session.exec(
+            select(Attendance, Employee)
+            .join(Employee, Employee.id == Attendance.employee_id)
+            .where(col(Attendance.status).in_(['absent', 'sick']))
+        ).all()
+        logger.info(f"Found {len(rows)} absence/sick attendance rows to scan.")
 
-        # Cache Employees
-        employees = session.exec(select(Employee)).all()
-        emp_map = {str(e.registration_id): e for e in employees}
-        logger.info(f"Cached {len(employees)} employees.")
+        # Eventos já existentes por (colaborador, tipo, dia) - uma consulta só
+        existing = {
+            (e.employee_id, e.type, e.day or e.timestamp.date())
+            for e in session.exec(select(Event).where(col(Event.type).in_(['falta', 'atestado']))).all()
+        }
 
         new_events_count = 0
         
-        for op in ops:
-            if not op.attendance_log:
-                continue
-                
-            op_date_dt = datetime.strptime(op.date, "%Y-%m-%d")
+        for att, emp in rows:
+            op_date = att.date
+            op_date_dt = datetime.combine(op_date, datetime.min.time())
+
+            # Determine Event Type
+            event_type = "falta" if att.status == 'absent' else "atestado"
             
-            # For each entry in attendance log
-            for reg_id, entry in op.attendance_log.items():
-                status = entry.get('status')
-                
-                # We care about: absent (falta), sick (atestado), away (afastado)
-                if status not in ['absent', 'sick']:
-                    continue
-                    
-                emp = emp_map.get(str(reg_id))
-                if not emp:
-                    continue
+            # Check for duplicate: Event for this employee, this date, this type
+            if (emp.id, event_type, op_date) in existing:
+                continue
 
-                # Determine Event Type
-                event_type = "falta" if status == 'absent' else "atestado"
-                
-                # Check for duplicate: Event for this employee, this date (approx), this type
-                # We assume the event timestamp matches the op date 
-                # (Or strictly, an event of this type created around this time? 
-                # Better: Check if an event exists for this employee with timestamp on this DATE)
-                
-                # Complex filter in SQLModel/SQLAlchemy for Date part of DataTime is tricky without specific funcs
-                # We'll fetch events for this employee and filter in python for safety and simplicity (volume isn't huge yet)
-                
-                existing_events = session.exec(
-                    select(Event)
-                    .where(Event.employee_id == emp.id)
-                    .where(Event.type == event_type)
-                ).all()
-                
-                # Check if any matches the date
-                already_exists = any(e.timestamp.date() == op_date_dt.date() for e in existing_events)
+            if att.status == 'sick':
+                evt_text = f"Atestado registrado em {op_date}"
+            else:
+                evt_text = f"Falta registrada em {op_date}"
                 
-                if not already_exists:
-                    # Create Event
-                    evt_text = f"Registro automático: {status.upper()} em {op.date}"
-                    if status == 'sick':
-                        evt_text = f"Atestado registrado em {op.date}"
-                    elif status == 'absent':
-                        evt_text = f"Falta registrada em {op.date}"
-                        
-                    new_event = Event(
-                        timestamp=op_date_dt.replace(hour=8, minute=0), # Set to morning of that day
-                        text=evt_text,
-                        type=event_type,
-                        category="pessoas",
-                        sector=emp.cost_center or "Geral",
-                        impact="medium", # Faltas/Atestados generally medium
-                        employee_id=emp.id,
-                        # We don't link shift_id easily unless we fetch shift object, skippable for now
-                    )
-                    session.add(new_event)
-                    new_events_count += 1
+            new_event = Event(
+                timestamp=op_date_dt.replace(hour=8, minute=0), # Set to morning of that day
+                text=evt_text,
+                type=event_type,
+                category="pessoas",
+                sector=emp.cost_center or "Geral",
+                impact="medium", # Faltas/Atestados generally medium
+                employee_id=emp.id,
+                day=op_date,  # Chave de dedup (employee_id, type, day)
+                # We don't link shift_id easily unless we fetch shift object, skippable for now
+            )
+            session.add(new_event)
+            existing.add((emp.id, event_type, op_date))
+            new_events_count += 1
 
         session.commit()
         logger.info(f"Backfill Complete. Created {new_events_count} new events.")
@@ -0,0 +1,152 @@
+"""
+Broker de eventos em tempo real do Smart Flow (Server-Sent Events).
+
+Cada aba aberta em /smart-flow assina canais por dia/turno e recebe os deltas
+de alocação/rotina gravados por outros supervisores, em vez de recarregar tudo.
+
+- LocalBroker: filas asyncio em memória (um processo / um worker).
+- RedisBroker: publica via Redis Pub/Sub para que vários workers se enxerguem;
+  cada processo repassa as mensagens aos seus assinantes locais. Ativado com
+  REALTIME_REDIS_URL (requer o pacote `redis`; sem ele cai no LocalBroker).
+"""
+import asyncio
+import json
+import logging
+import os
+from contextlib import asynccontextmanager
+from datetime import date as date_type
+
+# Filho do logger de main.py (herda o RotatingFileHandler de logs.txt)
+logger = logging.getLogger("main.broker")
+
+# Mensagens pendentes por assinante; acima disso o cliente recebe "resync"
+SUBSCRIBER_QUEUE_SIZE = int(os.environ.get("REALTIME_QUEUE_SIZE", 100))
+
+
+def day_channel(date: date_type, shift: str) -> str:
+    """Canal de um dia/turno (alocações e rotinas)"""
+    return f"{date.isoformat()}|{shift}"
+
+
+def shift_channel(shift: str) -> str:
+    """Canal de um turno em qualquer dia (status dos colaboradores)"""
+    return f"*|{shift}"
+
+
+class LocalBroker:
+    """Pub/Sub em memória: canal -> conjunto de filas dos assinantes"""
+
+    def __init__(self, queue_size: int = SUBSCRIBER_QUEUE_SIZE):
+        self.queue_size = queue_size
+        self._subscribers = {}  # canal -> set[asyncio.Queue]
+        self.published = 0
+        self.dropped = 0
+
+    async def start(self):
+        pass
+
+    async def stop(self):
+        pass
+
+    async def publish(self, channel: str, message: dict):
+        self._deliver(channel, message)
+
+    def _deliver(self, channel: str, message: dict):
+        self.published += 1
+        for queue in list(self._subscribers.get(channel, ())):
+            try:
+                queue.put_nowait(message)
+            except asyncio.QueueFull:
+                # Cliente lento: descarta o atraso e pede para recarregar o estado
+                self.dropped += 1
+                while not queue.empty():
+                    queue.get_nowait()
+                queue.put_nowait({"type": "resync"})
+
+    @asynccontextmanager
+    async def subscribe(self, *channels: str):
+        queue = asyncio.Queue(maxsize=self.queue_size)
+        for channel in channels:
+            self._subscribers.setdefault(channel, set()).add(queue)
+        try:
+            yield queue
+        finally:
+            for channel in channels:
+                subscribers = self._subscribers.get(channel)
+                if subscribers is not None:
+                    subscribers.discard(queue)
+                    if not subscribers:
+                        del self._subscribers[channel]
+
+    def stats(self) -> dict:
+        return {
+            "backend": type(self).__name__,
+            "channels": len(self._subscribers),
+            "subscribers": sum(len(s) for s in self._subscribers.values()),
+            "published": self.published,
+            "dropped": self.dropped,
+        }
+
+
+class RedisBroker(LocalBroker):
+    """Publica no Redis; um listener por processo entrega aos assinantes locais"""
+
+    PREFIX = "smartflow:"
+
+    def __init__(self, url: str, redis_module, queue_size: int = SUBSCRIBER_QUEUE_SIZE):
+        super().__init__(queue_size)
+        self._redis = redis_module.from_url(url)
+        self._listener = None
+
+    async def start(self):
+        self._listener = asyncio.create_task(self._listen())
+
+    async def stop(self):
+        if self._listener:
+            self._listener.cancel()
+            try:
+                await self._listener
+            except asyncio.CancelledError:
+                pass
+        await self._redis.aclose()
+
+    async def publish(self, channel: str, message: dict):
+        try:
+            await self._redis.publish(self.PREFIX + channel, json.dumps(message, default=str))
+        except Exception:
+            # Sem Redis ainda entrega neste processo
+            logger.exception("Falha ao publicar no Redis; entregando só localmente")
+            self._deliver(channel, message)
+
+    async def _listen(self):
+        while True:
+            try:
+                pubsub = self._redis.pubsub()
+                await pubsub.psubscribe(self.PREFIX + "*")
+                async for item in pubsub.listen():
+                    if item.get("type") != "pmessage":
+                        continue
+                    channel = item["channel"]
+                    if isinstance(channel, bytes):
+                        channel = channel.decode()
+                    self._deliver(channel[len(self.PREFIX):], json.loads(item["data"]))
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.exception("Listener do Redis caiu; reconectando em 5s")
+                await asyncio.sleep(5)
+
+
+def create_broker() -> LocalBroker:
+    url = os.environ.get("REALTIME_REDIS_URL")
+    if not url:
+        return LocalBroker()
+    try:
+        import redis.asyncio as redis_asyncio
+    except ImportError:
+        logger.warning("REALTIME_REDIS_URL definido mas o pacote 'redis' não está instalado; usando broker local")
+        return LocalBroker()
+    return RedisBroker(url, redis_asyncio)
+
+
+broker = create_broker()
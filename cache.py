@@ -0,0 +1,112 @@
+"""
+Cache em memória (por processo) para dados que mudam pouco, com ETag.
+
+Cada valor guardado recebe uma versão nova; o ETag é derivado dessa versão
+(e do início do processo, para não repetir valores após um restart). Os
+endpoints de escrita chamam invalidate() e a próxima leitura recarrega do
+banco com um ETag diferente. O TTL é uma rede de segurança para mudanças
+feitas fora da API (scripts, outros workers).
+
+Também concentra os helpers de GET condicional (ETag / If-None-Match -> 304)
+usados pelos endpoints que são consultados em polling.
+"""
+import hashlib
+import itertools
+import logging
+import os
+import threading
+import time
+
+from starlette.responses import Response
+
+logger = logging.getLogger("main.cache")
+
+
+class VersionedCache:
+    """Cache chave -> valor com versão por entrada e invalidação explícita"""
+
+    def __init__(self, name: str, ttl_seconds: float = 300):
+        self.name = name
+        self.ttl = ttl_seconds
+        self._epoch = format(int(time.time()), "x")
+        self._versions = itertools.count(1)
+        self._entries = {}  # chave -> (expira_em, versão, valor)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+
+    def get(self, key):
+        """Retorna (valor, etag) ou None se ausente/expirado"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry and (not self.ttl or entry[0] > time.monotonic()):
+                self.hits += 1
+                return entry[2], self._etag(entry[1])
+            self.misses += 1
+            return None
+
+    def set(self, key, value) -> str:
+        """Guarda o valor com uma versão nova e retorna o ETag"""
+        with self._lock:
+            version = next(self._versions)
+            self._entries[key] = (time.monotonic() + self.ttl, version, value)
+            return self._etag(version)
+
+    def invalidate(self, key=None):
+        """Descarta uma chave (ou tudo, se key=None)"""
+        with self._lock:
+            if key is None:
+                self._entries.clear()
+            else:
+                self._entries.pop(key, None)
+            self.invalidations += 1
+        logger.info("Cache %s invalidado (%s)", self.name, "tudo" if key is None else key)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "hits": self.hits,
+                "misses": self.misses,
+                "invalidations": self.invalidations,
+                "ttl_seconds": self.ttl,
+            }
+
+    def _etag(self, version: int) -> str:
+        return f'W/"{self.name}-{self._epoch}.{version}"'
+
+
+def etag_matches(if_none_match: str, etag: str) -> bool:
+    """Compara o header If-None-Match com o ETag (comparação fraca, aceita lista e '*')"""
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    bare = etag.removeprefix("W/")
+    return any(tag.strip().removeprefix("W/") == bare for tag in if_none_match.split(","))
+
+
+def make_etag(prefix: str, *parts) -> str:
+    """ETag forte a partir de um marcador de versão (ex.: contagens e max(updated_at))"""
+    digest = hashlib.sha1(repr(parts).encode("utf-8")).hexdigest()[:20]
+    return f'"{prefix}-{digest}"'
+
+
+def conditional_headers(etag: str) -> dict:
+    # no-cache: o navegador guarda a resposta, mas revalida com If-None-Match
+    return {"ETag": etag, "Cache-Control": "private, no-cache"}
+
+
+def not_modified(request, etag: str):
+    """Resposta 304 se o cliente já tem esta versão; None caso contrário"""
+    if etag_matches(request.headers.get("if-none-match"), etag):
+        return Response(status_code=304, headers=conditional_headers(etag))
+    return None
+
+
+# Árvore setor -> sub-setores por turno (Smart Flow)
+sector_tree_cache = VersionedCache("sectors", ttl_seconds=float(os.environ.get("SECTOR_CACHE_TTL_SECONDS", 300)))
+
+# Lista de colaboradores serializada, por versão (/api/roster)
+roster_cache = VersionedCache("roster", ttl_seconds=float(os.environ.get("ROSTER_CACHE_TTL_SECONDS", 3600)))
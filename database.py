@@ -1,17 +1,33 @@
 from sqlmodel import SQLModel, create_engine, Session
+from sqlmodel.ext.asyncio.session import AsyncSession
+from sqlalchemy import event, text
+from sqlalchemy.exc import OperationalError, TimeoutError as PoolTimeoutError
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
 
+import logging
 import os
+import time
+import threading
+from collections import deque
 from dotenv import load_dotenv
 
 load_dotenv()
 
+# Filho do logger de main.py (herda o RotatingFileHandler de logs.txt)
+logger = logging.getLogger("main.database")
+
+def _normalize_url(url):
+    # Fix for Render/Heroku using postgres:// instead of postgresql://
+    if url and url.startswith("postgres://"):
+        return url.replace("postgres://", "postgresql://", 1)
+    return url
+
 # Check for DATABASE_URL env var (Production) or use local sqlite (Development)
 sqlite_file_name = "database.db"
-sqlite_url = os.environ.get("DATABASE_URL", f"sqlite:///{sqlite_file_name}")
+sqlite_url = _normalize_url(os.environ.get("DATABASE_URL", f"sqlite:///{sqlite_file_name}"))
 
-# Fix for Render/Heroku using postgres:// instead of postgresql://
-if sqlite_url and sqlite_url.startswith("postgres://"):
-    sqlite_url = sqlite_url.replace("postgres://", "postgresql://", 1)
+# Réplica somente leitura opcional para os relatórios (vazio = usa o primário)
+read_url = _normalize_url(os.environ.get("DATABASE_READ_URL", "").strip()) or None
 
 connect_args = {}
 if "sqlite" in sqlite_url:
@@ -20,7 +36,326 @@ if "sqlite" in sqlite_url:
 
 # Performance: Only echo SQL in DEBUG mode
 DEBUG = os.environ.get("DEBUG", "false").lower() == "true"
-engine = create_engine(sqlite_url, echo=DEBUG, connect_args=connect_args)
+
+
+def _env_int(name: str, default: int) -> int:
+    try:
+        return int(os.environ.get(name, default))
+    except (TypeError, ValueError):
+        return default
+
+def _env_bool(name: str, default: bool) -> bool:
+    value = os.environ.get(name)
+    if value is None:
+        return default
+    return value.lower() in ("1", "true", "yes", "on")
+
+
+# --- Pool de conexões ---
+# Dimensionar por worker: (DB_POOL_SIZE + DB_MAX_OVERFLOW) * nº de workers
+# deve caber no max_connections do Postgres.
+POOL_CONFIG = {
+    "pool_size": _env_int("DB_POOL_SIZE", 5),
+    "max_overflow": _env_int("DB_MAX_OVERFLOW", 10),
+    "pool_timeout": _env_int("DB_POOL_TIMEOUT", 30),
+    "pool_recycle": _env_int("DB_POOL_RECYCLE", 1800),
+    "pool_pre_ping": _env_bool("DB_POOL_PRE_PING", True),
+}
+
+# --- SQLite: pragmas aplicados em cada nova conexão ---
+SQLITE_PRAGMAS = {
+    "journal_mode": "WAL",  # Leitores não bloqueiam o escritor
+    "synchronous": "NORMAL",  # Seguro com WAL e bem mais rápido que FULL
+    "cache_size": -_env_int("SQLITE_CACHE_SIZE_KB", 65536),  # Negativo = KiB
+    "mmap_size": _env_int("SQLITE_MMAP_SIZE", 268435456),  # 256 MB
+    "busy_timeout": _env_int("SQLITE_BUSY_TIMEOUT_MS", 5000),  # Espera em vez de "database is locked"
+}
+
+
+def _engine_kwargs(url: str) -> dict:
+    # SQLite em memória usa SingletonThreadPool, que não aceita overflow/timeout
+    if url.startswith("sqlite") and (":memory:" in url or url.rstrip("/").endswith("sqlite:")):
+        return {}
+    return dict(POOL_CONFIG)
+
+
+def _set_sqlite_pragmas(dbapi_connection, connection_record):
+    cursor = dbapi_connection.cursor()
+    for pragma, value in SQLITE_PRAGMAS.items():
+        cursor.execute(f"PRAGMA {pragma}={value}")
+    cursor.close()
+
+
+class PoolStats:
+    """Contadores de uso do pool (checkouts, conexões novas, espera por conexão)"""
+
+    def __init__(self, name: str):
+        self.name = name
+        self.connects = 0
+        self.checkouts = 0
+        self.checkins = 0
+        self.invalidations = 0
+        self.timeouts = 0
+        self.peak_checked_out = 0
+        self._checked_out = 0
+        self._waits = deque(maxlen=1000)  # Últimas esperas (segundos)
+        self._lock = threading.Lock()
+
+    def attach(self, sync_engine):
+        event.listen(sync_engine, "connect", self._on_connect)
+        event.listen(sync_engine, "checkout", self._on_checkout)
+        event.listen(sync_engine, "checkin", self._on_checkin)
+        event.listen(sync_engine, "invalidate", self._on_invalidate)
+        # O pool não tem evento "antes do checkout": a espera é medida
+        # embrulhando o connect(), no momento em que a sessão de fato usa
+        # uma conexão (as sessões não fazem checkout antecipado).
+        pool = sync_engine.pool
+        pool.connect = self._timed_connect(pool.connect)
+
+    def _timed_connect(self, connect):
+        def timed_connect():
+            started = time.perf_counter()
+            try:
+                connection = connect()
+            except PoolTimeoutError:
+                self.record_timeout()
+                raise
+            self.record_wait(time.perf_counter() - started)
+            return connection
+        return timed_connect
+
+    def _on_connect(self, dbapi_connection, connection_record):
+        with self._lock:
+            self.connects += 1
+
+    def _on_checkout(self, dbapi_connection, connection_record, connection_proxy):
+        with self._lock:
+            self.checkouts += 1
+            self._checked_out += 1
+            self.peak_checked_out = max(self.peak_checked_out, self._checked_out)
+
+    def _on_checkin(self, dbapi_connection, connection_record):
+        with self._lock:
+            self.checkins += 1
+            self._checked_out = max(0, self._checked_out - 1)
+
+    def _on_invalidate(self, dbapi_connection, connection_record, exception):
+        with self._lock:
+            self.invalidations += 1
+
+    def record_wait(self, seconds: float):
+        with self._lock:
+            self._waits.append(seconds)
+
+    def record_timeout(self):
+        with self._lock:
+            self.timeouts += 1
+
+    def snapshot(self, pool) -> dict:
+        with self._lock:
+            waits = sorted(self._waits)
+            data = {
+                "connects": self.connects,
+                "checkouts": self.checkouts,
+                "checkins": self.checkins,
+                "invalidations": self.invalidations,
+                "timeouts": self.timeouts,
+                "checked_out": self._checked_out,
+                "peak_checked_out": self.peak_checked_out,
+            }
+        data["wait_ms"] = {
+            "samples": len(waits),
+            "avg": round(sum(waits) / len(waits) * 1000, 2) if waits else 0.0,
+            "p95": round(waits[min(len(waits) - 1, int(len(waits) * 0.95))] * 1000, 2) if waits else 0.0,
+            "max": round(waits[-1] * 1000, 2) if waits else 0.0,
+        }
+        data["pool"] = pool.status()
+        for attr in ("size", "checkedin", "overflow"):
+            fn = getattr(pool, attr, None)
+            if callable(fn):
+                data[attr] = fn()
+        return data
+
+
+engine = create_engine(sqlite_url, echo=DEBUG, connect_args=connect_args, **_engine_kwargs(sqlite_url))
+
+
+def get_async_url(url: str) -> tuple:
+    """
+    Converte a URL síncrona para o driver assíncrono equivalente.
+    postgresql:// -> postgresql+asyncpg:// | sqlite:/// -> sqlite+aiosqlite:///
+
+    Retorna (url, connect_args). O asyncpg não aceita `sslmode` na URL,
+    então o parâmetro é convertido para o argumento `ssl` da conexão.
+    """
+    async_connect_args = {}
+    if url.startswith("sqlite"):
+        rest = url.split("://", 1)[1]
+        return f"sqlite+aiosqlite://{rest}", async_connect_args
+
+    scheme, rest = url.split("://", 1)
+    async_url = f"postgresql+asyncpg://{rest}" if scheme.startswith("postgresql") else url
+
+    if "sslmode=" in async_url:
+        base, query = async_url.split("?", 1)
+        params = [p for p in query.split("&") if p]
+        kept = []
+        for param in params:
+            key, _, value = param.partition("=")
+            if key == "sslmode":
+                async_connect_args["ssl"] = value
+            else:
+                kept.append(param)
+        async_url = base + ("?" + "&".join(kept) if kept else "")
+
+    return async_url, async_connect_args
+
+
+# Async engine (asyncpg em produção, aiosqlite em desenvolvimento)
+# Usado pelos endpoints quentes do Smart Flow para não bloquear o event loop.
+async_url, async_connect_args = get_async_url(sqlite_url)
+async_engine = create_async_engine(async_url, echo=DEBUG, connect_args=async_connect_args, **_engine_kwargs(sqlite_url))
+
+# expire_on_commit=False: após o commit os objetos continuam acessíveis sem
+# disparar lazy-load (que não é permitido fora do contexto async).
+async_session_maker = async_sessionmaker(async_engine, class_=AsyncSession, expire_on_commit=False)
+
+if sqlite_url.startswith("sqlite"):
+    event.listen(engine, "connect", _set_sqlite_pragmas)
+    event.listen(async_engine.sync_engine, "connect", _set_sqlite_pragmas)
+
+
+# --- Réplica de leitura ---
+
+def _set_read_only(dbapi_connection, connection_record):
+    # Garante que nada escreva pela réplica, mesmo se a URL apontar para um primário
+    cursor = dbapi_connection.cursor()
+    if read_url.startswith("sqlite"):
+        cursor.execute("PRAGMA query_only=ON")
+        cursor.close()
+    else:
+        cursor.execute("SET SESSION CHARACTERISTICS AS TRANSACTION READ ONLY")
+        cursor.close()
+        dbapi_connection.commit()
+
+
+read_engine = None
+if read_url:
+    read_engine = create_engine(read_url, echo=DEBUG, **_engine_kwargs(read_url))
+    if read_url.startswith("sqlite"):
+        event.listen(read_engine, "connect", _set_sqlite_pragmas)
+    event.listen(read_engine, "connect", _set_read_only)
+
+
+class ReplicaLagGuard:
+    """
+    Decide se a réplica pode atender leituras. O atraso de replicação é
+    consultado no máximo uma vez a cada `check_interval` segundos; se a réplica
+    estiver atrasada além de `max_lag` ou indisponível, as leituras vão para o
+    primário até a próxima checagem.
+    """
+
+    def __init__(self, max_lag: float, check_interval: float):
+        self.max_lag = max_lag
+        self.check_interval = check_interval
+        self.lag = None
+        self.healthy = False
+        self.last_error = None
+        self.fallbacks = 0
+        self._checked_at = 0.0
+        self._lock = threading.Lock()
+
+    def _measure_lag(self) -> float:
+        with read_engine.connect() as conn:
+            if read_engine.dialect.name != "postgresql":
+                # SQLite não replica: um segundo arquivo é considerado em dia
+                return 0.0
+            # Sem WAL pendente de replay = em dia, mesmo com o primário ocioso
+            lag = conn.execute(text(
+                "SELECT CASE "
+                "WHEN NOT pg_is_in_recovery() THEN 0 "
+                "WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0 "
+                "ELSE COALESCE(EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()), 0) END"
+            )).scalar()
+            return float(lag or 0)
+
+    def is_usable(self) -> bool:
+        if read_engine is None:
+            return False
+        with self._lock:
+            if time.monotonic() - self._checked_at < self.check_interval:
+                return self.healthy
+            self._checked_at = time.monotonic()
+            try:
+                self.lag = self._measure_lag()
+                self.last_error = None
+                healthy = self.lag <= self.max_lag
+                if not healthy:
+                    logger.warning(f"Réplica atrasada {self.lag:.1f}s (limite {self.max_lag}s) - leituras no primário")
+            except Exception as e:
+                self.lag = None
+                self.last_error = str(e)
+                healthy = False
+                logger.warning(f"Réplica indisponível - leituras no primário: {e}")
+            self.healthy = healthy
+            return healthy
+
+    def mark_unavailable(self, error: Exception):
+        """Chamado quando a conexão com a réplica falha entre duas checagens"""
+        with self._lock:
+            self.healthy = False
+            self.last_error = str(error)
+            self._checked_at = time.monotonic()
+        logger.warning(f"Falha ao conectar na réplica - leituras no primário: {error}")
+
+    def record_fallback(self):
+        with self._lock:
+            self.fallbacks += 1
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {
+                "configured": read_engine is not None,
+                "healthy": self.healthy,
+                "lag_seconds": round(self.lag, 2) if self.lag is not None else None,
+                "max_lag_seconds": self.max_lag,
+                "fallbacks": self.fallbacks,
+                "last_error": self.last_error,
+            }
+
+
+replica_guard = ReplicaLagGuard(
+    max_lag=_env_int("REPLICA_MAX_LAG_SECONDS", 30),
+    check_interval=_env_int("REPLICA_LAG_CHECK_SECONDS", 5),
+)
+
+
+pool_stats = {
+    "sync": PoolStats("sync"),
+    "async": PoolStats("async"),
+}
+pool_stats["sync"].attach(engine)
+pool_stats["async"].attach(async_engine.sync_engine)
+if read_engine is not None:
+    pool_stats["read"] = PoolStats("read")
+    pool_stats["read"].attach(read_engine)
+
+
+def get_pool_stats() -> dict:
+    """Estatísticas dos pools para dimensionar deploys com vários workers"""
+    engines = {
+        "sync": pool_stats["sync"].snapshot(engine.pool),
+        "async": pool_stats["async"].snapshot(async_engine.sync_engine.pool),
+    }
+    if read_engine is not None:
+        engines["read"] = pool_stats["read"].snapshot(read_engine.pool)
+    return {
+        "config": POOL_CONFIG,
+        "sqlite_pragmas": SQLITE_PRAGMAS if sqlite_url.startswith("sqlite") else None,
+        "engines": engines,
+        "replica": replica_guard.snapshot(),
+    }
+
 
 def create_db_and_tables():
     SQLModel.metadata.create_all(engine)
@@ -28,3 +363,36 @@ def create_db_and_tables():
 def get_session():
     with Session(engine) as session:
         yield session
+
+def get_read_session():
+    """
+    Sessão para endpoints somente leitura (relatórios). Usa a réplica
+    (DATABASE_READ_URL) quando configurada e em dia; senão, o primário.
+    """
+    if replica_guard.is_usable():
+        session = Session(read_engine)
+        try:
+            # Único checkout antecipado: detecta a réplica fora do ar aqui,
+            # enquanto ainda dá para cair no primário
+            session.connection()
+        except OperationalError as e:
+            session.close()
+            replica_guard.mark_unavailable(e)
+        else:
+            with session:
+                yield session
+            return
+    if read_engine is not None:
+        replica_guard.record_fallback()
+    with Session(engine) as session:
+        yield session
+
+async def get_async_session():
+    async with async_session_maker() as session:
+        yield session
+
+async def dispose_engines():
+    """Fecha as conexões do pool assíncrono (e da réplica) no shutdown"""
+    await async_engine.dispose()
+    if read_engine is not None:
+        read_engine.dispose()
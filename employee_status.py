@@ -0,0 +1,182 @@
+"""
+Status do colaborador em uma data.
+
+Employee.status guarda só o status atual; para datas passadas o status é
+reconstruído a partir do histórico, nesta ordem:
+
+1. demissão: termination_date até o dia, último evento "demissao" ou status
+   atual 'fired' sem data nem histórico;
+2. período de ausência (AbsencePeriod) cobrindo o dia -> vacation/sick/away;
+3. último evento de mudança de status até o dia ("Falta"/"Folga" continuam valendo);
+4. caso contrário, 'active'.
+
+Colaboradores admitidos depois do dia ficam de fora. Dias passados são
+memoizados em `employeestatussnapshot` (uma linha por colaborador/dia); hoje
+e datas futuras usam Employee.status. Edições de histórico (período retroativo,
+exclusão de evento de status, admissão no passado) descartam o memo a partir
+do dia afetado (persistence.invalidate_status_snapshots / invalidate_snapshots);
+o scheduler recalcula os dias passados sem memo (backfill_snapshots).
+
+As funções recebem Session síncrona; no código async use session.run_sync.
+"""
+from datetime import datetime, time, timedelta, date as date_type
+
+from sqlalchemy import delete, distinct, func
+from sqlmodel import Session, select
+
+import models
+import persistence
+
+# Eventos que registram mudança de status do colaborador
+STATUS_EVENT_TYPES = ("routine_change", "demissao", "retorno")
+
+# Status de rotina que valem até a próxima mudança (sem período de ausência)
+STICKY_STATUSES = ("absent", "dayoff")
+
+
+def _event_status(event_type: str, category: str) -> str:
+    if event_type == "demissao":
+        return "fired"
+    if event_type == "retorno":
+        return "active"
+    return persistence.ROUTINE_STATUS.get(category, "active")
+
+
+def compute_statuses(session: Session, day: date_type) -> dict:
+    """Reconstrói {employee_id: status} em `day` a partir do histórico (3 consultas)"""
+    Employee, Absence, Event = models.Employee, models.AbsencePeriod, models.Event
+
+    employees = session.exec(
+        select(Employee.id, Employee.status, Employee.admission_date, Employee.termination_date)
+    ).all()
+
+    absences = {}
+    for emp_id, kind in session.exec(
+        select(Absence.employee_id, Absence.kind)
+        .where(persistence.absence_overlaps(day, day))
+        .order_by(Absence.start_date)
+    ).all():
+        absences[emp_id] = kind  # Períodos sobrepostos: vale o que começou por último
+
+    # Último evento de status de cada colaborador até o fim do dia (índice employee_id+type+timestamp)
+    ranked = (
+        select(
+            Event.employee_id,
+            Event.type,
+            Event.category,
+            func.row_number().over(
+                partition_by=Event.employee_id,
+                order_by=(Event.timestamp.desc(), Event.id.desc()),
+            ).label("position"),
+        )
+        .where(Event.type.in_(STATUS_EVENT_TYPES))
+        .where(Event.employee_id.isnot(None))
+        .where(Event.timestamp < datetime.combine(day + timedelta(days=1), time.min))
+        .subquery()
+    )
+    last_status = {
+        emp_id: _event_status(event_type, category)
+        for emp_id, event_type, category in session.exec(
+            select(ranked.c.employee_id, ranked.c.type, ranked.c.category).where(ranked.c.position == 1)
+        ).all()
+    }
+
+    statuses = {}
+    for emp_id, current, admission_date, termination_date in employees:
+        if admission_date and admission_date.date() > day:
+            continue
+        last = last_status.get(emp_id)
+        if (
+            (termination_date and termination_date.date() <= day)
+            or last == "fired"
+            or (current == "fired" and termination_date is None and emp_id not in last_status)
+        ):
+            statuses[emp_id] = "fired"
+        elif emp_id in absences:
+            statuses[emp_id] = absences[emp_id]
+        elif last in STICKY_STATUSES:
+            statuses[emp_id] = last
+        else:
+            statuses[emp_id] = "active"
+    return statuses
+
+
+def _store(session: Session, day: date_type, statuses: dict):
+    """Grava o memo do dia (ON CONFLICT DO NOTHING: leituras concorrentes não colidem)"""
+    if not statuses:
+        return
+    table = models.EmployeeStatusSnapshot.__table__
+    now = datetime.now()
+    stmt = persistence.insert_ignoring(session.get_bind().dialect.name, table, ("date", "employee_id"))
+    session.exec(stmt, params=[
+        {"date": day, "employee_id": emp_id, "status": status, "computed_at": now}
+        for emp_id, status in statuses.items()
+    ])
+
+
+def invalidate_snapshots(session: Session, since: date_type) -> int:
+    """Descarta o memo a partir de `since` (rotas com Session síncrona); não faz commit"""
+    table = models.EmployeeStatusSnapshot.__table__
+    return session.exec(delete(table).where(table.c.date >= since)).rowcount
+
+
+def status_as_of(session: Session, day: date_type, memoize: bool = True) -> dict:
+    """
+    {employee_id: status} em `day`. Dias passados leem o memo; se não houver,
+    calculam e (com memoize) gravam e fazem commit. Sessões de leitura (réplica)
+    devem passar memoize=False.
+    """
+    if day >= datetime.now().date():
+        return dict(session.exec(select(models.Employee.id, models.Employee.status)).all())
+
+    Snapshot = models.EmployeeStatusSnapshot
+    stored = session.exec(select(Snapshot.employee_id, Snapshot.status).where(Snapshot.date == day)).all()
+    if stored:
+        return dict(stored)
+
+    statuses = compute_statuses(session, day)
+    if memoize:
+        _store(session, day, statuses)
+        session.commit()
+    return statuses
+
+
+def snapshot_statuses(session: Session, day: date_type) -> dict:
+    """Recalcula e regrava o memo de `day` (job diário); não faz commit"""
+    table = models.EmployeeStatusSnapshot.__table__
+    session.exec(delete(table).where(table.c.date == day))
+    statuses = compute_statuses(session, day)
+    _store(session, day, statuses)
+    counts = {}
+    for status in statuses.values():
+        counts[status] = counts.get(status, 0) + 1
+    return counts
+
+
+def backfill_snapshots(session: Session, start: date_type, end: date_type) -> dict:
+    """
+    Recalcula o memo dos dias de [start, end] que não têm linhas (descartados por
+    edição de histórico ou nunca calculados). Commit por dia; retorna {dia: linhas}.
+    """
+    Employee, Snapshot = models.Employee, models.EmployeeStatusSnapshot
+    earliest, undated, any_employee = session.exec(select(
+        func.min(Employee.admission_date),
+        select(Employee.id).where(Employee.admission_date.is_(None)).exists(),
+        select(Employee.id).exists(),
+    )).one()
+    if not any_employee:
+        return {}
+    if not undated and earliest:
+        # Antes da primeira admissão não há ninguém: dias sem linhas de propósito
+        start = max(start, earliest.date())
+    stored = set(session.exec(
+        select(distinct(Snapshot.date)).where(Snapshot.date >= start).where(Snapshot.date <= end)
+    ).all())
+    filled = {}
+    day = start
+    while day <= end:
+        if day not in stored:
+            filled[day.isoformat()] = sum(snapshot_statuses(session, day).values())
+            session.commit()
+        day += timedelta(days=1)
+    return filled
@@ -1,18 +1,30 @@
 from contextlib import asynccontextmanager
-from fastapi import FastAPI, Request, Form, Depends, HTTPException, status
+from fastapi import FastAPI, Request, Form, Depends, HTTPException, status, BackgroundTasks
 from fastapi.templating import Jinja2Templates
-from fastapi.responses import HTMLResponse, RedirectResponse, JSONResponse, Response
+from fastapi.responses import HTMLResponse, RedirectResponse, JSONResponse, Response, StreamingResponse
 from fastapi.staticfiles import StaticFiles
+from fastapi.exception_handlers import http_exception_handler
 from typing import Optional, List
 import json
-from datetime import datetime, timedelta
+import asyncio
+from datetime import datetime, timedelta, date as date_type
 import traceback
 import os
 from starlette.middleware.sessions import SessionMiddleware
-from sqlmodel import Session, select, col
+from sqlmodel import Session, select, col, func
+from sqlalchemy import update as sa_update, delete as sa_delete
 from typing import List
-from database import create_db_and_tables, get_session
+from sqlmodel.ext.asyncio.session import AsyncSession
+from database import create_db_and_tables, get_session, get_read_session, get_async_session, async_session_maker, dispose_engines, get_pool_stats, POOL_CONFIG, engine, async_engine, read_engine
 import models
+import persistence
+import employee_status
+from cache import sector_tree_cache, roster_cache, make_etag, conditional_headers, not_modified
+from broker import broker, day_channel, shift_channel
+from scheduler import scheduler, catch_up, rollover_allocations, rollover_shift, rollover_on_first_load, vacation_transitions, snapshot_statuses, backfill_status_snapshots
+from write_buffer import write_buffer, WriteBufferUnavailable
+from migrations import run_migrations, verify_indexes
+from monitoring import loop_monitor, RouteTrackingMiddleware, QueryCounterMiddleware, instrument_engine
 import logging
 from logging.handlers import RotatingFileHandler
 import unicodedata
@@ -92,6 +104,24 @@ def calculate_expected_work_days(work_days_json: str, start_date: datetime, end_
     return expected_days
 
 
+def parse_op_date(value) -> date_type:
+    """
+    Converte a data de operação recebida pela API para `date` (colunas DATE).
+    Aceita "YYYY-MM-DD" (formato padrão), "DD/MM/YYYY", date ou datetime.
+    """
+    if isinstance(value, datetime):
+        return value.date()
+    if isinstance(value, date_type):
+        return value
+    raw = (value or "").strip()
+    for fmt in ("%Y-%m-%d", "%d/%m/%Y"):
+        try:
+            return datetime.strptime(raw, fmt).date()
+        except ValueError:
+            continue
+    raise HTTPException(status_code=400, detail=f"Data inválida: {value!r} (use YYYY-MM-DD)")
+
+
 # API Models
 from pydantic import BaseModel
 from typing import Optional, List
@@ -111,43 +141,44 @@ class VacationSchedule(BaseModel):
     registration_id: str
     start_date: str
     end_date: str
-def update_vacation_statuses(session: Session, target_date: datetime):
-    """
-    Updates employee status based on vacation schedule vs target date.
-    """
-    check_start = target_date.replace(hour=0, minute=0, second=0, microsecond=0)
-    check_end = target_date.replace(hour=23, minute=59, second=59, microsecond=999)
-    employees = session.exec(select(models.Employee).where(models.Employee.status != "fired")).all()
-    for emp in employees:
-        if emp.vacation_start and emp.vacation_end:
-            # Basic validation of dates
-            v_start = emp.vacation_start
-            v_end = emp.vacation_end
-            
-            # Normalize for comparison
-            v_s = v_start.replace(hour=0, minute=0, second=0, microsecond=0)
-            v_e = v_end.replace(hour=23, minute=59, second=59, microsecond=999)
-            
-            should_be_vacation = v_s <= check_start <= v_e
-            
-            if should_be_vacation:
-                if emp.status != 'vacation':
-                    emp.status = 'vacation'
-                    session.add(emp)
-            else:
-                # If currently marked as vacation but NOT in vacation period anymore (or yet)
-                # revert to active.
-                if emp.status == 'vacation':
-                    emp.status = 'active'
-                    session.add(emp)
-    session.commit()
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     create_db_and_tables()
+    # Migrações versionadas (índices online) + verificação de drift do schema
+    if os.getenv("AUTO_MIGRATE", "true").lower() == "true":
+        try:
+            run_migrations(engine)
+        except Exception:
+            logger.exception("Falha ao aplicar migrações no startup")
+    verify_indexes(engine)
+    logger.info(f"DB pool config: {POOL_CONFIG}")
+    if read_engine is not None:
+        logger.info(f"Réplica de leitura ativa para relatórios ({read_engine.dialect.name})")
+    loop_monitor.start()
+    await broker.start()
+    # Rollover do dia seguinte (agendado) + recuperação de dias perdidos
+    await catch_up()
+    scheduler.start()
+    write_buffer.start()
     yield
+    # Flush de durabilidade: grava os autosaves ainda em memória antes de fechar o pool
+    await write_buffer.stop()
+    await scheduler.stop()
+    await broker.stop()
+    await loop_monitor.stop()
+    await dispose_engines()
 app = FastAPI(lifespan=lifespan)
 # Add Session Middleware
 app.add_middleware(SessionMiddleware, secret_key=SECRET_KEY)
+# Associa cada request à sua rota para o monitor de lag do event loop
+app.add_middleware(RouteTrackingMiddleware, monitor=loop_monitor)
+# Contagem de queries por request (headers X-DB-Queries / X-DB-Time-ms + alerta de N+1)
+if os.getenv("DB_QUERY_STATS_ENABLED", "true").lower() == "true":
+    instrument_engine(engine)
+    instrument_engine(async_engine.sync_engine)
+    if read_engine is not None:
+        instrument_engine(read_engine)
+    app.add_middleware(QueryCounterMiddleware, n_plus_one_threshold=int(os.getenv("DB_N_PLUS_ONE_THRESHOLD", "10")))
 # Mount static files
 app.mount("/static", StaticFiles(directory="static"), name="static")
 templates = Jinja2Templates(directory="templates")
@@ -205,9 +236,15 @@ async def clients_page(request: Request, session: Session = Depends(get_session)
     clients = session.exec(select(models.Client)).all()
     return templates.TemplateResponse("clients.html", {"request": request, "user": user, "clients": clients})
 @app.get("/clients/list", response_class=JSONResponse)
-async def list_clients(session: Session = Depends(get_session)):
+async def list_clients(request: Request, session: Session = Depends(get_session)):
+    # GET condicional: clientes só são incluídos, contagem + max(id) bastam como versão
+    version = session.exec(select(func.count(), func.max(models.Client.id))).one()
+    etag = make_etag("clients", *version)
+    cached = not_modified(request, etag)
+    if cached:
+        return cached
     clients = session.exec(select(models.Client)).all()
-    return {"clients": [c.name for c in clients]}
+    return JSONResponse({"clients": [c.name for c in clients]}, headers=conditional_headers(etag))
 # --- Route Management ---
 # --- Separação de Mercadorias Management ---
 @app.get("/separacao", response_class=HTMLResponse)
@@ -216,27 +253,33 @@ async def separacao_page(request: Request, date: Optional[str] = None, shift: st
     
     if not date:
         date = datetime.now().strftime("%Y-%m-%d")
-        
-    # 1. Fetch DailyOperation
-    daily_op = session.exec(
-        select(models.DailyOperation)
-        .where(models.DailyOperation.date == date)
-        .where(models.DailyOperation.shift == shift)
-    ).first()
-    
-    # 2. Filter Employees (Sector == Expedicao)
+    op_date = parse_op_date(date)
+    date = op_date.isoformat()
+        
+    # 1. Employees allocated to Expedição on this day/shift (indexed on date+shift+sector_key)
+    if write_buffer.version(op_date, shift):
+        # Autosaves ainda no buffer de escrita: presença do banco + pendente
+        attendance = write_buffer.attendance(session, op_date, shift)
+        expedicao_ids = [emp_id for emp_id, entry in attendance.items() if entry["sector"] == "expedicao"]
+        eligible_employees = session.exec(
+            select(models.Employee)
+            .where(models.Employee.id.in_(expedicao_ids))
+            .where(models.Employee.status != "fired")
+            .order_by(models.Employee.name)
+        ).all() if expedicao_ids else []
+    else:
+        eligible_employees = session.exec(
+            select(models.Employee)
+            .join(models.Attendance, models.Attendance.employee_id == models.Employee.id)
+            .where(models.Attendance.date == op_date)
+            .where(models.Attendance.shift == shift)
+            .where(models.Attendance.sector_key == "expedicao")
+            .where(models.Employee.status != "fired")
+            .order_by(models.Employee.name)
+        ).all()
+
+    # 2. All employees (name lookup for routes)
     all_employees = session.exec(select(models.Employee).where(models.Employee.status != "fired")).all()
-    emp_map_reg = {e.registration_id: e for e in all_employees}
-    
-    eligible_employees = []
-    if daily_op and daily_op.attendance_log:
-        for reg_id, data in daily_op.attendance_log.items():
-            if data.get('sector') == 'expedicao': 
-                emp = emp_map_reg.get(reg_id)
-                if emp:
-                    eligible_employees.append(emp)
-                    
-    eligible_employees.sort(key=lambda x: x.name)
 
     # 3. Fetch Clients
     clients = session.exec(select(models.Client)).all()
@@ -245,7 +288,7 @@ async def separacao_page(request: Request, date: Optional[str] = None, shift: st
     # 4. Fetch Routes
     db_routes = session.exec(
         select(models.Route)
-        .where(models.Route.date == date)
+        .where(models.Route.date == op_date)
         .where(models.Route.shift == shift)
         .order_by(models.Route.start_time)
     ).all()
@@ -312,7 +355,7 @@ async def separacao_page(request: Request, date: Optional[str] = None, shift: st
         "routes": routes_view,
         "selected_date": date,
         "selected_shift": shift,
-        "selected_date_fmt": datetime.strptime(date, "%Y-%m-%d").strftime("%d/%m/%Y")
+        "selected_date_fmt": op_date.strftime("%d/%m/%Y")
     })
 @app.post("/separacao/add", response_class=RedirectResponse)
 async def add_separacao(
@@ -329,7 +372,7 @@ async def add_separacao(
     require_login(request)
     try:
         new_route = models.Route(
-            date=date,
+            date=parse_op_date(date),
             shift=shift,
             employee_id=employee_id,
             client_id=client_id,
@@ -399,12 +442,19 @@ async def read_root(request: Request, shift: Optional[str] = None, session: Sess
             
         employees = session.exec(query).all()
         
-        # Also fetch people ON VACATION, filtering by shift if needed
-        vac_query = select(models.Employee).where(models.Employee.status == 'vacation')
+        # Férias em curso + próximas 20 dias: uma consulta no índice de períodos (kind, start_date, end_date)
+        limit_date = today + timedelta(days=20)
+        vac_query = (
+            select(models.Employee, models.AbsencePeriod)
+            .join(models.AbsencePeriod, models.AbsencePeriod.employee_id == models.Employee.id)
+            .where(persistence.absence_overlaps(today, limit_date, "vacation"))
+            .where(models.Employee.status != 'fired')
+            .order_by(models.AbsencePeriod.start_date)
+        )
         if shift and shift not in ['Todos', 'all']:
             vac_query = vac_query.where(models.Employee.work_shift == shift)
             
-        vacation_active_employees = session.exec(vac_query).all()
+        vacation_periods = session.exec(vac_query).all()
                 # Helper to get shift badge color/label
         def get_shift_meta(s):
             s = (s or '').lower()
@@ -446,38 +496,34 @@ async def read_root(request: Request, shift: Optional[str] = None, session: Sess
                     })
         anniversaries.sort(key=lambda x: x['day'])
         # 3. Vacations (Active + Upcoming 20 days)
-        # We need to scan ACTIVE employees for UPCOMING vacations, 
-        # and VACATION employees for CURRENT status.
         vacation_list = []
+        listed = set()
+        for emp, period in vacation_periods:
+            if emp.id in listed:
+                continue
+            listed.add(emp.id)
+            if period.start_date <= today:
                 # A) Currently on Vacation
-        for emp in vacation_active_employees:
-            end_str = "-"
-            if emp.vacation_end:
-                end_str = emp.vacation_end.strftime('%d/%m')
-            vacation_list.append({
-                "id": emp.id,
-                "name": emp.name,
-                "status": "Em Férias",
-                "date_info": f"Volta: {end_str}",
-                "is_active": True, # Blue/Orange status
-                "shift": get_shift_meta(emp.work_shift)
-            })
-        # B) Upcoming (Next 20 days) - Scan Active Employees
-        limit_date = today + timedelta(days=20)
-        for emp in employees:
-            if emp.vacation_start:
-                v_start = emp.vacation_start.date()
-                # If starts between tomorrow and limit_date
-                if today < v_start <= limit_date:
-                    vacation_list.append({
-                        "id": emp.id,
-                        "name": emp.name,
-                        "status": "Vai sair",
-                        "date_info": f"Sai: {v_start.strftime('%d/%m')}",
-                        "is_active": False, # Future
-                        "shift": get_shift_meta(emp.work_shift),
-                        "sort_date": v_start
-                    })
+                end_str = period.end_date.strftime('%d/%m') if period.end_date else "-"
+                vacation_list.append({
+                    "id": emp.id,
+                    "name": emp.name,
+                    "status": "Em Férias",
+                    "date_info": f"Volta: {end_str}",
+                    "is_active": True, # Blue/Orange status
+                    "shift": get_shift_meta(emp.work_shift)
+                })
+            else:
+                # B) Upcoming (Next 20 days)
+                vacation_list.append({
+                    "id": emp.id,
+                    "name": emp.name,
+                    "status": "Vai sair",
+                    "date_info": f"Sai: {period.start_date.strftime('%d/%m')}",
+                    "is_active": False, # Future
+                    "shift": get_shift_meta(emp.work_shift),
+                    "sort_date": period.start_date
+                })
                 # Sort: Current first, then upcoming by date
         # We can use a sort key tuple: (0 for current/1 for future, date)
         # Active vacations don't have a sort_date easily, give them today
@@ -542,150 +588,32 @@ async def read_root(request: Request, shift: Optional[str] = None, session: Sess
         return HTMLResponse(content=f"<h1>Error Interno (500)</h1><pre>{traceback.format_exc()}</pre>", status_code=500)
 # --- Smart Flow Routes ---
 @app.get("/smart-flow", response_class=HTMLResponse)
-async def smart_flow_page(request: Request, shift: str = "Manhã", date: Optional[str] = None, session: Session = Depends(get_session)):
+async def smart_flow_page(request: Request, shift: str = "Manhã", date: Optional[str] = None):
     try:
         user = require_login(request)
-        # Get Employees for "Available Pool" (Active, Sick, Vacation, Away - Everyone except Fired)
-        # Auto-Update Vacation Status Check
-        if date:
-            try:
-                update_vacation_statuses(session, datetime.strptime(date, "%Y-%m-%d"))
-            except Exception as e:
-                print(f"Error checking vacation dates: {e}")
-                
-        employees = session.exec(select(models.Employee).where(models.Employee.status != "fired")).all()
-        emp_map = {e.registration_id: e for e in employees}
-        
-        # Get Daily Op
         if not date:
             date = datetime.now().strftime("%Y-%m-%d")
-            
-        daily_op = session.exec(
-            select(models.DailyOperation)
-            .where(models.DailyOperation.date == date)
-            .where(models.DailyOperation.shift == shift)
-        ).first()
-        if not daily_op:
-            # Logic: Smart Copy from Last Operation
-            last_op = session.exec(
-                select(models.DailyOperation)
-                .where(models.DailyOperation.shift == shift)
-                .where(models.DailyOperation.date < date)
-                .order_by(models.DailyOperation.date.desc())
-            ).first()
-            
-            initial_log = {}
-            if last_op and last_op.attendance_log:
-                for reg_id, entry in last_op.attendance_log.items():
-                    # Only copy if employee is still active
-                    if reg_id in emp_map:
-                        emp_record = emp_map[reg_id]
-                        # Reset daily status to 'present' ONLY if their permanent status is active.
-                        new_entry = entry.copy()
-                        
-                        if emp_record.status == 'vacation':
-                            new_entry['status'] = 'vacation'
-                        elif emp_record.status == 'sick':
-                            new_entry['status'] = 'sick'
-                        elif emp_record.status == 'away':
-                            new_entry['status'] = 'away'
-                        else:
-                            new_entry['status'] = 'present'
-                            
-                        initial_log[reg_id] = new_entry
-                        
-            daily_op = models.DailyOperation(date=date, shift=shift, attendance_log=initial_log) # Transient
-    
-        # Get Targets (Headcount) - Official HR Target
-        targets_db = session.exec(select(models.HeadcountTarget).where(models.HeadcountTarget.shift_name == shift)).first()
-        shift_target_hr = targets_db.target_value if targets_db else 0
-        
-        # Get Sector Configuration
-        sector_config_db = session.exec(select(models.SectorConfiguration).where(models.SectorConfiguration.shift_name == shift)).first()
+        date = parse_op_date(date).isoformat()
         
-        sector_config = {}
-        if sector_config_db and sector_config_db.config_json:
-            sector_config = sector_config_db.config_json
-            if isinstance(sector_config, str):
-                try:
-                    sector_config = json.loads(sector_config)
-                except:
-                    sector_config = {}
-        
-        if not sector_config or not isinstance(sector_config, dict) or "sectors" not in sector_config:
-            # Default Seed (Targets initialized to 0 to avoid confusion with HR Target)
-            sector_config = {
-                "sectors": [
-                    { "key": "recebimento", "label": "Recebimento", "target": 0, "subsectors": ["Doca 1", "Doca 2", "Paletização"] },
-                    { "key": "camara_fria", "label": "Câmara Fria", "target": 0, "subsectors": ["Armazenagem", "Abastecimento"] },
-                    { "key": "selecao", "label": "Seleção", "target": 0, "subsectors": ["Linha 1", "Linha 2"] },
-                    { "key": "expedicao", "label": "Expedição", "target": 0, "subsectors": ["Separação", "Carregamento"] }
-                ]
-            }
-    
-        # Calculate Total Target from Config (Operational Demand)
-        sectors_total_demand = sum(s.get("target", 0) for s in sector_config.get("sectors", []) if isinstance(s, dict))
-        # Calculate Real Tonnage from Routes
-        routes_in_shift = session.exec(
-            select(models.Route)
-            .where(models.Route.date == date)
-            .where(models.Route.shift == shift)
-        ).all()
-        total_tonnage_real = sum(r.tonnage for r in routes_in_shift if r.tonnage)
-        if daily_op.tonnage and daily_op.tonnage > 0:
-            total_tonnage_real = daily_op.tonnage
-            
-        # Format Tonnage
-        def fmt_num(n):
-            val = n if n is not None else 0.0
-            return f"{val:,.2f}".replace(",", "X").replace(".", ",").replace("X", ".")
-            
-        # Get employees who are substituted (for Dashboard "Substituição" KPI)
-        # Logic: Events where text contains "Substituído por"
-        sub_events = session.exec(select(models.Event).where(col(models.Event.text).contains("Substituído por"))).all()
-        substituted_ids = {e.employee_id for e in sub_events}
-
+        # Os dados da tela (setores, alocações, colaboradores, KPIs) vêm de
+        # /api/smart-flow/bootstrap; o HTML leva só data e turno
         return templates.TemplateResponse("smart_flow.html", {
             "request": request,
             "user": user,
-            "daily_op": daily_op,
-            "employees_list": employees,
             "current_shift": shift,
-            "current_date": date,
-            "total_target": sectors_total_demand, 
-            "shift_target_hr": shift_target_hr, # Passed for KPI
-            "sector_config": sector_config,
-            "total_tonnage_fmt": fmt_num(total_tonnage_real),
-            "total_tonnage_raw": total_tonnage_real, # Raw for JS calc
-            "manual_tonnage": daily_op.tonnage or 0, # Pass raw manual value for frontend to know
-            "substituted_ids": list(substituted_ids),
-            # JSON data for JavaScript modules
-            "employees_json": json.dumps(daily_op.attendance_log or {}),
-            "config_json": json.dumps(sector_config),
-            "all_employees_json": json.dumps([{
-                "id": e.registration_id,
-                "name": e.name,
-                "role": e.role,
-                "shift": e.work_shift,
-                "cost_center": e.cost_center,
-                "status": e.status,
-                "birthday": e.birthday.isoformat() if e.birthday else None,
-                "admission_date": e.admission_date.isoformat() if e.admission_date else None,
-                "is_substituted": e.registration_id in substituted_ids
-            } for e in employees])
+            "current_date": date
         })
     except Exception as e:
         logger.exception("Error in smart_flow_page")
         raise e
-    # Valid return is above
 @app.post("/employees/vacation", response_class=JSONResponse)
 async def schedule_vacation(
     request: Request,
     data: VacationSchedule,
-    session: Session = Depends(get_session)
+    session: AsyncSession = Depends(get_async_session)
 ):
     require_login(request)
-    emp = session.exec(select(models.Employee).where(models.Employee.registration_id == data.registration_id)).first()
+    emp = (await session.exec(select(models.Employee).where(models.Employee.registration_id == data.registration_id))).first()
     if not emp:
         return JSONResponse({"error": "Employee not found"}, status_code=404)
     try:
@@ -721,7 +649,13 @@ async def schedule_vacation(
         session.add(new_event)
         
         session.add(emp)
-        session.commit()
+        await persistence.upsert_absence_periods(session, [{
+            "employee_id": emp.id,
+            "kind": "vacation",
+            "start_date": emp.vacation_start.date(),
+            "end_date": emp.vacation_end.date()
+        }])
+        await session.commit()
         return JSONResponse({"message": "Vacation scheduled and status updated."})
     except ValueError:
         return JSONResponse({"error": "Invalid date format"}, status_code=400)
@@ -731,151 +665,162 @@ class BulkVacationItem(BaseModel):
     registration_id: str
     start_date: str
     end_date: str
+# Linhas gravadas por transação na importação de férias em lote
+BULK_VACATION_CHUNK = int(os.getenv("BULK_VACATION_CHUNK", "500"))
+
 @app.post("/employees/vacation/bulk", response_class=JSONResponse)
 async def bulk_schedule_vacation(
     request: Request,
     items: List[BulkVacationItem],
-    session: Session = Depends(get_session)
+    session: AsyncSession = Depends(get_async_session)
 ):
+    """
+    Programação de férias colada do Excel: uma consulta IN para todas as
+    matrículas e, a cada BULK_VACATION_CHUNK linhas, uma transação com UPDATE
+    em lote + períodos + eventos. Com `Accept: application/x-ndjson` o resultado
+    de cada linha é enviado à medida que os blocos são gravados.
+    """
     require_login(request)
-    updated_count = 0
-    errors = []
-    today = datetime.now()
-    for item in items:
-        # Find by Registration ID
-        emp = session.exec(select(models.Employee).where(models.Employee.registration_id == str(item.registration_id))).first()
-        if not emp:
-            errors.append(f"Matrícula {item.registration_id} não encontrada.")
+    registration_ids = {str(item.registration_id).strip() for item in items}
+    employees = {
+        reg_id: [emp_id, emp_status, cost_center]
+        for emp_id, reg_id, emp_status, cost_center in (await session.exec(
+            select(models.Employee.id, models.Employee.registration_id, models.Employee.status, models.Employee.cost_center)
+            .where(col(models.Employee.registration_id).in_(list(registration_ids)))
+        )).all()
+    } if registration_ids else {}
+    
+    # Valida todas as linhas antes de gravar
+    today = datetime.now().date()
+    results = []  # Linhas com erro (não gravadas)
+    rows = []     # Linhas válidas: (nº da linha, matrícula, dados para persistence.schedule_vacations)
+    for line, item in enumerate(items, 1):
+        reg_id = str(item.registration_id).strip()
+        employee = employees.get(reg_id)
+        if not employee:
+            results.append({"row": line, "registration_id": reg_id, "ok": False, "error": f"Matrícula {reg_id} não encontrada."})
             continue
-            
         try:
-            # Flexible Date Parsing? No, frontend should standardize to YYYY-MM-DD
             v_start = datetime.strptime(item.start_date, "%Y-%m-%d")
             v_end = datetime.strptime(item.end_date, "%Y-%m-%d")
-            
-            emp.vacation_start = v_start
-            emp.vacation_end = v_end
-            
-            # Status Check
-            check_start = v_start.replace(hour=0, minute=0, second=0, microsecond=0)
-            check_end = v_end.replace(hour=23, minute=59, second=59, microsecond=999)
-            
-            if check_start <= today <= check_end:
-                emp.status = 'vacation'
-            else:
-                if emp.status == 'vacation':
-                    emp.status = 'active'
-                    
-            # Create History Event
-            hist_event = models.Event(
-                employee_id=emp.id,
-                type="ferias_hist",
-                text=f"Férias Agendadas: {item.start_date} a {item.end_date}",
-                category="pessoas",
-                sector=emp.cost_center or "Geral",
-                timestamp=datetime.now()
-            )
-            session.add(hist_event)
-            
-            session.add(emp)
-            updated_count += 1
-            
         except ValueError:
-            errors.append(f"Data inválida para matrícula {item.registration_id}")
+            results.append({"row": line, "registration_id": reg_id, "ok": False, "error": f"Data inválida para matrícula {reg_id}"})
+            continue
+        if v_start > v_end:
+            results.append({"row": line, "registration_id": reg_id, "ok": False, "error": f"Início depois do fim para matrícula {reg_id}"})
+            continue
+        
+        # Mesmo critério do job de férias: em férias se o período cobre hoje
+        emp_id, emp_status, cost_center = employee
+        if v_start.date() <= today <= v_end.date():
+            emp_status = 'vacation'
+        elif emp_status == 'vacation':
+            emp_status = 'active'
+        employee[1] = emp_status  # Matrícula repetida na colagem parte do status já calculado
+        rows.append((line, reg_id, {
+            "employee_id": emp_id,
+            "vacation_start": v_start,
+            "vacation_end": v_end,
+            "status": emp_status,
+            "sector": cost_center
+        }))
+    
+    chunks = [rows[i:i + BULK_VACATION_CHUNK] for i in range(0, len(rows), BULK_VACATION_CHUNK)]
+    
+    async def save_chunk(db: AsyncSession, chunk: list) -> list:
+        try:
+            await persistence.schedule_vacations(db, [data for _, _, data in chunk])
+            await db.commit()
+            return [{"row": line, "registration_id": reg_id, "ok": True} for line, reg_id, _ in chunk]
         except Exception as e:
-            errors.append(f"Erro ao processar matrícula {item.registration_id}: {str(e)}")
+            await db.rollback()
+            logger.exception("Erro ao gravar bloco de férias")
+            return [{"row": line, "registration_id": reg_id, "ok": False, "error": f"Erro ao processar matrícula {reg_id}: {e}"} for line, reg_id, _ in chunk]
+    
+    def summary(all_results: list) -> dict:
+        errors = [r["error"] for r in all_results if not r["ok"]]
+        message = f"{sum(1 for r in all_results if r['ok'])} colaboradores atualizados/agendados."
+        if errors:
+            message += f" Erros: {'; '.join(errors)}"
+        return {"message": message, "errors": errors}
+    
+    if "application/x-ndjson" in request.headers.get("accept", ""):
+        def ndjson(records: list) -> str:
+            return "".join(json.dumps(record, ensure_ascii=False) + "\n" for record in records)
+        
+        async def stream():
+            # Sessão própria: o stream continua depois que o endpoint retorna
+            sent = list(results)
+            yield ndjson([{"type": "row", **r} for r in results] + [{"type": "progress", "done": len(results), "total": len(items)}])
+            async with async_session_maker() as db:
+                for chunk in chunks:
+                    saved = await save_chunk(db, chunk)
+                    sent.extend(saved)
+                    yield ndjson([{"type": "row", **r} for r in saved] + [{"type": "progress", "done": len(sent), "total": len(items)}])
+            yield ndjson([{"type": "summary", "total": len(items), **summary(sent)}])
+        return StreamingResponse(stream(), media_type="application/x-ndjson")
+    
+    for chunk in chunks:
+        results.extend(await save_chunk(session, chunk))
+    return JSONResponse(summary(results))
+async def sync_attendance_events(op_date: date_type, attendance_log: dict):
+    """Pós-commit de /routine/update: faltas/atestados/afastamentos viram eventos (sessão própria)"""
+    try:
+        async with async_session_maker() as session:
+            await persistence.sync_attendance_events(session, op_date, attendance_log)
+            await session.commit()
+    except Exception:
+        logger.exception(f"Falha ao sincronizar eventos de presença ({op_date})")
+
 
-    session.commit()
-    msg = f"{updated_count} colaboradores atualizados/agendados."
-    if errors:
-        msg += f" Erros: {'; '.join(errors)}"
-    
-    return JSONResponse({"message": msg, "errors": errors})
 @app.post("/routine/update", response_class=JSONResponse)
 async def update_routine(
     request: Request,
     data: DailyRoutineUpdate,
-    session: Session = Depends(get_session)
+    background_tasks: BackgroundTasks,
+    session: AsyncSession = Depends(get_async_session)
 ):
     require_login(request)
+    op_date = parse_op_date(data.date)
     try:
-        daily = session.exec(
-            select(models.DailyOperation)
-            .where(models.DailyOperation.date == data.date)
+        daily_id = (await session.exec(
+            select(models.DailyOperation.id)
+            .where(models.DailyOperation.date == op_date)
             .where(models.DailyOperation.shift == data.shift)
-        ).first()
-        if not daily:
-            daily = models.DailyOperation(date=data.date, shift=data.shift)
+        )).first()
+        if daily_id is None:
+            # Criada uma vez por dia/turno; o id volta na resposta
+            daily = models.DailyOperation(date=op_date, shift=data.shift)
             session.add(daily)
-            
-        # Update Log Fields
-        if data.attendance_log is not None:
-            daily.attendance_log = data.attendance_log
-        if data.tonnage is not None:
-            daily.tonnage = data.tonnage
-        if data.arrival_time is not None:
-            daily.arrival_time = data.arrival_time
-        if data.exit_time is not None:
-            daily.exit_time = data.exit_time
-        if data.report is not None:
-            daily.report = data.report
-        if data.rating is not None:
-            daily.rating = data.rating
-        if data.status is not None:
-            daily.status = data.status
-        if data.logs is not None:
-            daily.logs = data.logs
-            
-        # [NEW] Sync Absences to Events
-        # We process the attendance_log to find 'absent' or 'sick'
-        if data.attendance_log:
-             try:
-                op_date_dt = datetime.strptime(data.date, "%Y-%m-%d")
-                
-                # Fetch employees map
-                all_ids = [str(k) for k in data.attendance_log.keys()]
-                # Optimization: Only fetch relevant employees later if needed, or query all
-                # For now, simplistic approach:
-                
-                for reg_id, entry in data.attendance_log.items():
-                    status = entry.get('status')
-                    if status in ['absent', 'sick', 'away']:
-                        # Check if event already exists for this day/emp
-                        # We need the employee ID (int) not just registration_id (str)
-                        # So we might need to fetch the employee object
-                        emp = session.exec(select(models.Employee).where(models.Employee.registration_id == str(reg_id))).first()
-                        if emp:
-                            evt_type = "falta"
-                            if status == 'sick': evt_type = "atestado"
-                            elif status == 'away': evt_type = "afastamento"
-                            
-                            # Check existence
-                            existing = session.exec(select(models.Event).where(
-                                models.Event.employee_id == emp.id, 
-                                models.Event.type == evt_type
-                            ).where(col(models.Event.timestamp) >= op_date_dt).where(col(models.Event.timestamp) < op_date_dt + timedelta(days=1))).first()
-                            
-                            if not existing:
-                                # Create
-                                evt_text = f"Registro: {status.upper()} em {data.date}"
-                                new_event = models.Event(
-                                    timestamp=datetime.now(), # Logged NOW, but text refers to date
-                                    text=evt_text,
-                                    type=evt_type,
-                                    category="pessoas",
-                                    sector=emp.cost_center or "Geral",
-                                    impact="medium",
-                                    employee_id=emp.id
-                                )
-                                session.add(new_event)
-             except Exception as e_sync:
-                 print(f"Error syncing events: {e_sync}")
-            
-        daily.updated_at = datetime.now()
+            await session.commit()
+            daily_id = daily.id
+        
+        # Campos do dia e presença (tabela Attendance) vão para o buffer de escrita e são
+        # gravados em lote (write_buffer.py)
+        fields = {
+            name: value for name, value in (
+                ("tonnage", data.tonnage),
+                ("arrival_time", data.arrival_time),
+                ("exit_time", data.exit_time),
+                ("report", data.report),
+                ("rating", data.rating),
+                ("status", data.status),
+            ) if value is not None
+        }
+        await write_buffer.stage_daily(op_date, data.shift, fields, attendance_log=data.attendance_log)
+        if data.logs:
+            # Histórico (OperationLog) reenviado por clientes antigos: grava na hora só o que é novo
+            if await persistence.append_resent_operation_logs(session, daily_id, data.logs):
+                await session.commit()
+        if data.status == "closed":
+            # Fechamento do turno: grava já e prepara o mesmo turno no dia seguinte
+            await write_buffer.flush(op_date, data.shift)
+            if not write_buffer.version(op_date, data.shift):
+                background_tasks.add_task(rollover_shift, op_date + timedelta(days=1), data.shift)
         
         # Save Sector Config
         if data.sector_config:
-            config_entry = session.exec(select(models.SectorConfiguration).where(models.SectorConfiguration.shift_name == data.shift)).first()
+            config_entry = (await session.exec(select(models.SectorConfiguration).where(models.SectorConfiguration.shift_name == data.shift))).first()
             if not config_entry:
                 config_entry = models.SectorConfiguration(shift_name=data.shift, config_json=data.sector_config)
                 session.add(config_entry)
@@ -883,14 +828,78 @@ async def update_routine(
                 config_entry.config_json = data.sector_config
                 config_entry.updated_at = datetime.now()
                 session.add(config_entry)
+            await session.commit()
         
-        session.commit()
-        session.refresh(daily)
-        return JSONResponse({"message": "Routine updated successfully", "id": daily.id})
+        # Eventos de falta/atestado/afastamento depois da resposta, fora do caminho do autosave
+        if data.attendance_log:
+            background_tasks.add_task(sync_attendance_events, op_date, data.attendance_log)
+        return JSONResponse({"message": "Routine updated successfully", "id": daily_id})
+    except WriteBufferUnavailable as e:
+        # Gravações anteriores do dia/turno ainda falhando: o cliente reenvia depois
+        await session.rollback()
+        return JSONResponse({"error": str(e)}, status_code=503)
     except Exception as e:
         print(f"Error updating routine: {e}")
+        await session.rollback()
         return JSONResponse({"error": str(e)}, status_code=500)
 
+class OperationLogEntry(BaseModel):
+    kind: str = "snapshot"
+    ts: Optional[str] = None
+    payload: Optional[dict] = None
+class OperationLogAppend(BaseModel):
+    date: str
+    shift: str
+    entries: List[OperationLogEntry]
+
+@app.post("/api/smart-flow/operation-log", response_class=JSONResponse)
+async def append_operation_log(
+    request: Request,
+    data: OperationLogAppend,
+    session: AsyncSession = Depends(get_async_session)
+):
+    """Acrescenta entradas ao histórico do dia/turno (as anteriores não são reenviadas)"""
+    require_login(request)
+    op_date = parse_op_date(data.date)
+    daily = (await session.exec(
+        select(models.DailyOperation)
+        .where(models.DailyOperation.date == op_date)
+        .where(models.DailyOperation.shift == data.shift)
+    )).first()
+    if not daily:
+        daily = models.DailyOperation(date=op_date, shift=data.shift)
+        session.add(daily)
+        await session.flush()
+    appended = await persistence.append_operation_logs(
+        session, daily.id, [{"kind": e.kind, "ts": e.ts, "payload": e.payload} for e in data.entries]
+    )
+    await session.commit()
+    return JSONResponse({"success": True, "appended": appended})
+
+@app.get("/api/smart-flow/operation-log", response_class=JSONResponse)
+async def get_operation_log(
+    request: Request,
+    date: str,
+    shift: str = "Manhã",
+    after: int = 0,
+    limit: int = 100,
+    session: AsyncSession = Depends(get_async_session)
+):
+    """Histórico do dia/turno paginado por cursor: `after` = `next_after` da página anterior"""
+    require_login(request)
+    op_date = parse_op_date(date)
+    limit = max(1, min(limit, 500))
+    daily_id = (await session.exec(
+        select(models.DailyOperation.id)
+        .where(models.DailyOperation.date == op_date)
+        .where(models.DailyOperation.shift == shift)
+    )).first()
+    rows = (await session.exec(persistence.operation_log_page_query(daily_id, after, limit))).all() if daily_id else []
+    return JSONResponse({
+        "entries": [{"id": row.id, "ts": row.ts.isoformat(), "kind": row.kind, "payload": row.payload} for row in rows],
+        "next_after": rows[-1].id if len(rows) == limit else None,
+    })
+
 # --- Employees API ---
 
 @app.get("/api/employees", response_class=JSONResponse)
@@ -898,13 +907,20 @@ async def get_all_employees(request: Request, session: Session = Depends(get_ses
     """Retorna todos os colaboradores (incluindo demitidos, mas excluindo substituídos)"""
     require_login(request)
     
+    # GET condicional: contagem + max(id) + max(updated_at) mudam a cada inclusão/edição/exclusão
+    version = session.exec(persistence.employees_version_query()).one()
+    etag = make_etag("employees", *version)
+    cached = not_modified(request, etag)
+    if cached:
+        return cached
+    
     # Buscar TODOS os colaboradores não substituídos
     employees = session.exec(
         select(models.Employee)
         .where(models.Employee.replaced_by.is_(None))  # Excluir substituídos
     ).all()
     
-    return {
+    return JSONResponse({
         "employees": [{
             "id": e.id,
             "registration_id": e.registration_id,
@@ -913,49 +929,67 @@ async def get_all_employees(request: Request, session: Session = Depends(get_ses
             "shift": e.work_shift,
             "status": e.status
         } for e in employees]
-    }
+    }, headers=conditional_headers(etag))
+
+@app.get("/api/employees/status", response_class=JSONResponse)
+async def get_employee_statuses(request: Request, date: str, session: Session = Depends(get_read_session)):
+    """Status de cada colaborador em uma data ({employee_id: status}); dias passados vêm do histórico"""
+    require_login(request)
+    op_date = parse_op_date(date)
+    # Só leitura: o memo é gravado pelo job status_snapshot (scheduler.py)
+    statuses = employee_status.status_as_of(session, op_date, memoize=False)
+    return {"date": op_date.isoformat(), "statuses": statuses}
 
 # --- Smart Flow Hierarchical API Endpoints ---
 
+async def load_sector_tree(session: AsyncSession, shift: str) -> list:
+    """Setores do turno com sub-setores em uma única consulta (LEFT JOIN)"""
+    rows = (await session.exec(
+        select(models.Sector, models.SubSector)
+        .outerjoin(models.SubSector, models.SubSector.sector_id == models.Sector.id)
+        .where(models.Sector.shift == shift)
+        .order_by(models.Sector.order, models.Sector.id, models.SubSector.order, models.SubSector.id)
+    )).all()
+    
+    tree = {}  # sector_id -> dict (mantém a ordem da consulta)
+    for sector, sub in rows:
+        node = tree.get(sector.id)
+        if node is None:
+            node = tree[sector.id] = {
+                "id": sector.id,
+                "name": sector.name,
+                "max_employees": sector.max_employees,
+                "color": sector.color,
+                "icon": sector.icon,
+                "order": sector.order,
+                "subsectors": []
+            }
+        if sub is not None:
+            node["subsectors"].append({
+                "id": sub.id,
+                "name": sub.name,
+                "max_employees": sub.max_employees,
+                "order": sub.order
+            })
+    return list(tree.values())
+
 @app.get("/api/smart-flow/sectors", response_class=JSONResponse)
 async def get_sectors(
     request: Request,
     shift: str = "Manhã",
-    session: Session = Depends(get_session)
+    session: AsyncSession = Depends(get_async_session)
 ):
-    """Retorna todos os setores e sub-setores de um turno"""
+    """Retorna todos os setores e sub-setores de um turno (cache por turno + ETag)"""
     require_login(request)
     
-    sectors = session.exec(
-        select(models.Sector)
-        .where(models.Sector.shift == shift)
-        .order_by(models.Sector.order)
-    ).all()
-    
-    result = []
-    for sector in sectors:
-        subsectors = session.exec(
-            select(models.SubSector)
-            .where(models.SubSector.sector_id == sector.id)
-            .order_by(models.SubSector.order)
-        ).all()
-        
-        result.append({
-            "id": sector.id,
-            "name": sector.name,
-            "max_employees": sector.max_employees,
-            "color": sector.color,
-            "icon": sector.icon,
-            "order": sector.order,
-            "subsectors": [{
-                "id": sub.id,
-                "name": sub.name,
-                "max_employees": sub.max_employees,
-                "order": sub.order
-            } for sub in subsectors]
-        })
+    cached = sector_tree_cache.get(shift)
+    if cached:
+        sectors, etag = cached
+    else:
+        sectors = await load_sector_tree(session, shift)
+        etag = sector_tree_cache.set(shift, sectors)
     
-    return {"sectors": result}
+    return not_modified(request, etag) or JSONResponse({"sectors": sectors}, headers=conditional_headers(etag))
 
 @app.post("/api/smart-flow/sectors", response_class=JSONResponse)
 async def create_sector(
@@ -989,6 +1023,7 @@ async def create_sector(
     session.add(new_sector)
     session.commit()
     session.refresh(new_sector)
+    sector_tree_cache.invalidate()
     
     return {"success": True, "sector": {"id": new_sector.id, "name": new_sector.name}}
 
@@ -1018,6 +1053,7 @@ async def update_sector(
     sector.updated_at = datetime.now()
     session.add(sector)
     session.commit()
+    sector_tree_cache.invalidate()
     
     return {"success": True}
 
@@ -1037,6 +1073,7 @@ async def delete_sector(
     # Cascade delete vai remover sub-setores e alocações automaticamente
     session.delete(sector)
     session.commit()
+    sector_tree_cache.invalidate()
     
     return {"success": True}
 
@@ -1074,6 +1111,7 @@ async def create_subsector(
     session.add(new_subsector)
     session.commit()
     session.refresh(new_subsector)
+    sector_tree_cache.invalidate()
     
     return {"success": True, "subsector": {"id": new_subsector.id, "name": new_subsector.name}}
 
@@ -1099,6 +1137,7 @@ async def update_subsector(
     
     session.add(subsector)
     session.commit()
+    sector_tree_cache.invalidate()
     
     return {"success": True}
 
@@ -1118,6 +1157,7 @@ async def delete_subsector(
     # Cascade delete vai remover alocações automaticamente
     session.delete(subsector)
     session.commit()
+    sector_tree_cache.invalidate()
     
     return {"success": True}
 
@@ -1126,113 +1166,35 @@ async def get_allocations(
     request: Request,
     date: str,
     shift: str,
-    session: Session = Depends(get_session)
+    session: AsyncSession = Depends(get_async_session)
 ):
-    """Retorna alocações e rotinas do dia/turno"""
+    """
+    Retorna alocações e rotinas do dia/turno. A cópia do dia anterior é feita no
+    fechamento do turno (rollover, ver scheduler.py); se ainda não foi, o primeiro acesso a faz.
+    """
     require_login(request)
-    
-    # Buscar alocações do dia atual
-    allocations = session.exec(
+    op_date = parse_op_date(date)
+    
+    # GET condicional: 1 consulta de versão; se o cliente já tem essa versão, 304
+    version = (await session.exec(persistence.allocations_version_query(op_date, shift))).one()
+    if not version[0] and not write_buffer.version(op_date, shift) and await rollover_on_first_load(op_date, shift):
+        # Dia/turno sem escala e rollover do turno ainda não feito: copiada do dia anterior
+        version = (await session.exec(persistence.allocations_version_query(op_date, shift))).one()
+    etag = make_etag("alloc", op_date.isoformat(), shift, *version, write_buffer.version(op_date, shift))
+    cached = not_modified(request, etag)
+    if cached:
+        return cached
+    
+    allocations = (await session.exec(
         select(models.EmployeeAllocation)
-        .where(models.EmployeeAllocation.date == date)
+        .where(models.EmployeeAllocation.date == op_date)
         .where(models.EmployeeAllocation.shift == shift)
-    ).all()
-    
-    # Se não houver alocações, buscar do dia anterior
-    if not allocations:
-        from datetime import datetime, timedelta
-        try:
-            current_date = datetime.strptime(date, "%Y-%m-%d")
-            previous_date = current_date - timedelta(days=1)
-            previous_date_str = previous_date.strftime("%Y-%m-%d")
-            
-            print(f"📋 Nenhuma alocação encontrada para {date}. Buscando escala de {previous_date_str}...")
-            
-            # Buscar alocações do dia anterior
-            previous_allocations = session.exec(
-                select(models.EmployeeAllocation)
-                .where(models.EmployeeAllocation.date == previous_date_str)
-                .where(models.EmployeeAllocation.shift == shift)
-            ).all()
-            
-            if previous_allocations:
-                print(f"✅ Encontradas {len(previous_allocations)} alocações do dia anterior. Copiando...")
-                
-                # Copiar alocações do dia anterior para o dia atual
-                for prev_alloc in previous_allocations:
-                    new_alloc = models.EmployeeAllocation(
-                        date=date,
-                        shift=shift,
-                        employee_id=prev_alloc.employee_id,
-                        subsector_id=prev_alloc.subsector_id
-                    )
-                    session.add(new_alloc)
-                
-                session.commit()
-                
-                # Recarregar alocações criadas
-                allocations = session.exec(
-                    select(models.EmployeeAllocation)
-                    .where(models.EmployeeAllocation.date == date)
-                    .where(models.EmployeeAllocation.shift == shift)
-                ).all()
-                
-                print(f"✅ Escala copiada com sucesso! {len(allocations)} colaboradores alocados.")
-        except Exception as e:
-            print(f"❌ Erro ao copiar escala do dia anterior: {e}")
-    
-    # Buscar rotinas do dia atual
-    routines = session.exec(
+    )).all()
+    routines = (await session.exec(
         select(models.EmployeeRoutine)
-        .where(models.EmployeeRoutine.date == date)
+        .where(models.EmployeeRoutine.date == op_date)
         .where(models.EmployeeRoutine.shift == shift)
-    ).all()
-    
-    # Se não houver rotinas, copiar do dia anterior (especialmente Férias e Afastado)
-    if not routines and allocations:
-        from datetime import datetime, timedelta
-        try:
-            current_date = datetime.strptime(date, "%Y-%m-%d")
-            previous_date = current_date - timedelta(days=1)
-            previous_date_str = previous_date.strftime("%Y-%m-%d")
-            
-            print(f"📋 Buscando rotinas de {previous_date_str}...")
-            
-            # Buscar rotinas do dia anterior
-            previous_routines = session.exec(
-                select(models.EmployeeRoutine)
-                .where(models.EmployeeRoutine.date == previous_date_str)
-                .where(models.EmployeeRoutine.shift == shift)
-            ).all()
-            
-            if previous_routines:
-                # Copiar apenas rotinas persistentes (vacation, away, sick)
-                persistent_routines = ['vacation', 'away', 'sick']
-                copied_count = 0
-                
-                for prev_routine in previous_routines:
-                    if prev_routine.routine in persistent_routines:
-                        new_routine = models.EmployeeRoutine(
-                            date=date,
-                            shift=shift,
-                            employee_id=prev_routine.employee_id,
-                            routine=prev_routine.routine
-                        )
-                        session.add(new_routine)
-                        copied_count += 1
-                
-                if copied_count > 0:
-                    session.commit()
-                    print(f"✅ {copied_count} rotinas persistentes copiadas (Férias/Afastado/Atestado)")
-                    
-                    # Recarregar rotinas
-                    routines = session.exec(
-                        select(models.EmployeeRoutine)
-                        .where(models.EmployeeRoutine.date == date)
-                        .where(models.EmployeeRoutine.shift == shift)
-                    ).all()
-        except Exception as e:
-            print(f"❌ Erro ao copiar rotinas: {e}")
+    )).all()
     
     # Montar resposta - APENAS subsector_id, não objeto completo
     allocations_map = {}
@@ -1243,15 +1205,196 @@ async def get_allocations(
     for routine in routines:
         routines_map[routine.employee_id] = routine.routine
     
-    return {
+    # Autosaves ainda no buffer de escrita
+    allocations_map, routines_map = write_buffer.overlay(op_date, shift, allocations_map, routines_map)
+    
+    return JSONResponse({
         "allocations": allocations_map,
         "routines": routines_map
-    }
+    }, headers=conditional_headers(etag))
+
+@app.get("/api/smart-flow/bootstrap", response_class=JSONResponse)
+async def smart_flow_bootstrap(
+    request: Request,
+    date: Optional[str] = None,
+    shift: str = "Manhã",
+    session: AsyncSession = Depends(get_async_session)
+):
+    """
+    Tudo que a tela do Smart Flow precisa em uma resposta: árvore de setores,
+    alocações, rotinas, versão da lista de colaboradores (/api/roster) e
+    entradas dos KPIs. Uma consulta de versão decide o 304; sem cache são mais
+    2 consultas (setores vêm do cache).
+    """
+    require_login(request)
+    op_date = parse_op_date(date) if date else datetime.now().date()
+    
+    cached_sectors = sector_tree_cache.get(shift)
+    if cached_sectors:
+        sectors, sectors_etag = cached_sectors
+    else:
+        sectors = await load_sector_tree(session, shift)
+        sectors_etag = sector_tree_cache.set(shift, sectors)
+    
+    Route = models.Route
+    employees_version = persistence.employees_version_query().selected_columns
+    version_query = persistence.allocations_version_query(op_date, shift).add_columns(
+        *employees_version,
+        select(func.coalesce(func.sum(Route.tonnage), 0.0)).where(Route.date == op_date).where(Route.shift == shift).scalar_subquery(),
+        select(models.DailyOperation.tonnage).where(models.DailyOperation.date == op_date).where(models.DailyOperation.shift == shift).limit(1).scalar_subquery(),
+        select(models.HeadcountTarget.target_value).where(models.HeadcountTarget.shift_name == shift).limit(1).scalar_subquery(),
+    )
+    version = (await session.exec(version_query)).one()
+    if not version[0] and not write_buffer.version(op_date, shift) and await rollover_on_first_load(op_date, shift):
+        # Dia/turno sem escala e rollover do turno ainda não feito: copiada do dia anterior
+        version = (await session.exec(version_query)).one()
+    etag = make_etag("bootstrap", op_date.isoformat(), shift, sectors_etag, *version, write_buffer.version(op_date, shift))
+    cached = not_modified(request, etag)
+    if cached:
+        return cached
+    routes_tonnage, manual_tonnage, target_hr = version[-3:]
+    manual_tonnage = write_buffer.daily_fields(op_date, shift).get("tonnage", manual_tonnage)
+    roster_v = roster_version(version[-3 - len(employees_version):-3])
+    
+    allocations = (await session.exec(
+        select(models.EmployeeAllocation.employee_id, models.EmployeeAllocation.subsector_id)
+        .where(models.EmployeeAllocation.date == op_date)
+        .where(models.EmployeeAllocation.shift == shift)
+    )).all()
+    routines = (await session.exec(
+        select(models.EmployeeRoutine.employee_id, models.EmployeeRoutine.routine)
+        .where(models.EmployeeRoutine.date == op_date)
+        .where(models.EmployeeRoutine.shift == shift)
+    )).all()
+    allocations, routines = write_buffer.overlay(op_date, shift, dict(allocations), dict(routines))
+    return JSONResponse({
+        "date": op_date.isoformat(),
+        "shift": shift,
+        "sectors": sectors,
+        "allocations": allocations,
+        "routines": routines,
+        # Colaboradores: GET /api/roster?v=<roster_version> (cache imutável no navegador)
+        "roster_version": roster_v,
+        "kpi": {
+            # Tonelagem manual do dia tem prioridade sobre a soma das rotas
+            "tonnage": manual_tonnage if manual_tonnage else routes_tonnage,
+            "manual_tonnage": manual_tonnage or 0,
+            "routes_tonnage": routes_tonnage,
+            "target_hr": target_hr or 0
+        }
+    }, headers=conditional_headers(etag))
+
+def roster_version(employees_version) -> str:
+    """Identificador da lista de colaboradores a partir de persistence.employees_version_query()"""
+    return make_etag("roster", *employees_version).strip('"')
+
+@app.get("/api/roster")
+async def get_roster(
+    request: Request,
+    v: Optional[str] = None,
+    session: AsyncSession = Depends(get_async_session)
+):
+    """
+    Lista de colaboradores (projeção) como recurso versionado. A URL com a
+    versão atual é imutável: o navegador guarda e só baixa de novo quando
+    um colaborador é incluído/editado/excluído (a versão muda).
+    """
+    require_login(request)
+    version = roster_version((await session.exec(persistence.employees_version_query())).one())
+    if v != version:
+        # Versão ausente ou antiga: aponta para a URL da versão atual
+        return RedirectResponse(f"/api/roster?v={version}", status_code=307, headers={"Cache-Control": "no-store"})
+    
+    etag = f'"{version}"'
+    headers = {"ETag": etag, "Cache-Control": "private, max-age=31536000, immutable"}
+    if not_modified(request, etag):
+        return Response(status_code=304, headers=headers)
+    
+    cached = roster_cache.get(version)
+    if cached:
+        body = cached[0]
+    else:
+        Employee = models.Employee
+        rows = (await session.exec(
+            select(Employee.id, Employee.registration_id, Employee.name, Employee.role,
+                   Employee.work_shift, Employee.status, Employee.replaced_by)
+            .order_by(Employee.name)
+        )).all()
+        body = json.dumps({
+            "version": version,
+            "employees": [{
+                "id": emp_id,
+                "registration_id": registration_id,
+                "name": name,
+                "role": role,
+                "shift": work_shift,
+                "status": status,
+                # Substituído = já tem um colaborador no lugar (replaced_by)
+                "is_substituted": replaced_by is not None
+            } for emp_id, registration_id, name, role, work_shift, status, replaced_by in rows]
+        }, ensure_ascii=False).encode("utf-8")
+        # Só a versão atual fica em memória
+        roster_cache.invalidate()
+        roster_cache.set(version, body)
+    return Response(body, media_type="application/json", headers=headers)
+
+async def publish_event(channel: str, message: dict):
+    """Publica no broker de tempo real; falha aqui não derruba a gravação"""
+    try:
+        await broker.publish(channel, message)
+    except Exception:
+        logger.exception(f"Falha ao publicar evento em tempo real ({channel})")
+
+async def publish_allocations(request: Request, op_date: date_type, shift: str, allocations: dict, routines: dict, replace: bool = False):
+    """
+    Delta de alocações/rotinas para as abas no mesmo dia/turno. `null` remove;
+    replace=True substitui o mapa de alocações inteiro. `origin` (X-Client-Id)
+    permite que a aba que gravou ignore o próprio eco.
+    """
+    await publish_event(day_channel(op_date, shift), {
+        "type": "allocations",
+        "origin": request.headers.get("x-client-id"),
+        "replace": replace,
+        "allocations": allocations,
+        "routines": routines
+    })
+
+# Heartbeat do SSE (mantém a conexão aberta em proxies e detecta abas fechadas)
+SSE_HEARTBEAT_SECONDS = 15
+# Cada stream é encerrado após esse tempo e o EventSource reconecta sozinho
+# (conexões não ficam presas para sempre em deploys/restarts)
+SSE_MAX_STREAM_SECONDS = int(os.getenv("SSE_MAX_STREAM_SECONDS", "300"))
+
+@app.get("/api/smart-flow/stream")
+async def smart_flow_stream(request: Request, date: str, shift: str):
+    """Server-Sent Events com as mudanças de alocação/rotina do dia/turno"""
+    require_login(request)
+    op_date = parse_op_date(date)
+    channels = (day_channel(op_date, shift), shift_channel(shift))
+    
+    async def events():
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + SSE_MAX_STREAM_SECONDS
+        async with broker.subscribe(*channels) as queue:
+            yield "retry: 3000\n\n"
+            while not await request.is_disconnected() and loop.time() < deadline:
+                try:
+                    timeout = min(SSE_HEARTBEAT_SECONDS, max(deadline - loop.time(), 0))
+                    message = await asyncio.wait_for(queue.get(), timeout=timeout)
+                except asyncio.TimeoutError:
+                    yield ": ping\n\n"
+                    continue
+                yield f"event: {message.get('type', 'message')}\ndata: {json.dumps(message, default=str)}\n\n"
+    
+    return StreamingResponse(events(), media_type="text/event-stream", headers={
+        "Cache-Control": "no-cache",
+        "X-Accel-Buffering": "no"  # nginx: não bufferizar o stream
+    })
 
 @app.post("/api/smart-flow/allocations/save", response_class=JSONResponse)
 async def save_allocations(
     request: Request,
-    session: Session = Depends(get_session)
+    session: AsyncSession = Depends(get_async_session)
 ):
     """Salva alocações e rotinas do dia"""
     require_login(request)
@@ -1272,197 +1415,130 @@ async def save_allocations(
         if not date or not shift:
             print("❌ Data ou turno não fornecidos")
             return JSONResponse({"error": "Data e turno são obrigatórios"}, status_code=400)
+        try:
+            date = parse_op_date(date)
+        except HTTPException as e:
+            return JSONResponse({"error": e.detail}, status_code=400)
         
-        # 1. Limpar alocações antigas do dia/turno
-        old_allocations = session.exec(
-            select(models.EmployeeAllocation)
-            .where(models.EmployeeAllocation.date == date)
-            .where(models.EmployeeAllocation.shift == shift)
-        ).all()
-        
-        print(f"🗑️ Removendo {len(old_allocations)} alocações antigas")
-        for alloc in old_allocations:
-            session.delete(alloc)
-        
-        # 2. Criar novas alocações
-        print(f"📝 Criando {len(allocations)} novas alocações...")
-        for emp_id, subsector_id in allocations.items():
-            try:
-                emp_id_int = int(emp_id)
-                subsector_id_int = int(subsector_id)
-                
-                print(f"  - Validando emp_id={emp_id_int}, subsector_id={subsector_id_int}")
-                
-                # Validar se employee existe
-                employee = session.get(models.Employee, emp_id_int)
-                if not employee:
-                    print(f"  ❌ Employee {emp_id_int} não encontrado no banco!")
-                    continue  # Pular este colaborador
-                
-                # Validar se subsector existe
-                subsector = session.get(models.SubSector, subsector_id_int)
-                if not subsector:
-                    print(f"  ❌ SubSector {subsector_id_int} não encontrado no banco!")
-                    continue  # Pular este sub-setor
-                
-                print(f"  ✅ Criando alocação para {employee.name} em {subsector.name}")
-                new_alloc = models.EmployeeAllocation(
-                    date=date,
-                    shift=shift,
-                    employee_id=emp_id_int,
-                    subsector_id=subsector_id_int
-                )
-                session.add(new_alloc)
-            except Exception as e:
-                print(f"❌ Erro ao criar alocação para emp_id={emp_id}, subsector_id={subsector_id}: {e}")
-                import traceback
-                traceback.print_exc()
-                raise
-        
-        # 3. Atualizar rotinas
-        print(f"📝 Criando/atualizando {len(routines)} rotinas...")
-        for emp_id, routine in routines.items():
-            try:
-                emp_id_int = int(emp_id)
-                print(f"  - Rotina emp_id={emp_id_int}, routine={routine}")
-                
-                # Validar se employee existe
-                employee = session.get(models.Employee, emp_id_int)
-                if not employee:
-                    print(f"  ❌ Employee {emp_id_int} não encontrado para rotina!")
-                    continue
-                
-                existing = session.exec(
-                    select(models.EmployeeRoutine)
-                    .where(models.EmployeeRoutine.date == date)
-                    .where(models.EmployeeRoutine.shift == shift)
-                    .where(models.EmployeeRoutine.employee_id == emp_id_int)
-                ).first()
-                
-                if existing:
-                    print(f"    Atualizando rotina existente id={existing.id}")
-                    existing.routine = routine
-                    existing.updated_at = datetime.now()
-                    session.add(existing)
-                else:
-                    print(f"    Criando nova rotina")
-                    new_routine = models.EmployeeRoutine(
-                        date=date,
-                        shift=shift,
-                        employee_id=emp_id_int,
-                        routine=routine
-                    )
-                    session.add(new_routine)
-            except Exception as e:
-                print(f"❌ Erro ao criar rotina para emp_id={emp_id}: {e}")
-                import traceback
-                traceback.print_exc()
-                raise
-        
-        # 4. SINCRONIZAR com DailyOperation.attendance_log (para compatibilidade com relatório)
-        print("🔄 Sincronizando com DailyOperation.attendance_log...")
-        
-        # Buscar ou criar DailyOperation
-        daily_op = session.exec(
-            select(models.DailyOperation)
-            .where(models.DailyOperation.date == date)
-            .where(models.DailyOperation.shift == shift)
-        ).first()
-        
-        if not daily_op:
-            print("  📝 Criando novo DailyOperation")
-            daily_op = models.DailyOperation(
-                date=date,
-                shift=shift,
-                attendance_log={}
-            )
-            session.add(daily_op)
-        
-        # Construir attendance_log a partir das alocações e rotinas
-        attendance_log = {}
-        
-        # Buscar todas as alocações recém-salvas
-        allocations_db = session.exec(
-            select(models.EmployeeAllocation)
-            .where(models.EmployeeAllocation.date == date)
-            .where(models.EmployeeAllocation.shift == shift)
-        ).all()
-        
-        # Buscar todas as rotinas recém-salvas
-        routines_db = session.exec(
-            select(models.EmployeeRoutine)
-            .where(models.EmployeeRoutine.date == date)
-            .where(models.EmployeeRoutine.shift == shift)
-        ).all()
-        
-        # Mapear rotinas por employee_id
-        routines_map = {r.employee_id: r.routine for r in routines_db}
-        
-        print(f"  📊 Processando {len(allocations_db)} alocações...")
-        
-        # Construir log
-        for alloc in allocations_db:
-            employee = session.get(models.Employee, alloc.employee_id)
-            if not employee:
-                print(f"  ⚠️ Employee {alloc.employee_id} não encontrado")
-                continue
-            
-            # Buscar sub-setor e setor pai
-            subsector = session.get(models.SubSector, alloc.subsector_id)
-            if not subsector:
-                print(f"  ⚠️ SubSector {alloc.subsector_id} não encontrado")
-                continue
-            
-            
-            sector = session.get(models.Sector, subsector.sector_id)
-            if not sector:
-                print(f"  ⚠️ Sector {subsector.sector_id} não encontrado")
-                continue
-            
-            
-            # Normalizar nome do setor: sempre remover acentos e espaços
-            import unicodedata
-            sector_name_original = sector.name
-            sector_name_normalized = unicodedata.normalize('NFD', sector.name.lower().strip())
-            sector_key = sector_name_normalized.encode('ascii', 'ignore').decode('utf-8')
-            sector_key = sector_key.replace(' ', '_')
-            print(f"  🔧 Normalizando setor: '{sector_name_original}' → '{sector_key}'")
-            
-            # Status da rotina ou 'present' como padrão
-            status = routines_map.get(alloc.employee_id, 'present')
-            
-            # IMPORTANTE: Usar registration_id como chave (não employee_id)
-            reg_id_str = str(employee.registration_id)
-            attendance_log[reg_id_str] = {
-                "status": status,
-                "sector": sector_key
-            }
-            
-            print(f"  ✅ {employee.name} ({reg_id_str}) → {sector_key} [{status}]")
+        try:
+            allocations = {int(k): int(v) for k, v in allocations.items()}
+            routines = {int(k): v for k, v in routines.items()}
+        except (TypeError, ValueError) as e:
+            logger.warning(f"IDs inválidos no payload de alocações: {e}")
+            return JSONResponse({"error": "Payload inválido"}, status_code=400)
+        
+        # 1. Validar em conjunto: 1 IN para colaboradores + 1 JOIN SubSector→Sector
+        employee_ids = set(allocations) | set(routines)
+        known_employees = set((await session.exec(
+            select(models.Employee.id).where(col(models.Employee.id).in_(employee_ids))
+        )).all()) if employee_ids else set()
+        subsector_ids = set(allocations.values())
+        sector_by_subsector = dict((await session.exec(
+            select(models.SubSector.id, models.Sector.name)
+            .join(models.Sector, models.Sector.id == models.SubSector.sector_id)
+            .where(col(models.SubSector.id).in_(subsector_ids))
+        )).all()) if subsector_ids else {}
+        
+        valid_allocations = {
+            emp_id: subsector_id for emp_id, subsector_id in allocations.items()
+            if emp_id in known_employees and subsector_id in sector_by_subsector
+        }
+        valid_routines = {emp_id: routine for emp_id, routine in routines.items() if emp_id in known_employees}
         
-        # Atualizar DailyOperation
-        daily_op.attendance_log = attendance_log
-        session.add(daily_op)
+        ignored = len(allocations) - len(valid_allocations)
+        logger.debug(f"{len(valid_allocations)} alocações válidas ({ignored} ignoradas), {len(valid_routines)} rotinas válidas")
         
-        print(f"✅ Attendance log atualizado com {len(attendance_log)} colaboradores")
+        # 2. Alocações (substituídas), rotinas e presença: buffer de escrita, gravadas
+        #    em lote a cada WRITE_BUFFER_FLUSH_SECONDS (write_buffer.py)
+        await write_buffer.stage_allocations(date, shift, valid_allocations, valid_routines, replace=True)
         
-        print("💾 Fazendo commit...")
-        session.commit()
-        print("✅ Alocações, rotinas e relatório sincronizados com sucesso")
+        # Avisar as outras abas do mesmo dia/turno (alocações substituídas, rotinas mescladas)
+        await publish_allocations(request, date, shift, valid_allocations, valid_routines, replace=True)
         
         return {"success": True, "message": "Alocações e rotinas salvas com sucesso"}
+    except WriteBufferUnavailable as e:
+        await session.rollback()
+        return JSONResponse({"error": str(e), "success": False}, status_code=503)
     except Exception as e:
         print(f"❌ ERRO GERAL ao salvar alocações: {e}")
         import traceback
         traceback.print_exc()
-        session.rollback()
+        await session.rollback()
+        return JSONResponse({"error": str(e), "success": False}, status_code=500)
+
+
+@app.patch("/api/smart-flow/allocations", response_class=JSONResponse)
+async def patch_allocations(
+    request: Request,
+    session: AsyncSession = Depends(get_async_session)
+):
+    """
+    Aplica só as mudanças do Smart Flow (em vez de regravar o turno inteiro).
+    Payload: {date, shift, allocations: {employee_id: subsector_id | null},
+    routines: {employee_id: routine | null}} - null remove o registro.
+    """
+    require_login(request)
+    
+    data = await request.json()
+    date = data.get("date")
+    shift = data.get("shift")
+    if not date or not shift:
+        return JSONResponse({"error": "Data e turno são obrigatórios"}, status_code=400)
+    try:
+        date = parse_op_date(date)
+        allocations = {int(k): (int(v) if v is not None else None) for k, v in (data.get("allocations") or {}).items()}
+        routines = {int(k): v for k, v in (data.get("routines") or {}).items()}
+    except HTTPException as e:
+        return JSONResponse({"error": e.detail}, status_code=400)
+    except (TypeError, ValueError, AttributeError):
+        return JSONResponse({"error": "Payload inválido"}, status_code=400)
+    
+    try:
+        # Validação em conjunto: colaboradores e sub-setores citados no patch
+        employee_ids = set(allocations) | set(routines)
+        known_employees = set((await session.exec(
+            select(models.Employee.id).where(col(models.Employee.id).in_(employee_ids))
+        )).all()) if employee_ids else set()
+        subsector_ids = {v for v in allocations.values() if v is not None}
+        known_subsectors = set((await session.exec(
+            select(models.SubSector.id).where(col(models.SubSector.id).in_(subsector_ids))
+        )).all()) if subsector_ids else set()
+        
+        skipped = sorted(employee_ids - known_employees)
+        to_allocate = {e: sub for e, sub in allocations.items() if sub is not None and e in known_employees and sub in known_subsectors}
+        to_unallocate = [e for e, sub in allocations.items() if sub is None]
+        to_set_routine = {e: r for e, r in routines.items() if r is not None and e in known_employees}
+        to_clear_routine = [e for e, r in routines.items() if r is None]
+        skipped += sorted(e for e, sub in allocations.items() if sub is not None and e in known_employees and sub not in known_subsectors)
+        
+        # Gravação via buffer de escrita (mescla os autosaves do dia/turno; presença recalculada no flush)
+        allocations_delta = {**to_allocate, **dict.fromkeys(to_unallocate)}
+        routines_delta = {**to_set_routine, **dict.fromkeys(to_clear_routine)}
+        await write_buffer.stage_allocations(date, shift, allocations_delta, routines_delta)
+        await publish_allocations(request, date, shift, allocations_delta, routines_delta)
+        return {
+            "success": True,
+            "applied": {
+                "allocations": len(to_allocate),
+                "unallocated": len(to_unallocate),
+                "routines": len(to_set_routine),
+                "routines_cleared": len(to_clear_routine),
+            },
+            "skipped": skipped
+        }
+    except WriteBufferUnavailable as e:
+        await session.rollback()
+        return JSONResponse({"error": str(e), "success": False}, status_code=503)
+    except Exception as e:
+        logger.exception("Erro ao aplicar patch de alocações")
+        await session.rollback()
         return JSONResponse({"error": str(e), "success": False}, status_code=500)
 
 
 @app.post("/api/employees/vacation", response_class=JSONResponse)
 async def set_employee_vacation(
     request: Request,
-    session: Session = Depends(get_session)
+    session: AsyncSession = Depends(get_async_session)
 ):
     """Define férias de um colaborador"""
     require_login(request)
@@ -1477,7 +1553,7 @@ async def set_employee_vacation(
             return JSONResponse({"error": "Dados incompletos"}, status_code=400)
         
         # Buscar colaborador
-        employee = session.get(models.Employee, int(employee_id))
+        employee = await session.get(models.Employee, int(employee_id))
         if not employee:
             return JSONResponse({"error": "Colaborador não encontrado"}, status_code=404)
         
@@ -1502,22 +1578,28 @@ async def set_employee_vacation(
             employee_id=employee_id
         )
         session.add(event)
+        await persistence.upsert_absence_periods(session, [{
+            "employee_id": employee.id,
+            "kind": "vacation",
+            "start_date": start_date.date(),
+            "end_date": end_date.date()
+        }])
         
-        session.commit()
+        await session.commit()
         
         print(f"✅ Férias definidas: {employee.name} - {vacation_start} até {vacation_end}")
         
         return {"success": True, "message": "Férias definidas com sucesso"}
     except Exception as e:
         print(f"❌ Erro ao definir férias: {e}")
-        session.rollback()
+        await session.rollback()
         return JSONResponse({"error": str(e)}, status_code=500)
 
 
 @app.post("/api/employees/routine", response_class=JSONResponse)
 async def set_employee_routine(
     request: Request,
-    session: Session = Depends(get_session)
+    session: AsyncSession = Depends(get_async_session)
 ):
     """Define rotina de um colaborador"""
     require_login(request)
@@ -1531,23 +1613,14 @@ async def set_employee_routine(
             return JSONResponse({"error": "Dados incompletos"}, status_code=400)
         
         # Buscar colaborador
-        employee = session.get(models.Employee, int(employee_id))
+        employee = await session.get(models.Employee, int(employee_id))
         if not employee:
             return JSONResponse({"error": "Colaborador não encontrado"}, status_code=404)
         
         old_status = employee.status
         
         # Mapear rotina para status
-        status_map = {
-            'present': 'active',
-            'vacation': 'vacation',
-            'sick': 'sick',
-            'away': 'away',
-            'absent': 'absent',
-            'dayoff': 'dayoff'
-        }
-        
-        new_status = status_map.get(routine, 'active')
+        new_status = persistence.ROUTINE_STATUS.get(routine, 'active')
         
         # Atualizar colaborador
         employee.status = new_status
@@ -1557,6 +1630,15 @@ async def set_employee_routine(
             employee.vacation_start = None
             employee.vacation_end = None
         
+        # Períodos de ausência: encerra os em curso de outro tipo e abre o novo (em aberto)
+        today = datetime.now().date()
+        if routine in persistence.ABSENCE_KINDS:
+            await persistence.end_absence_periods(session, employee.id, [k for k in persistence.ABSENCE_KINDS if k != routine], today)
+            await persistence.open_absence_period(session, employee.id, routine, today, note="rotina")
+        else:
+            # Presente também cancela férias agendadas (como os campos acima)
+            await persistence.end_absence_periods(session, employee.id, persistence.ABSENCE_KINDS, today, drop_future=(routine == 'present'))
+        
         # Labels em português
         routine_labels = {
             'present': 'Presente',
@@ -1576,14 +1658,20 @@ async def set_employee_routine(
         )
         session.add(event)
         
-        session.commit()
+        await session.commit()
         
         print(f"✅ Rotina atualizada: {employee.name} - {routine}")
+        await publish_event(shift_channel(employee.work_shift), {
+            "type": "employee",
+            "origin": request.headers.get("x-client-id"),
+            "employee_id": employee.id,
+            "status": new_status
+        })
         
         return {"success": True, "message": "Rotina atualizada com sucesso"}
     except Exception as e:
         print(f"❌ Erro ao atualizar rotina: {e}")
-        session.rollback()
+        await session.rollback()
         return JSONResponse({"error": str(e)}, status_code=500)
 
 # --- Report Route ---
@@ -1593,22 +1681,22 @@ async def routine_report(
     request: Request,
     date: str,
     shift: str,
-    session: Session = Depends(get_session)
+    session: Session = Depends(get_read_session)
 ):
     user = require_login(request)
+    op_date = parse_op_date(date)
     try:
         # 1. Fetch Daily Operation
         daily_op = session.exec(
             select(models.DailyOperation)
-            .where(models.DailyOperation.date == date)
+            .where(models.DailyOperation.date == op_date)
             .where(models.DailyOperation.shift == shift)
         ).first()
         
-        # 2. Fetch Employees (Active + those in log even if fired/changed)
-        # For simplicity, we fetch all non-fired first, then we might need to handle historical
-        # The log uses registration_id as key.
+        # 2. Fetch Employees (birthdays, contracts and substitution KPIs)
         all_employees = session.exec(select(models.Employee)).all()
-        emp_map = {str(e.registration_id): e for e in all_employees}
+        # Status de cada colaborador NA DATA do relatório (não o atual); réplica: só lê o memo
+        statuses = employee_status.status_as_of(session, op_date, memoize=False)
         
         # 3. Fetch Sector Config (Targets)
         sector_config_db = session.exec(select(models.SectorConfiguration).where(models.SectorConfiguration.shift_name == shift)).first()
@@ -1637,48 +1725,61 @@ async def routine_report(
         # 4. Build Snapshot Data
         
         # Initial State
-        log = daily_op.attendance_log if daily_op and daily_op.attendance_log else {}
-        tonnage = daily_op.tonnage if daily_op and daily_op.tonnage else 0.0
-        
-        # Prepare People List for Report
-        people_list = []
+        tonnage = write_buffer.daily_fields(op_date, shift).get("tonnage", daily_op.tonnage if daily_op else None) or 0.0
         
-        # IMPORTANTE: Iterar apenas sobre colaboradores no attendance_log (alocados)
+        # IMPORTANTE: Considerar apenas colaboradores com presença no dia (alocados)
         # Não mostrar TODOS os colaboradores do turno, apenas os alocados no Smart Flow
-        
-        # Helper to get daily entry
-        def get_daily_status(reg_id):
-            return log.get(str(reg_id), {})
-            
-        total_present = 0
-        
-        # Iterar sobre o attendance_log (apenas colaboradores alocados)
-        for reg_id_str, entry in log.items():
-            # Buscar colaborador por registration_id
-            employee = emp_map.get(reg_id_str)
-            if not employee:
-                print(f"⚠️ Colaborador com matrícula {reg_id_str} não encontrado no banco")
-                continue
+        counts_by_sector = {}  # {sector_key: {status: n}}
+        if write_buffer.version(op_date, shift):
+            # Autosaves ainda no buffer de escrita: presença do banco + pendente
+            employee_by_id = {e.id: e for e in all_employees}
+            attendance_rows = [
+                (employee_by_id[emp_id], entry["sector"], entry["status"])
+                for emp_id, entry in write_buffer.attendance(session, op_date, shift).items()
+                if emp_id in employee_by_id
+            ]
+            for _, sector_key, daily_status in attendance_rows:
+                counts = counts_by_sector.setdefault(sector_key, {})
+                counts[daily_status or 'present'] = counts.get(daily_status or 'present', 0) + 1
+        else:
+            attendance_rows = session.exec(
+                select(models.Employee, models.Attendance.sector_key, models.Attendance.status)
+                .join(models.Attendance, models.Attendance.employee_id == models.Employee.id)
+                .where(models.Attendance.date == op_date)
+                .where(models.Attendance.shift == shift)
+            ).all()
             
-            # Determine effective status for today
-            daily_status = entry.get('status', 'present')
-            sector_key = entry.get('sector')
+            # Contagens por setor/status direto no banco (índice date+shift+sector_key)
+            for sector_key, daily_status, n in session.exec(
+                select(models.Attendance.sector_key, models.Attendance.status, func.count())
+                .where(models.Attendance.date == op_date)
+                .where(models.Attendance.shift == shift)
+                .group_by(models.Attendance.sector_key, models.Attendance.status)
+            ).all():
+                counts_by_sector.setdefault(sector_key, {})[daily_status or 'present'] = n
+        
+        def count_status(counts, statuses):
+            return sum(counts.get(st, 0) for st in statuses)
+        
+        status_totals = {}
+        for counts in counts_by_sector.values():
+            for st, n in counts.items():
+                status_totals[st] = status_totals.get(st, 0) + n
+        total_present = status_totals.get('present', 0)
+        
+        # Colaboradores substituídos: já têm alguém no lugar (replaced_by)
+        substituted_ids = set(session.exec(
+            select(models.Employee.id).where(models.Employee.replaced_by.is_not(None))
+        ).all())
+        
+        # Prepare People List for Report
+        people_list = []
+        for employee, sector_key, daily_status in attendance_rows:
+            daily_status = daily_status or 'present'
             
-            # Count Present
-            if daily_status == 'present':
-                total_present += 1
-                
             # Check if Substituted (Only relevant if Away/Vacation?)
             # User said: "destacar que ele ja foi subistiuido, somente com a rotina de afastado"
-            # So we check if there's a "Substituído por" event for this employee
-            is_substituted = False
-            if daily_status in ['away', 'vacation']:
-                 has_sub_evt = session.exec(select(models.Event).where(
-                    models.Event.employee_id == employee.id,
-                    models.Event.text.like("%Substituído por%")
-                 )).first()
-                 if has_sub_evt:
-                     is_substituted = True
+            is_substituted = daily_status in ['away', 'vacation'] and employee.id in substituted_ids
 
             people_list.append({
                 "name": employee.name,
@@ -1687,24 +1788,14 @@ async def routine_report(
                 "is_substituted": is_substituted
             })
         
-        # DEBUG: Mostrar setores únicos presentes no attendance_log
-        unique_sectors = set(p['sector_daily'] for p in people_list if p['sector_daily'])
-        print(f"🔍 DEBUG - Setores no attendance_log: {unique_sectors}")
+        # DEBUG: Mostrar setores únicos presentes na presença do dia
+        unique_sectors = set(k for k in counts_by_sector if k)
+        print(f"🔍 DEBUG - Setores na presença do dia: {unique_sectors}")
         print(f"🔍 DEBUG - Total de colaboradores: {len(people_list)}")
             
         # Substituted Count (Employees 'Away' who have a replacement OR Active employees who are replacements?)
-        # User said "reminding that it can only pull this information from the away routine when creating a new employee"
         # Interpreted as: Count of Away employees who have been substituted.
-        # Logic: Find 'away' employees. Check if they have an event "Substituído por..."
-        count_substitutions = 0
-        away_employees = [e for e in all_employees if e.status == 'away']
-        for emp in away_employees:
-            has_sub = session.exec(select(models.Event).where(
-                models.Event.employee_id == emp.id,
-                models.Event.text.like("%Substituído por%")
-            )).first()
-            if has_sub:
-                count_substitutions += 1
+        count_substitutions = len([e for e in all_employees if statuses.get(e.id) == 'away' and e.id in substituted_ids])
                 
         # Build Sectors Detailed
         sectors_detailed = []
@@ -1715,63 +1806,57 @@ async def routine_report(
             key = sec.get('key')
             target = int(sec.get('target', 0))
             
-            # Find people allocated to this sector
-            allocated_people = [p for p in people_list if p['sector_daily'] == key]
+            counts = counts_by_sector.get(key, {})
+            allocated_count = sum(counts.values())
             
             # IMPORTANTE: Pular setores sem colaboradores alocados
-            if len(allocated_people) == 0:
+            if allocated_count == 0:
                 continue
             
             # Adicionar target ao total apenas se setor tiver colaboradores
             total_target += target
             
-            # Counts per sector
-            present_people = [p for p in allocated_people if p['status_daily'] == 'present']
-            absent_people = [p for p in allocated_people if p['status_daily'] in ['absent', 'sick']]
-            vacation_away_people = [p for p in allocated_people if p['status_daily'] in ['vacation', 'away']]
+            present_count = counts.get('present', 0)
             
-            # Vagas: Target - Active Allocated? Or just Target - Present?
-            # User dashboard usually shows "Vagas" as empty spots. 
-            # If target=14 and allocated=13, vacancies=1. 
-            # If target=14, allocated=14, present=10 -> gap=4.
-            # Usually Vagas = Target - Allocated (Open positions).
+            # Vagas = Target - Allocated (Open positions).
             # Gap = Target - Present (Operational gap).
-            vacancies = max(0, target - len(allocated_people))
-            gap = max(0, target - len(present_people))
+            vacancies = max(0, target - allocated_count)
+            gap = max(0, target - present_count)
             
             sectors_detailed.append({
                 "label": sec.get('label'),
                 "target": target,
-                "allocated_count": len(allocated_people),
-                "present_count": len(present_people),
+                "allocated_count": allocated_count,
+                "present_count": present_count,
                 "vacancies": vacancies, # Vagas
-                "absences": len(absent_people), # Faltas/Atestados
-                "vacation_away": len(vacation_away_people), # Férias/Afastados
+                "absences": count_status(counts, ['absent', 'sick']), # Faltas/Atestados
+                "vacation_away": count_status(counts, ['vacation', 'away']), # Férias/Afastados
                 "gap": gap
             })
-            total_allocated_sum += len(allocated_people)
+            total_allocated_sum += allocated_count
             
         # Catch Unallocated (Present but not in a sector)
-        # We need to know which people were already counted in sectors
         mapped_sector_keys = [s.get('key') for s in SECTORS]
+        others = {}
+        for key, counts in counts_by_sector.items():
+            if key in mapped_sector_keys:
+                continue
+            for st, n in counts.items():
+                others[st] = others.get(st, 0) + n
+        others_allocated = sum(others.values())
         
-        others_allocated = [p for p in people_list if p['sector_daily'] not in mapped_sector_keys]
-        others_present = [p for p in others_allocated if p['status_daily'] == 'present']
-        others_absent = [p for p in others_allocated if p['status_daily'] in ['absent', 'sick']]
-        others_vac_away = [p for p in others_allocated if p['status_daily'] in ['vacation', 'away']]
-        
-        if others_present or others_allocated:
+        if others_allocated:
             sectors_detailed.append({
                 "label": "Outros / Não Definido",
                 "target": 0,
-                "allocated_count": len(others_allocated),
-                "present_count": len(others_present),
+                "allocated_count": others_allocated,
+                "present_count": others.get('present', 0),
                 "vacancies": 0,
-                "absences": len(others_absent),
-                "vacation_away": len(others_vac_away),
+                "absences": count_status(others, ['absent', 'sick']),
+                "vacation_away": count_status(others, ['vacation', 'away']),
                 "gap": 0
             })
-            total_allocated_sum += len(others_allocated)
+            total_allocated_sum += others_allocated
             
         # Top KPIs - ALINHADO COM SMART FLOW
         # Total target = TODOS os colaboradores do turno (não apenas soma de metas)
@@ -1781,11 +1866,11 @@ async def routine_report(
             .where(col(models.Employee.work_shift).ilike(f"%{shift}%"))
         ).all()
         
-        # Total target = colaboradores ativos do turno
-        total_target_real = len([e for e in all_shift_employees if e.status != 'fired'])
+        # Total target = colaboradores ativos do turno na data (admitidos e não demitidos)
+        total_target_real = len([e for e in all_shift_employees if statuses.get(e.id) not in (None, 'fired')])
         
-        # Vagas = colaboradores demitidos do turno
-        total_vacancies_real = len([e for e in all_shift_employees if e.status == 'fired'])
+        # Vagas = colaboradores demitidos do turno até a data
+        total_vacancies_real = len([e for e in all_shift_employees if statuses.get(e.id) == 'fired'])
         
         total_gap = sum(s['gap'] for s in sectors_detailed)
         total_vacancies = sum(s['vacancies'] for s in sectors_detailed)
@@ -1794,11 +1879,11 @@ async def routine_report(
         present_pct = int((total_present / total_target_real * 100)) if total_target_real > 0 else 0
         
         # Detailed Counts - SEPARADOS (não combinados)
-        daily_absent = len([p for p in people_list if p['status_daily'] == 'absent'])
-        daily_sick = len([p for p in people_list if p['status_daily'] == 'sick'])
-        daily_vacation = len([p for p in people_list if p['status_daily'] == 'vacation'])
-        daily_away = len([p for p in people_list if p['status_daily'] == 'away'])
-        daily_dayoff = len([p for p in people_list if p['status_daily'] == 'dayoff'])
+        daily_absent = status_totals.get('absent', 0)
+        daily_sick = status_totals.get('sick', 0)
+        daily_vacation = status_totals.get('vacation', 0)
+        daily_away = status_totals.get('away', 0)
+        daily_dayoff = status_totals.get('dayoff', 0)
         
         snapshot = {
             "kpis": {
@@ -1823,7 +1908,7 @@ async def routine_report(
         }
         
         # Extras for Insights
-        params_date = datetime.strptime(date, "%Y-%m-%d").date()
+        params_date = op_date
         
         # Pre-filter lists for Report (Avoid Jinja complexity)
         absences = [p for p in people_list if p['status_daily'] in ['absent', 'sick']]
@@ -1898,7 +1983,7 @@ async def routine_report(
 
         return templates.TemplateResponse("report_pdf.html", {
             "request": request,
-            "date": datetime.strptime(date, "%Y-%m-%d").strftime("%d/%m/%Y"),
+            "date": op_date.strftime("%d/%m/%Y"),
             "shift": shift,
             "generated_at": datetime.now().strftime("%d/%m/%Y %H:%M"),
             "snapshot": snapshot,
@@ -1925,8 +2010,7 @@ async def employees_page(request: Request, session: Session = Depends(get_sessio
     except Exception:
         return HTMLResponse(content=f"<h1>Debug 500</h1><pre>{traceback.format_exc()}</pre>", status_code=500)
 async def _employees_page_impl(request: Request, session: Session):
-    # Auto-update statuses based on today's date
-    update_vacation_statuses(session, datetime.now())
+    # Início/fim de férias é aplicado pelo job agendado (scheduler.vacation_transitions)
     # user = require_login(request)
     user = "debug_admin"
         # Fetch Employees (excluindo substituídos)
@@ -2078,6 +2162,8 @@ async def add_employee(
     try:
         session.add(new_employee)
         session.flush() # Flush to get ID if needed, though we just need to commit later
+        # Admitido no passado (ou sem data): entra no status histórico já memoizado
+        employee_status.invalidate_snapshots(session, admission_dt.date() if admission_dt else date_type.min)
         
         # Substitution Logic
         if is_substitution and replaced_employee_id:
@@ -2181,19 +2267,19 @@ async def update_employee_status(
     emp_id: int,
     request: Request,
     status_action: str = Form(...), # active, vacation, away, fired, delete
-    session: Session = Depends(get_session)
+    session: AsyncSession = Depends(get_async_session)
 ):
     require_login(request)
-    emp = session.get(models.Employee, emp_id)
+    emp = await session.get(models.Employee, emp_id)
     if emp:
         if status_action == "delete":
-            # Explicitly fetch and unlink events to ensure no FK constraints block deletion
-            stmt = select(models.Event).where(models.Event.employee_id == emp_id)
-            events = session.exec(stmt).all()
-            for event in events:
-                event.employee_id = None
-                session.add(event)
-            session.delete(emp)
+            # Desvincula eventos e remove períodos/memos para nenhuma FK bloquear a exclusão
+            await session.exec(
+                sa_update(models.Event).where(models.Event.employee_id == emp_id).values(employee_id=None)
+            )
+            for model in (models.AbsencePeriod, models.EmployeeStatusSnapshot):
+                await session.exec(sa_delete(model).where(model.employee_id == emp_id))
+            await session.delete(emp)
         else:
             # Generate History Event
             event_type = "ocorrencia"
@@ -2221,7 +2307,19 @@ async def update_employee_status(
             session.add(new_event)
             emp.status = status_action
             session.add(emp)
-        session.commit()
+            
+            # Períodos de ausência e data de demissão (status histórico)
+            today = datetime.now().date()
+            if status_action in persistence.ABSENCE_KINDS:
+                await persistence.end_absence_periods(session, emp.id, [k for k in persistence.ABSENCE_KINDS if k != status_action], today)
+                await persistence.open_absence_period(session, emp.id, status_action, today, note="status")
+            else:
+                await persistence.end_absence_periods(session, emp.id, persistence.ABSENCE_KINDS, today)
+            if status_action == "fired":
+                emp.termination_date = emp.termination_date or datetime.now()
+            elif status_action == "active":
+                emp.termination_date = None
+        await session.commit()
     return RedirectResponse(url="/employees", status_code=status.HTTP_303_SEE_OTHER)
 @app.post("/events/{event_id}/delete")
 async def delete_event(
@@ -2233,6 +2331,9 @@ async def delete_event(
     event = session.get(models.Event, event_id)
     if event:
         emp_id = event.employee_id
+        if event.type in employee_status.STATUS_EVENT_TYPES:
+            # Status histórico muda a partir do dia do evento
+            employee_status.invalidate_snapshots(session, event.day or event.timestamp.date())
         session.delete(event)
         session.commit()
         return RedirectResponse(url=f"/employees/{emp_id}", status_code=status.HTTP_303_SEE_OTHER)
@@ -2249,7 +2350,7 @@ async def update_vacation_event(
     event = session.get(models.Event, event_id)
     if not event or event.type != 'ferias_hist':
         raise HTTPException(status_code=404, detail="Evento de férias não encontrado")
-        emp = session.get(models.Employee, event.employee_id)
+    emp = session.get(models.Employee, event.employee_id)
     if not emp:
         raise HTTPException(status_code=404, detail="Colaborador não encontrado")
     try:
@@ -2262,6 +2363,18 @@ async def update_vacation_event(
         event.text = f"Férias Agendadas: {fmt_start} a {fmt_end}"
         session.add(event)
         
+        # Período de férias reagendado: substitui o anterior e descarta o status histórico afetado
+        old_start = emp.vacation_start.date() if emp.vacation_start else v_start.date()
+        Absence = models.AbsencePeriod
+        session.exec(
+            sa_delete(Absence)
+            .where(Absence.employee_id == emp.id)
+            .where(Absence.kind == "vacation")
+            .where(Absence.start_date.in_([old_start, v_start.date()]))
+        )
+        session.add(Absence(employee_id=emp.id, kind="vacation", start_date=v_start.date(), end_date=v_end.date()))
+        employee_status.invalidate_snapshots(session, min(old_start, v_start.date()))
+        
         emp.vacation_start = v_start
         emp.vacation_end = v_end
         
@@ -2382,8 +2495,13 @@ async def update_employee(
         
         if admission_date:
             try:
-                emp.admission_date = datetime.strptime(admission_date, "%Y-%m-%d")
-            except:
+                new_admission = datetime.strptime(admission_date, "%Y-%m-%d")
+                if new_admission != emp.admission_date:
+                    # Admissão muda quem entra no status histórico desde a menor das duas datas
+                    changed_from = min(d for d in (emp.admission_date, new_admission) if d)
+                    employee_status.invalidate_snapshots(session, changed_from.date())
+                emp.admission_date = new_admission
+            except ValueError:
                 pass
                 
         if birthday:
@@ -2468,6 +2586,7 @@ async def import_employees(
         }
         df = df.rename(columns=column_map)
         count = 0 
+        admissions = []
         for _, row in df.iterrows():
             # Validation
             reg_id = str(row.get("registration_id", ""))
@@ -2521,7 +2640,11 @@ async def import_employees(
                 )
                 session.add(emp)
                 count += 1
+                admissions.append(admission.date() if admission else date_type.min)
                 
+        if admissions:
+            # Novos colaboradores entram no status histórico já memoizado
+            employee_status.invalidate_snapshots(session, min(admissions))
         session.commit()
     except Exception as e:
         print(f"Import Error: {e}")
@@ -2531,7 +2654,7 @@ async def import_employees(
 async def auth_exception_handler(request: Request, exc: HTTPException):
     if exc.status_code == status.HTTP_307_TEMPORARY_REDIRECT:
         return RedirectResponse(url="/login")
-    raise exc
+    return await http_exception_handler(request, exc)
 
 # --- People Intelligence Route ---
 @app.get("/people-intelligence", response_class=HTMLResponse)
@@ -2540,7 +2663,7 @@ async def people_intelligence_page(
     shift: str = "Todos",
     start_date: Optional[str] = None,
     end_date: Optional[str] = None,
-    session: Session = Depends(get_session)
+    session: Session = Depends(get_read_session)
 ):
     user = require_login(request)
     
@@ -2716,7 +2839,7 @@ async def people_intelligence_report(
     shift: str = "Todos",
     start_date: Optional[str] = None,
     end_date: Optional[str] = None,
-    session: Session = Depends(get_session)
+    session: Session = Depends(get_read_session)
 ):
     """Print-ready version of people intelligence (no sidebar)"""
     user = require_login(request)
@@ -2862,8 +2985,19 @@ async def people_intelligence_report(
 @app.get("/smart-flow/load", response_class=JSONResponse)
 async def smart_flow_load(request: Request, shift: str = "Manhã", date: Optional[str] = None, session: Session = Depends(get_session)):
     try:
-        if not date:
-            date = datetime.now().strftime("%Y-%m-%d")
+        op_date = parse_op_date(date) if date else datetime.now().date()
+
+        # GET condicional: versão da presença/DailyOperation + config de setores do turno + buffer
+        version = session.exec(persistence.attendance_version_query(op_date, shift)).one()
+        config_version = session.exec(
+            select(func.count(), func.max(models.SectorConfiguration.updated_at))
+            .where(models.SectorConfiguration.shift_name == shift)
+        ).one()
+        pending_version = write_buffer.version(op_date, shift)
+        etag = make_etag("load", op_date.isoformat(), shift, *version, *config_version, pending_version)
+        cached = not_modified(request, etag)
+        if cached:
+            return cached
 
         # Get Sector Config
         sector_config_db = session.exec(select(models.SectorConfiguration).where(models.SectorConfiguration.shift_name == shift)).first()
@@ -2890,22 +3024,131 @@ async def smart_flow_load(request: Request, shift: str = "Manhã", date: Optiona
         # Get Operation
         daily_op = session.exec(
             select(models.DailyOperation)
-            .where(models.DailyOperation.date == date)
+            .where(models.DailyOperation.date == op_date)
             .where(models.DailyOperation.shift == shift)
         ).first()
 
         employees_log = {}
-        manual_tonnage = 0
-        
-        if daily_op:
-            employees_log = daily_op.attendance_log or {}
-            manual_tonnage = daily_op.tonnage or 0
+        manual_tonnage = daily_op.tonnage if daily_op else 0
+        
+        if pending_version:
+            # Autosaves ainda no buffer de escrita: presença do banco + pendente
+            attendance = write_buffer.attendance(session, op_date, shift)
+            reg_by_id = dict(session.exec(
+                select(models.Employee.id, models.Employee.registration_id).where(models.Employee.id.in_(list(attendance)))
+            ).all()) if attendance else {}
+            employees_log = {
+                str(reg_by_id[emp_id]): entry for emp_id, entry in attendance.items() if emp_id in reg_by_id
+            }
+            manual_tonnage = write_buffer.daily_fields(op_date, shift).get("tonnage", manual_tonnage)
+        elif daily_op:
+            employees_log = persistence.to_attendance_log(
+                session.exec(persistence.attendance_log_query(op_date, shift)).all()
+            )
+        manual_tonnage = manual_tonnage or 0
 
-        return {
+        return JSONResponse({
             "employees_log": employees_log,
             "sector_config": sector_config.get("sectors", []),
             "manual_tonnage": manual_tonnage
-        }
+        }, headers=conditional_headers(etag))
     except Exception as e:
         logger.error(f"Error in smart_flow_load: {e}")
         return JSONResponse(content={"error": str(e)}, status_code=500)
+
+
+# --- Admin / Diagnóstico ---
+
+@app.get("/api/admin/db-pool", response_class=JSONResponse)
+async def db_pool_stats(request: Request):
+    """Estatísticas de checkout/espera dos pools de conexão"""
+    require_login(request)
+    return get_pool_stats()
+
+@app.get("/api/admin/loop-lag", response_class=JSONResponse)
+async def loop_lag_stats(request: Request):
+    """Histograma de lag do event loop e últimos bloqueios detectados"""
+    require_login(request)
+    return loop_monitor.snapshot()
+
+@app.get("/api/admin/cache", response_class=JSONResponse)
+async def cache_stats(request: Request):
+    """Acertos/erros/invalidações dos caches em memória"""
+    require_login(request)
+    return {"sectors": sector_tree_cache.stats(), "roster": roster_cache.stats()}
+
+@app.post("/api/admin/rollover", response_class=JSONResponse)
+async def trigger_rollover(request: Request, date: Optional[str] = None, force: bool = False):
+    """
+    Dispara o rollover (cópia da escala do dia anterior) para `date` (padrão: amanhã),
+    em todos os turnos com escala, fechados ou não. Sem force, não roda de novo um
+    turno já processado (null no resultado).
+    """
+    require_login(request)
+    target = parse_op_date(date) if date else datetime.now().date() + timedelta(days=1)
+    try:
+        result = await rollover_allocations(target, force=force, closed_only=False)
+    except Exception as e:
+        return JSONResponse({"success": False, "error": str(e)}, status_code=500)
+    return {"success": True, "date": target.isoformat(), "shifts": result}
+
+@app.post("/api/admin/vacation-transitions", response_class=JSONResponse)
+async def trigger_vacation_transitions(request: Request, date: Optional[str] = None, force: bool = False):
+    """
+    Aplica início/fim de férias para `date` (padrão: hoje).
+    Sem force, não roda de novo uma data já processada.
+    """
+    require_login(request)
+    target = parse_op_date(date) if date else datetime.now().date()
+    try:
+        result = await vacation_transitions(target, force=force)
+    except Exception as e:
+        return JSONResponse({"success": False, "error": str(e)}, status_code=500)
+    if result is None:
+        return {"success": True, "date": target.isoformat(), "skipped": True, "message": "Transições de férias já aplicadas para esta data (use force=true)"}
+    return {"success": True, "date": target.isoformat(), **result}
+
+@app.post("/api/admin/status-snapshot", response_class=JSONResponse)
+async def trigger_status_snapshot(request: Request, date: Optional[str] = None, force: bool = False):
+    """
+    Grava o status histórico dos colaboradores em `date` (padrão: ontem).
+    Sem force, não roda de novo uma data já processada.
+    """
+    require_login(request)
+    target = parse_op_date(date) if date else datetime.now().date() - timedelta(days=1)
+    try:
+        result = await snapshot_statuses(target, force=force)
+    except Exception as e:
+        return JSONResponse({"success": False, "error": str(e)}, status_code=500)
+    if result is None:
+        return {"success": True, "date": target.isoformat(), "skipped": True, "message": "Snapshot já gravado para esta data (use force=true)"}
+    return {"success": True, "date": target.isoformat(), "statuses": result}
+
+@app.post("/api/admin/status-backfill", response_class=JSONResponse)
+async def trigger_status_backfill(request: Request, days: Optional[int] = None):
+    """Recalcula agora o status histórico dos dias passados sem memo (padrão: STATUS_BACKFILL_DAYS)"""
+    require_login(request)
+    try:
+        filled = await backfill_status_snapshots(days)
+    except Exception as e:
+        return JSONResponse({"success": False, "error": str(e)}, status_code=500)
+    return {"success": True, "filled": filled}
+
+@app.get("/api/admin/write-buffer", response_class=JSONResponse)
+async def write_buffer_stats(request: Request):
+    """Dias/turnos pendentes no buffer de escrita e contadores (requisições x transações)"""
+    require_login(request)
+    return write_buffer.stats()
+
+@app.post("/api/admin/write-buffer/flush", response_class=JSONResponse)
+async def flush_write_buffer(request: Request):
+    """Grava agora tudo que está pendente no buffer de escrita"""
+    require_login(request)
+    await write_buffer.flush_all(force=True)
+    return {"success": True, **write_buffer.stats()}
+
+@app.get("/api/admin/realtime", response_class=JSONResponse)
+async def realtime_stats(request: Request):
+    """Canais/assinantes do broker de tempo real (SSE)"""
+    require_login(request)
+    return broker.stats()
@@ -1,31 +0,0 @@
--- Performance Optimization: Add indexes for frequently queried columns
--- Created: 2026-01-03
--- Impact: 10-15% improvement in query performance
-
--- Índices para Employee (tabela principal)
-CREATE INDEX IF NOT EXISTS idx_employee_registration_id ON employee(registration_id);
-CREATE INDEX IF NOT EXISTS idx_employee_status ON employee(status);
-CREATE INDEX IF NOT EXISTS idx_employee_work_shift ON employee(work_shift);
-CREATE INDEX IF NOT EXISTS idx_employee_cost_center ON employee(cost_center);
-
--- Índices para DailyOperation (queries frequentes por data+turno)
-CREATE INDEX IF NOT EXISTS idx_daily_op_date_shift ON dailyoperation(date, shift);
-CREATE INDEX IF NOT EXISTS idx_daily_op_date ON dailyoperation(date);
-
--- Índices para Event (histórico de colaboradores)
-CREATE INDEX IF NOT EXISTS idx_event_employee_id ON event(employee_id);
-CREATE INDEX IF NOT EXISTS idx_event_timestamp ON event(timestamp);
-CREATE INDEX IF NOT EXISTS idx_event_type ON event(type);
-CREATE INDEX IF NOT EXISTS idx_event_category ON event(category);
-
--- Índices para Route (separação de mercadorias)
-CREATE INDEX IF NOT EXISTS idx_route_date_shift ON route(date, shift);
-CREATE INDEX IF NOT EXISTS idx_route_employee_id ON route(employee_id);
-CREATE INDEX IF NOT EXISTS idx_route_client_id ON route(client_id);
-CREATE INDEX IF NOT EXISTS idx_route_date ON route(date);
-
--- Índices para HeadcountTarget
-CREATE INDEX IF NOT EXISTS idx_headcount_shift_name ON headcounttarget(shift_name);
-
--- Índices para SectorConfiguration
-CREATE INDEX IF NOT EXISTS idx_sector_config_shift_name ON sectorconfiguration(shift_name);
@@ -0,0 +1,427 @@
+"""
+Migrações versionadas do schema.
+
+Cada migração tem um número de versão e é aplicada uma única vez; as versões
+aplicadas ficam registradas na tabela `schema_migration`. Índices são criados
+online (CREATE INDEX CONCURRENTLY no PostgreSQL), sem travar escrita.
+
+Uso:
+    python migrations.py            # Aplica migrações pendentes
+    python migrations.py --status   # Lista versões e índices faltantes
+"""
+import json
+import logging
+import sys
+from datetime import datetime
+
+from sqlalchemy import bindparam, insert, inspect, select, text, update
+from sqlmodel import SQLModel
+
+import models  # também registra as tabelas no metadata
+import persistence
+
+# Filho do logger de main.py (herda o RotatingFileHandler de logs.txt)
+logger = logging.getLogger("main.migrations")
+
+# Lock consultivo para que vários workers não migrem ao mesmo tempo (PostgreSQL)
+MIGRATION_LOCK_ID = 727001
+
+
+# --- Helpers ---
+
+def declared_indexes(table_names=None) -> list:
+    """Índices nomeados declarados nos modelos (Field(index=True) e __table_args__)"""
+    indexes = []
+    for table in SQLModel.metadata.sorted_tables:
+        if table_names and table.name not in table_names:
+            continue
+        indexes.extend(sorted(table.indexes, key=lambda i: i.name))
+    return indexes
+
+
+def _index_ddl(engine, index) -> str:
+    preparer = engine.dialect.identifier_preparer
+    columns = ", ".join(preparer.quote(c.name) for c in index.columns)
+    unique = "UNIQUE " if index.unique else ""
+    concurrently = "CONCURRENTLY " if engine.dialect.name == "postgresql" else ""
+    # Índice parcial (postgresql_where / sqlite_where)
+    where = index.dialect_options[engine.dialect.name].get("where") if engine.dialect.name in ("postgresql", "sqlite") else None
+    predicate = f" WHERE {where.compile(dialect=engine.dialect, compile_kwargs={'literal_binds': True})}" if where is not None else ""
+    return (
+        f"CREATE {unique}INDEX {concurrently}IF NOT EXISTS {preparer.quote(index.name)} "
+        f"ON {preparer.quote(index.table.name)} ({columns}){predicate}"
+    )
+
+
+def _invalid_indexes(engine) -> set:
+    """PostgreSQL: índices que ficaram INVALID após um CREATE INDEX CONCURRENTLY interrompido"""
+    if engine.dialect.name != "postgresql":
+        return set()
+    with engine.connect() as conn:
+        rows = conn.execute(text(
+            "SELECT c.relname FROM pg_index i JOIN pg_class c ON c.oid = i.indexrelid "
+            "WHERE NOT i.indisvalid"
+        )).all()
+    return {r[0] for r in rows}
+
+
+def create_indexes_online(engine, indexes):
+    """Cria índices fora de transação (CONCURRENTLY exige autocommit no PostgreSQL)"""
+    invalid = _invalid_indexes(engine)
+    with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+        for index in indexes:
+            if index.name in invalid:
+                logger.warning(f"Recriando índice inválido {index.name}")
+                conn.execute(text(f"DROP INDEX CONCURRENTLY IF EXISTS {engine.dialect.identifier_preparer.quote(index.name)}"))
+            logger.info(f"Criando índice {index.name} em {index.table.name}")
+            conn.execute(text(_index_ddl(engine, index)))
+
+
+def _indexes_by_name(names) -> list:
+    wanted = set(names)
+    found = [i for i in declared_indexes() if i.name in wanted]
+    missing = wanted - {i.name for i in found}
+    if missing:
+        raise RuntimeError(f"Índices não declarados nos modelos: {sorted(missing)}")
+    return found
+
+
+# --- Migrações ---
+
+def m001_composite_indexes(engine):
+    """Índices compostos declarados em models.py (substitui migration_add_indexes.sql)"""
+    create_indexes_online(engine, _indexes_by_name([
+        "idx_employee_status",
+        "idx_employee_work_shift",
+        "idx_employee_cost_center",
+        "idx_daily_op_date_shift",
+        "idx_event_employee_type_ts",
+        "idx_event_type_ts",
+        "idx_route_date_shift",
+        "idx_route_employee_id",
+        "idx_route_client_id",
+        # idx_allocation_date_shift / idx_routine_date_shift: substituídos pelos únicos da 005
+    ]))
+
+
+# Tabelas diárias cuja coluna `date` passou de texto YYYY-MM-DD para DATE
+DAILY_DATE_TABLES = ("dailyoperation", "route", "employeeallocation", "employeeroutine")
+
+
+def m002_native_date_columns(engine):
+    """
+    Converte `date` das tabelas diárias para DATE.
+    PostgreSQL: ALTER COLUMN ... TYPE DATE (reescreve a tabela; índices são refeitos).
+    SQLite: o tipo Date do SQLAlchemy já grava texto ISO, então só normaliza
+    eventuais datas em DD/MM/YYYY.
+    """
+    existing_tables = set(inspect(engine).get_table_names())
+    tables = [t for t in DAILY_DATE_TABLES if t in existing_tables]
+
+    with engine.begin() as conn:
+        for table in tables:
+            if engine.dialect.name == "postgresql":
+                data_type = conn.execute(text(
+                    "SELECT data_type FROM information_schema.columns "
+                    "WHERE table_schema = current_schema() AND table_name = :t AND column_name = 'date'"
+                ), {"t": table}).scalar()
+                if data_type == "date":
+                    continue
+                logger.info(f"Convertendo {table}.date para DATE")
+                conn.execute(text(
+                    f"ALTER TABLE {table} ALTER COLUMN date TYPE DATE USING "
+                    f"CASE WHEN date ~ '^\\d{{2}}/\\d{{2}}/\\d{{4}}$' THEN to_date(date, 'DD/MM/YYYY') "
+                    f"ELSE date::date END"
+                ))
+            else:
+                conn.execute(text(
+                    f"UPDATE {table} SET date = substr(date, 7, 4) || '-' || substr(date, 4, 2) || '-' || substr(date, 1, 2) "
+                    f"WHERE date LIKE '__/__/____'"
+                ))
+
+
+def m003_attendance_table(engine):
+    """
+    Cria a tabela `attendance` e copia para ela o JSON legado
+    DailyOperation.attendance_log ({matrícula: {"status", "sector"}}).
+    Dias/turnos que já têm linhas em `attendance` são mantidos como estão.
+    """
+    attendance = models.Attendance.__table__
+    daily = models.DailyOperation.__table__
+    employee = models.Employee.__table__
+    attendance.create(engine, checkfirst=True)
+
+    with engine.begin() as conn:
+        id_by_reg = {str(reg): emp_id for reg, emp_id in conn.execute(select(employee.c.registration_id, employee.c.id))}
+        done = {(d, s) for d, s in conn.execute(select(attendance.c.date, attendance.c.shift).distinct())}
+        now = datetime.now()
+        copied = 0
+        for op_date, shift, log in conn.execute(select(daily.c.date, daily.c.shift, daily.c.attendance_log)):
+            if not log or (op_date, shift) in done:
+                continue
+            if isinstance(log, str):
+                log = json.loads(log)
+            rows = [
+                {
+                    "date": op_date,
+                    "shift": shift,
+                    "employee_id": id_by_reg[str(reg_id)],
+                    "sector_key": entry.get("sector"),
+                    "status": entry.get("status") or "present",
+                    "updated_at": now,
+                }
+                for reg_id, entry in log.items()
+                if str(reg_id) in id_by_reg and isinstance(entry, dict)
+            ]
+            if rows:
+                conn.execute(insert(attendance), rows)
+                copied += len(rows)
+            done.add((op_date, shift))
+        logger.info(f"Presença migrada do attendance_log: {copied} linhas")
+
+
+
+def m004_employee_updated_at(engine):
+    """Adiciona employee.updated_at (bancos criados antes da coluna existir no modelo)"""
+    columns = {c["name"] for c in inspect(engine).get_columns("employee")}
+    if "updated_at" in columns:
+        return
+    with engine.begin() as conn:
+        conn.execute(text("ALTER TABLE employee ADD COLUMN updated_at TIMESTAMP"))
+        conn.execute(text("UPDATE employee SET updated_at = CURRENT_TIMESTAMP"))
+
+
+
+# Eventos gerados pela presença diária (deduplicados por colaborador/tipo/dia)
+ATTENDANCE_EVENT_TYPES = ("falta", "atestado", "afastamento")
+
+
+def m005_daily_unique_keys(engine):
+    """
+    Chave única (date, shift, employee_id) em alocações e rotinas (mantém a
+    linha mais recente de cada duplicata) e event.day com índice único parcial
+    (employee_id, type, day) para os eventos de presença.
+    """
+    preparer = engine.dialect.identifier_preparer
+    columns = {c["name"] for c in inspect(engine).get_columns("event")}
+    day_expr = "CAST(timestamp AS DATE)" if engine.dialect.name == "postgresql" else "date(timestamp)"
+    types = ", ".join(f"'{t}'" for t in ATTENDANCE_EVENT_TYPES)
+
+    with engine.begin() as conn:
+        for table in ("employeeallocation", "employeeroutine"):
+            removed = conn.execute(text(
+                f"DELETE FROM {table} WHERE id NOT IN "
+                f"(SELECT MAX(id) FROM {table} GROUP BY date, shift, employee_id)"
+            )).rowcount
+            if removed:
+                logger.info(f"{table}: {removed} linhas duplicadas removidas")
+
+        if "day" not in columns:
+            conn.execute(text("ALTER TABLE event ADD COLUMN day DATE"))
+        # Só o primeiro evento de cada (colaborador, tipo, dia) recebe `day`; os demais ficam como histórico
+        conn.execute(text(
+            f"UPDATE event SET day = {day_expr} WHERE day IS NULL AND id IN ("
+            f"SELECT MIN(id) FROM event WHERE type IN ({types}) AND employee_id IS NOT NULL "
+            f"GROUP BY employee_id, type, {day_expr})"
+        ))
+
+    create_indexes_online(engine, _indexes_by_name([
+        "uq_allocation_day_employee",
+        "uq_routine_day_employee",
+        "uq_event_employee_type_day",
+    ]))
+
+    # Os únicos começam por (date, shift): os índices simples antigos ficaram redundantes
+    concurrently = "CONCURRENTLY " if engine.dialect.name == "postgresql" else ""
+    with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+        for name in ("idx_allocation_date_shift", "idx_routine_date_shift"):
+            conn.execute(text(f"DROP INDEX {concurrently}IF EXISTS {preparer.quote(name)}"))
+
+
+def m006_absence_periods(engine):
+    """
+    Cria `absenceperiod` e copia para ela o período de férias de cada colaborador
+    (employee.vacation_start/vacation_end). Quem está hoje em afastamento/atestado
+    ganha um período em aberto a partir de hoje (a data de início real não existe).
+    """
+    absence = models.AbsencePeriod.__table__
+    absence.create(engine, checkfirst=True)
+    if engine.dialect.name == "postgresql":
+        start, end = "CAST(e.vacation_start AS DATE)", "CAST(e.vacation_end AS DATE)"
+    else:
+        start, end = "date(e.vacation_start)", "date(e.vacation_end)"
+    columns = "employee_id, kind, start_date, end_date, note, created_at, updated_at"
+
+    with engine.begin() as conn:
+        vacations = conn.execute(text(
+            f"INSERT INTO absenceperiod ({columns}) "
+            f"SELECT e.id, 'vacation', {start}, {end}, 'migração', CURRENT_TIMESTAMP, CURRENT_TIMESTAMP "
+            f"FROM employee e WHERE e.vacation_start IS NOT NULL AND e.vacation_end IS NOT NULL "
+            f"AND NOT EXISTS (SELECT 1 FROM absenceperiod a WHERE a.employee_id = e.id "
+            f"AND a.kind = 'vacation' AND a.start_date = {start})"
+        )).rowcount
+        ongoing = conn.execute(text(
+            f"INSERT INTO absenceperiod ({columns}) "
+            f"SELECT e.id, e.status, CURRENT_DATE, NULL, 'migração', CURRENT_TIMESTAMP, CURRENT_TIMESTAMP "
+            f"FROM employee e WHERE e.status IN ('away', 'sick') "
+            f"AND NOT EXISTS (SELECT 1 FROM absenceperiod a WHERE a.employee_id = e.id AND a.kind = e.status)"
+        )).rowcount
+    logger.info(f"Períodos de ausência migrados: {vacations} férias, {ongoing} em aberto")
+
+
+def m007_status_snapshots(engine):
+    """Cria `employeestatussnapshot` (status histórico memoizado por dia; preenchido sob demanda)"""
+    models.EmployeeStatusSnapshot.__table__.create(engine, checkfirst=True)
+
+
+def m008_operation_log(engine):
+    """
+    Cria `operationlog` e move para ela o JSON DailyOperation.logs (uma linha por
+    item, na ordem da lista); a coluna legada fica vazia.
+    """
+    operation_log = models.OperationLog.__table__
+    daily = models.DailyOperation.__table__
+    operation_log.create(engine, checkfirst=True)
+
+    with engine.begin() as conn:
+        copied = 0
+        for daily_id, logs, updated_at in conn.execute(select(daily.c.id, daily.c.logs, daily.c.updated_at)):
+            if isinstance(logs, str):
+                logs = json.loads(logs)
+            if not logs:
+                continue
+            rows = persistence.operation_log_rows(daily_id, logs, default_ts=updated_at)
+            conn.execute(insert(operation_log), rows)
+            conn.execute(update(daily).where(daily.c.id == daily_id).values(logs=[]))
+            copied += len(rows)
+        logger.info(f"Histórico migrado de DailyOperation.logs: {copied} linhas")
+
+
+def m009_operation_log_hash(engine):
+    """Adiciona operationlog.entry_hash e preenche nas linhas existentes (dedupe por conteúdo)"""
+    operation_log = models.OperationLog.__table__
+    columns = {c["name"] for c in inspect(engine).get_columns("operationlog")}
+    with engine.begin() as conn:
+        if "entry_hash" not in columns:
+            conn.execute(text("ALTER TABLE operationlog ADD COLUMN entry_hash VARCHAR(40)"))
+        pending = conn.execute(
+            select(operation_log.c.id, operation_log.c.kind, operation_log.c.payload)
+            .where(operation_log.c.entry_hash.is_(None))
+        ).all()
+        hashes = [
+            {"row_id": row_id, "hash": persistence.operation_log_hash(kind, json.loads(payload) if isinstance(payload, str) else payload)}
+            for row_id, kind, payload in pending
+        ]
+        if hashes:
+            conn.execute(
+                update(operation_log).where(operation_log.c.id == bindparam("row_id")).values(entry_hash=bindparam("hash")),
+                hashes,
+            )
+        logger.info(f"entry_hash preenchido em {len(hashes)} linhas do histórico")
+
+
+MIGRATIONS = [
+    (1, "composite_indexes", m001_composite_indexes),
+    (2, "native_date_columns", m002_native_date_columns),
+    (3, "attendance_table", m003_attendance_table),
+    (4, "employee_updated_at", m004_employee_updated_at),
+    (5, "daily_unique_keys", m005_daily_unique_keys),
+    (6, "absence_periods", m006_absence_periods),
+    (7, "status_snapshots", m007_status_snapshots),
+    (8, "operation_log", m008_operation_log),
+    (9, "operation_log_hash", m009_operation_log_hash),
+]
+
+
+# --- Runner ---
+
+def _ensure_migration_table(engine):
+    with engine.begin() as conn:
+        conn.execute(text(
+            "CREATE TABLE IF NOT EXISTS schema_migration ("
+            "version INTEGER PRIMARY KEY, "
+            "name VARCHAR(200) NOT NULL, "
+            "applied_at TIMESTAMP NOT NULL)"
+        ))
+
+
+def applied_versions(engine) -> set:
+    _ensure_migration_table(engine)
+    with engine.connect() as conn:
+        return {row[0] for row in conn.execute(text("SELECT version FROM schema_migration"))}
+
+
+def run_migrations(engine) -> list:
+    """Aplica as migrações pendentes em ordem. Retorna as versões aplicadas."""
+    _ensure_migration_table(engine)
+    lock_conn = None
+    if engine.dialect.name == "postgresql":
+        lock_conn = engine.connect().execution_options(isolation_level="AUTOCOMMIT")
+        lock_conn.execute(text("SELECT pg_advisory_lock(:id)"), {"id": MIGRATION_LOCK_ID})
+
+    applied_now = []
+    try:
+        done = applied_versions(engine)
+        for version, name, migrate in MIGRATIONS:
+            if version in done:
+                continue
+            logger.info(f"Aplicando migração {version:03d}_{name}")
+            migrate(engine)
+            with engine.begin() as conn:
+                conn.execute(
+                    text("INSERT INTO schema_migration (version, name, applied_at) VALUES (:v, :n, :t)"),
+                    {"v": version, "n": name, "t": datetime.now()},
+                )
+            applied_now.append(version)
+    finally:
+        if lock_conn is not None:
+            lock_conn.execute(text("SELECT pg_advisory_unlock(:id)"), {"id": MIGRATION_LOCK_ID})
+            lock_conn.close()
+    return applied_now
+
+
+def missing_indexes(engine) -> list:
+    """Índices declarados nos modelos que não existem (ou estão inválidos) no banco"""
+    inspector = inspect(engine)
+    existing_tables = set(inspector.get_table_names())
+    invalid = _invalid_indexes(engine)
+    missing = []
+    for table in SQLModel.metadata.sorted_tables:
+        if table.name not in existing_tables:
+            continue
+        existing = {i["name"] for i in inspector.get_indexes(table.name)}
+        # Constraints UNIQUE também aparecem como índices no PostgreSQL
+        existing |= {u["name"] for u in inspector.get_unique_constraints(table.name) if u.get("name")}
+        for index in table.indexes:
+            if index.name not in existing or index.name in invalid:
+                missing.append(f"{table.name}.{index.name}")
+    return sorted(missing)
+
+
+def verify_indexes(engine) -> list:
+    """Loga os índices faltantes (chamado no startup)"""
+    missing = missing_indexes(engine)
+    if missing:
+        logger.warning(f"Índices faltando no banco ({len(missing)}): {', '.join(missing)} - rode `python migrations.py`")
+    else:
+        logger.info("Todos os índices declarados nos modelos existem no banco")
+    return missing
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
+    from database import engine
+
+    if "--status" in sys.argv:
+        done = applied_versions(engine)
+        for version, name, _ in MIGRATIONS:
+            mark = "✅" if version in done else "⏳"
+            print(f"{mark} {version:03d}_{name}")
+        missing = missing_indexes(engine)
+        print(f"📊 Índices faltando: {', '.join(missing) if missing else 'nenhum'}")
+        sys.exit(0)
+
+    applied = run_migrations(engine)
+    print(f"✅ {len(applied)} migração(ões) aplicada(s): {applied}" if applied else "ℹ️  Nenhuma migração pendente")
+    missing = verify_indexes(engine)
+    sys.exit(1 if missing else 0)
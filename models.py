@@ -1,6 +1,7 @@
-from datetime import datetime, time
+from datetime import datetime, time, date as date_type
 from typing import Optional, List
 from sqlmodel import Field, SQLModel, Relationship
+from sqlalchemy import Index, UniqueConstraint, text
 
 class Shift(SQLModel, table=True):
     id: Optional[int] = Field(default=None, primary_key=True)
@@ -20,6 +21,12 @@ class HeadcountTarget(SQLModel, table=True):
     target_value: int
 
 class Employee(SQLModel, table=True):
+    __table_args__ = (
+        Index("idx_employee_status", "status"),
+        Index("idx_employee_work_shift", "work_shift"),
+        Index("idx_employee_cost_center", "cost_center"),
+    )
+
     id: Optional[int] = Field(default=None, primary_key=True)
     registration_id: str = Field(index=True, unique=True) # Matrícula
     name: str
@@ -47,6 +54,9 @@ class Employee(SQLModel, table=True):
     # Replacement tracking
     replaced_by: Optional[int] = Field(default=None, foreign_key="employee.id")  # ID do colaborador que substituiu este
 
+    # Meta (onupdate: qualquer UPDATE via ORM/Core atualiza; usado no ETag de /api/employees)
+    updated_at: Optional[datetime] = Field(default_factory=datetime.now, sa_column_kwargs={"onupdate": datetime.now})
+
 
 
 
@@ -56,14 +66,18 @@ from sqlalchemy import Column, JSON
 from datetime import datetime
 
 class DailyOperation(SQLModel, table=True):
+    __table_args__ = (
+        Index("idx_daily_op_date_shift", "date", "shift"),
+    )
+
     id: Optional[int] = Field(default=None, primary_key=True)
-    date: str = Field(index=True) # YYYY-MM-DD
+    date: date_type = Field(index=True)  # DATE (API aceita "YYYY-MM-DD")
     shift: str = Field(index=True) # Manhã, Tarde, Noite
     
     # Metrics
     tonnage: int = Field(default=0)
-    attendance_log: Optional[dict] = Field(default={}, sa_column=Column(JSON))
-    logs: Optional[List[dict]] = Field(default=[], sa_column=Column(JSON)) # Store snapshots/events history
+    attendance_log: Optional[dict] = Field(default={}, sa_column=Column(JSON))  # Legado: substituído pela tabela Attendance
+    logs: Optional[List[dict]] = Field(default=[], sa_column=Column(JSON)) # Legado: substituído pela tabela OperationLog
     
     # Logistics
     arrival_time: Optional[str] = Field(default=None)
@@ -79,6 +93,14 @@ class DailyOperation(SQLModel, table=True):
     updated_at: datetime = Field(default_factory=datetime.now)
 
 class Event(SQLModel, table=True):
+    __table_args__ = (
+        Index("idx_event_employee_type_ts", "employee_id", "type", "timestamp"),  # Histórico/dedup por colaborador
+        Index("idx_event_type_ts", "type", "timestamp"),  # People Intelligence (tipo + período)
+        # Um evento de falta/atestado/afastamento por colaborador/dia (só linhas com `day`)
+        Index("uq_event_employee_type_day", "employee_id", "type", "day", unique=True,
+              postgresql_where=text("day IS NOT NULL"), sqlite_where=text("day IS NOT NULL")),
+    )
+
     id: Optional[int] = Field(default=None, primary_key=True)
     timestamp: datetime = Field(default_factory=datetime.now)
     text: str
@@ -86,6 +108,7 @@ class Event(SQLModel, table=True):
     category: str # infraestrutura, pessoas, processo, fornecedor
     sector: str = Field(default="Geral") # selecao, expedicao, camara
     impact: str = Field(default="low") # low, medium, high
+    day: Optional[date_type] = None  # Dia da ocorrência (eventos gerados pela presença; chave de dedup)
     
     shift_id: Optional[int] = Field(default=None, foreign_key="shift.id")
     shift: Optional[Shift] = Relationship(back_populates="events")
@@ -110,8 +133,14 @@ class Client(SQLModel, table=True):
     created_at: datetime = Field(default_factory=datetime.now)
 
 class Route(SQLModel, table=True):
+    __table_args__ = (
+        Index("idx_route_date_shift", "date", "shift"),
+        Index("idx_route_employee_id", "employee_id"),
+        Index("idx_route_client_id", "client_id"),
+    )
+
     id: Optional[int] = Field(default=None, primary_key=True)
-    date: str = Field(index=True) # YYYY-MM-DD
+    date: date_type = Field(index=True)  # DATE (API aceita "YYYY-MM-DD")
     shift: str = Field(default="Manhã", index=True) # Manhã, Tarde, Noite
     employee_id: int = Field(foreign_key="employee.id")
     client_id: int = Field(foreign_key="client.id")
@@ -153,8 +182,13 @@ class SubSector(SQLModel, table=True):
 
 class EmployeeAllocation(SQLModel, table=True):
     """Alocação de colaborador em sub-setor (por dia/turno)"""
+    __table_args__ = (
+        # Único por dia/turno/colaborador (também atende as buscas por date+shift)
+        Index("uq_allocation_day_employee", "date", "shift", "employee_id", unique=True),
+    )
+
     id: Optional[int] = Field(default=None, primary_key=True)
-    date: str = Field(index=True)  # YYYY-MM-DD
+    date: date_type = Field(index=True)  # DATE (API aceita "YYYY-MM-DD")
     shift: str = Field(index=True)  # Manhã, Tarde, Noite
     employee_id: int = Field(foreign_key="employee.id", index=True)
     subsector_id: int = Field(foreign_key="subsector.id", index=True)
@@ -165,10 +199,91 @@ class EmployeeAllocation(SQLModel, table=True):
 
 class EmployeeRoutine(SQLModel, table=True):
     """Rotina diária do colaborador (Presente, Falta, Férias, etc)"""
+    __table_args__ = (
+        # Único por dia/turno/colaborador (também atende as buscas por date+shift)
+        Index("uq_routine_day_employee", "date", "shift", "employee_id", unique=True),
+    )
+
     id: Optional[int] = Field(default=None, primary_key=True)
-    date: str = Field(index=True)  # YYYY-MM-DD
+    date: date_type = Field(index=True)  # DATE (API aceita "YYYY-MM-DD")
     shift: str = Field(index=True)  # Manhã, Tarde, Noite
     employee_id: int = Field(foreign_key="employee.id", index=True)
     routine: str = Field(default="present")  # present, absent, sick, vacation, away
     created_at: datetime = Field(default_factory=datetime.now)
     updated_at: datetime = Field(default_factory=datetime.now)
+
+class Attendance(SQLModel, table=True):
+    """Presença diária por colaborador (setor e status no dia/turno)"""
+    __table_args__ = (
+        UniqueConstraint("date", "shift", "employee_id", name="uq_attendance_day_employee"),
+        Index("idx_attendance_date_shift_sector", "date", "shift", "sector_key"),
+        Index("idx_attendance_date_status", "date", "status"),
+        Index("idx_attendance_employee_date", "employee_id", "date"),
+    )
+
+    id: Optional[int] = Field(default=None, primary_key=True)
+    date: date_type
+    shift: str  # Manhã, Tarde, Noite
+    employee_id: int = Field(foreign_key="employee.id")
+    sector_key: Optional[str] = None  # expedicao, camara_fria, ... (nome do setor normalizado)
+    status: str = Field(default="present")  # present, absent, sick, vacation, away, dayoff
+    updated_at: datetime = Field(default_factory=datetime.now)
+
+class AbsencePeriod(SQLModel, table=True):
+    """Período de ausência do colaborador (férias, afastamento, atestado); histórico completo"""
+    __table_args__ = (
+        # Reagendar = mesmo (colaborador, tipo, início): atualiza o fim em vez de duplicar
+        Index("uq_absence_employee_kind_start", "employee_id", "kind", "start_date", unique=True),
+        # "Quem está ausente em [a, b]": kind = ? AND start_date <= b, end_date filtrado no índice
+        Index("idx_absence_kind_start_end", "kind", "start_date", "end_date"),
+    )
+
+    id: Optional[int] = Field(default=None, primary_key=True)
+    employee_id: int = Field(foreign_key="employee.id")
+    kind: str  # vacation, away, sick
+    start_date: date_type
+    end_date: Optional[date_type] = None  # None = em aberto
+    note: Optional[str] = None
+    created_at: datetime = Field(default_factory=datetime.now)
+    updated_at: datetime = Field(default_factory=datetime.now)
+
+class EmployeeStatusSnapshot(SQLModel, table=True):
+    """Status de cada colaborador em um dia passado (memo de employee_status.status_as_of)"""
+    __table_args__ = (
+        Index("uq_status_snapshot_day_employee", "date", "employee_id", unique=True),
+        Index("idx_status_snapshot_date_status", "date", "status"),
+    )
+
+    id: Optional[int] = Field(default=None, primary_key=True)
+    date: date_type
+    employee_id: int = Field(foreign_key="employee.id")
+    status: str  # active, vacation, sick, away, absent, dayoff, fired
+    computed_at: datetime = Field(default_factory=datetime.now)
+
+class OperationLog(SQLModel, table=True):
+    """Histórico do dia/turno (snapshots e eventos da tela); só recebe INSERT"""
+    __table_args__ = (
+        # Leitura paginada por id dentro da operação
+        Index("idx_operation_log_daily_id", "daily_operation_id", "id"),
+    )
+
+    id: Optional[int] = Field(default=None, primary_key=True)
+    daily_operation_id: int = Field(foreign_key="dailyoperation.id")
+    ts: datetime = Field(default_factory=datetime.now)
+    kind: str = Field(default="snapshot")  # snapshot, event, ...
+    payload: Optional[dict] = Field(default=None, sa_column=Column(JSON))
+    entry_hash: Optional[str] = Field(default=None, max_length=40)  # sha1 de kind + payload (dedupe de reenvios)
+
+class JobRun(SQLModel, table=True):
+    """Execução de job agendado; (job, run_key) único impede rodar duas vezes"""
+    __table_args__ = (
+        UniqueConstraint("job", "run_key", name="uq_jobrun_job_key"),
+    )
+
+    id: Optional[int] = Field(default=None, primary_key=True)
+    job: str  # rollover, ...
+    run_key: str  # Chave da execução (ex.: data alvo "2026-10-19")
+    status: str = Field(default="running")  # running, done, failed
+    detail: Optional[str] = None  # Resumo ou erro
+    started_at: datetime = Field(default_factory=datetime.now)
+    finished_at: Optional[datetime] = None
@@ -0,0 +1,304 @@
+"""
+Monitoramento de runtime do servidor.
+
+- LoopLagMonitor: mede continuamente o atraso (lag) do event loop e, quando um
+  único callback bloqueia o loop além do limite, registra a rota e a stack do
+  código que estava rodando. Serve para achar handlers `async def` que fazem
+  trabalho síncrono (queries com Session síncrona, pandas, etc).
+- QueryCounterMiddleware: conta statements SQL e tempo de banco por request,
+  devolve nos headers X-DB-Queries / X-DB-Time-ms e sinaliza padrões N+1
+  (o mesmo formato de statement repetido mais de N vezes).
+"""
+import asyncio
+import contextvars
+import logging
+import os
+import re
+import sys
+import threading
+import time
+import traceback
+from collections import Counter, deque
+
+from sqlalchemy import event
+
+# Filho do logger de main.py (herda o RotatingFileHandler de logs.txt)
+logger = logging.getLogger("main.monitoring")
+
+# Limites superiores dos buckets do histograma de lag (ms)
+LAG_BUCKETS_MS = (1, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, float("inf"))
+
+
+class LoopLagMonitor:
+    """Mede o lag do event loop e detecta chamadas bloqueantes"""
+
+    def __init__(self, interval_ms: int = 100, block_threshold_ms: int = 250, enabled: bool = True):
+        self.interval = interval_ms / 1000
+        self.block_threshold = block_threshold_ms / 1000
+        self.enabled = enabled
+
+        self._loop = None
+        self._loop_thread_id = None
+        self._probe_task = None
+        self._watchdog = None
+        self._stop_event = threading.Event()
+        self._heartbeat = time.monotonic()
+        self._pending_block = None  # (rota, stack) capturados pelo watchdog
+        self._routes = {}  # asyncio.Task -> "METHOD /path"
+
+        self._histogram = [0] * len(LAG_BUCKETS_MS)
+        self._samples = 0
+        self._lag_sum = 0.0
+        self._lag_max = 0.0
+        self._blocks = 0
+        self._recent_blocks = deque(maxlen=20)
+        self._lock = threading.Lock()
+
+    # --- Ciclo de vida ---
+
+    def start(self):
+        if not self.enabled or self._probe_task:
+            return
+        self._loop = asyncio.get_running_loop()
+        self._loop_thread_id = threading.get_ident()
+        self._heartbeat = time.monotonic()
+        self._stop_event.clear()
+        self._probe_task = self._loop.create_task(self._probe())
+        self._watchdog = threading.Thread(target=self._watch, name="loop-lag-watchdog", daemon=True)
+        self._watchdog.start()
+        logger.info(
+            f"Loop lag monitor ativo (intervalo={self.interval * 1000:.0f}ms, "
+            f"limite de bloqueio={self.block_threshold * 1000:.0f}ms)"
+        )
+
+    async def stop(self):
+        self._stop_event.set()
+        if self._probe_task:
+            self._probe_task.cancel()
+            try:
+                await self._probe_task
+            except asyncio.CancelledError:
+                pass
+            self._probe_task = None
+
+    # --- Rastreamento de rota por task ---
+
+    def set_route(self, route: str):
+        task = asyncio.current_task()
+        if task is not None:
+            self._routes[task] = route
+
+    def clear_route(self):
+        task = asyncio.current_task()
+        if task is not None:
+            self._routes.pop(task, None)
+
+    # --- Medição ---
+
+    async def _probe(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            started = loop.time()
+            self._heartbeat = time.monotonic()
+            await asyncio.sleep(self.interval)
+            self._heartbeat = time.monotonic()
+            lag = max(0.0, loop.time() - started - self.interval)
+            self._record(lag)
+
+    def _record(self, lag: float):
+        lag_ms = lag * 1000
+        with self._lock:
+            self._samples += 1
+            self._lag_sum += lag
+            self._lag_max = max(self._lag_max, lag)
+            for i, upper in enumerate(LAG_BUCKETS_MS):
+                if lag_ms <= upper:
+                    self._histogram[i] += 1
+                    break
+            pending, self._pending_block = self._pending_block, None
+
+        if lag < self.block_threshold:
+            return
+
+        route, stack = pending if pending else ("desconhecida", None)
+        block = {
+            "at": time.strftime("%Y-%m-%d %H:%M:%S"),
+            "duration_ms": round(lag_ms, 1),
+            "route": route,
+            "stack": stack,
+        }
+        with self._lock:
+            self._blocks += 1
+            self._recent_blocks.append(block)
+        logger.warning(
+            f"Event loop bloqueado por {lag_ms:.0f}ms | rota: {route} "
+            f"(candidato a threadpool/engine assíncrono)"
+            + (f"\n{stack}" if stack else "")
+        )
+
+    def _watch(self):
+        """Thread separada: percebe o loop parado e captura quem está bloqueando"""
+        check_every = max(self.block_threshold / 2, 0.01)
+        while not self._stop_event.wait(check_every):
+            stalled = time.monotonic() - self._heartbeat
+            if stalled < self.block_threshold or self._pending_block is not None:
+                continue
+            frame = sys._current_frames().get(self._loop_thread_id)
+            stack = "".join(traceback.format_stack(frame)) if frame else None
+            route = None
+            try:
+                task = asyncio.current_task(self._loop)
+                route = self._routes.get(task)
+            except RuntimeError:
+                pass
+            with self._lock:
+                self._pending_block = (route or "fora de request", stack)
+
+    # --- Exposição ---
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            histogram = {}
+            for upper, count in zip(LAG_BUCKETS_MS, self._histogram):
+                label = f"le_{int(upper)}ms" if upper != float("inf") else "le_inf"
+                histogram[label] = count
+            return {
+                "enabled": self.enabled,
+                "interval_ms": self.interval * 1000,
+                "block_threshold_ms": self.block_threshold * 1000,
+                "samples": self._samples,
+                "avg_lag_ms": round(self._lag_sum / self._samples * 1000, 2) if self._samples else 0.0,
+                "max_lag_ms": round(self._lag_max * 1000, 2),
+                "blocks": self._blocks,
+                "histogram": histogram,
+                "recent_blocks": list(self._recent_blocks),
+            }
+
+
+class RouteTrackingMiddleware:
+    """
+    Middleware ASGI puro: associa a task atual à rota do request, para que o
+    LoopLagMonitor saiba qual handler estava bloqueando o loop.
+    (BaseHTTPMiddleware não serve aqui: ele roda o endpoint em outra task.)
+    """
+
+    def __init__(self, app, monitor: LoopLagMonitor):
+        self.app = app
+        self.monitor = monitor
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        self.monitor.set_route(f"{scope['method']} {scope['path']}")
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            self.monitor.clear_route()
+
+
+loop_monitor = LoopLagMonitor(
+    interval_ms=int(os.environ.get("LOOP_MONITOR_INTERVAL_MS", 100)),
+    block_threshold_ms=int(os.environ.get("LOOP_BLOCK_THRESHOLD_MS", 250)),
+    enabled=os.environ.get("LOOP_MONITOR_ENABLED", "true").lower() == "true",
+)
+
+
+# --- Contador de queries por request ---
+
+_request_queries = contextvars.ContextVar("request_queries", default=None)
+
+# Listas de parâmetros em IN (...) viram um único marcador, para que
+# "IN (?, ?)" e "IN (?, ?, ?)" contem como o mesmo formato de statement
+_IN_LIST_RE = re.compile(r"\((?:\s*(?:\?|\$\d+|%\([^)]+\)s|%s|:\w+)\s*,)+\s*(?:\?|\$\d+|%\([^)]+\)s|%s|:\w+)\s*\)")
+_SPACES_RE = re.compile(r"\s+")
+
+
+def normalize_statement(statement: str) -> str:
+    """Formato do statement (sem variação de espaços nem tamanho de listas IN)"""
+    shape = _SPACES_RE.sub(" ", statement).strip()
+    return _IN_LIST_RE.sub("(?...)", shape)
+
+
+class RequestQueryStats:
+    def __init__(self):
+        self.count = 0
+        self.time = 0.0
+        self.shapes = Counter()
+
+    def record(self, statement: str, elapsed: float):
+        self.count += 1
+        self.time += elapsed
+        self.shapes[normalize_statement(statement)] += 1
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    if _request_queries.get() is not None:
+        conn.info.setdefault("query_started", []).append(time.perf_counter())
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    stats = _request_queries.get()
+    if stats is None:
+        return
+    started = conn.info.get("query_started")
+    elapsed = time.perf_counter() - started.pop() if started else 0.0
+    stats.record(statement, elapsed)
+
+
+def instrument_engine(sync_engine):
+    """Liga a contagem de queries em um engine (para AsyncEngine, passar .sync_engine)"""
+    event.listen(sync_engine, "before_cursor_execute", _before_cursor_execute)
+    event.listen(sync_engine, "after_cursor_execute", _after_cursor_execute)
+
+
+class QueryCounterMiddleware:
+    """
+    Middleware ASGI puro: abre um contador por request e adiciona os headers
+    X-DB-Queries e X-DB-Time-ms na resposta. Se algum formato de statement se
+    repetir mais de `n_plus_one_threshold` vezes, loga um aviso e adiciona o
+    header X-DB-N-Plus-One com o maior número de repetições.
+    """
+
+    def __init__(self, app, n_plus_one_threshold: int = 10):
+        self.app = app
+        self.n_plus_one_threshold = n_plus_one_threshold
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        stats = RequestQueryStats()
+        token = _request_queries.set(stats)
+        route = f"{scope['method']} {scope['path']}"
+        reported = False
+
+        async def send_with_headers(message):
+            nonlocal reported
+            if message["type"] == "http.response.start":
+                headers = list(message.get("headers", []))
+                headers.append((b"x-db-queries", str(stats.count).encode()))
+                headers.append((b"x-db-time-ms", f"{stats.time * 1000:.1f}".encode()))
+                repeated = self._repeated_shapes(stats)
+                if repeated:
+                    headers.append((b"x-db-n-plus-one", str(repeated[0][1]).encode()))
+                    if not reported:
+                        reported = True
+                        self._report(route, stats, repeated)
+                message = {**message, "headers": headers}
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_headers)
+        finally:
+            _request_queries.reset(token)
+
+    def _repeated_shapes(self, stats: RequestQueryStats) -> list:
+        return [(shape, count) for shape, count in stats.shapes.most_common() if count > self.n_plus_one_threshold]
+
+    def _report(self, route: str, stats: RequestQueryStats, repeated: list):
+        details = "\n".join(f"  {count}x {shape[:300]}" for shape, count in repeated[:5])
+        logger.warning(
+            f"Possível N+1 em {route}: {stats.count} queries, {stats.time * 1000:.1f}ms de banco\n{details}"
+        )
@@ -0,0 +1,607 @@
+"""
+Persistência em lote das tabelas diárias do Smart Flow
+(EmployeeAllocation, EmployeeRoutine e Attendance).
+
+Em vez de um session.add/delete por colaborador, cada operação vira poucos
+statements: um DELETE por dia/turno, INSERT com executemany (ou COPY no
+PostgreSQL para lotes grandes) e INSERT ... SELECT para copiar a escala do
+dia anterior. As funções não fazem commit: rodam na transação do chamador.
+
+As tabelas diárias têm chave única (date, shift, employee_id); as gravações
+usam INSERT ... ON CONFLICT, então escritores concorrentes não duplicam linhas
+e não é preciso consultar antes de inserir.
+"""
+import hashlib
+import json
+import os
+import unicodedata
+from collections import Counter
+from datetime import datetime, timedelta, date as date_type
+
+from sqlalchemy import bindparam, delete, func, insert, literal, select, update
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlmodel.ext.asyncio.session import AsyncSession
+
+import models
+
+# A partir deste tamanho de lote o PostgreSQL usa COPY em vez de executemany
+COPY_THRESHOLD = int(os.environ.get("BULK_COPY_THRESHOLD", 500))
+
+# Rotinas que continuam valendo no dia seguinte (Férias, Afastado, Atestado)
+PERSISTENT_ROUTINES = ("vacation", "away", "sick")
+
+# Status de presença que geram evento no histórico do colaborador
+ATTENDANCE_EVENT_TYPES = {"absent": "falta", "sick": "atestado", "away": "afastamento"}
+
+# Tipos de AbsencePeriod (mesmos status das rotinas persistentes)
+ABSENCE_KINDS = PERSISTENT_ROUTINES
+
+# Rotina escolhida na tela -> Employee.status
+ROUTINE_STATUS = {
+    'present': 'active',
+    'vacation': 'vacation',
+    'sick': 'sick',
+    'away': 'away',
+    'absent': 'absent',
+    'dayoff': 'dayoff'
+}
+
+# Chave única das tabelas diárias por colaborador
+DAY_KEY = ("date", "shift", "employee_id")
+
+# Chave única de AbsencePeriod (reagendamento atualiza o fim)
+ABSENCE_KEY = ("employee_id", "kind", "start_date")
+
+_allocations = models.EmployeeAllocation.__table__
+_routines = models.EmployeeRoutine.__table__
+_attendance = models.Attendance.__table__
+_daily = models.DailyOperation.__table__
+_events = models.Event.__table__
+_employees = models.Employee.__table__
+_absences = models.AbsencePeriod.__table__
+_snapshots = models.EmployeeStatusSnapshot.__table__
+_operation_logs = models.OperationLog.__table__
+
+# INSERT com suporte a ON CONFLICT por dialeto
+_DIALECT_INSERT = {"postgresql": postgresql.insert, "sqlite": sqlite.insert}
+
+
+async def _dialect(session: AsyncSession) -> str:
+    return (await session.connection()).dialect.name
+
+
+async def _copy_rows(session: AsyncSession, table, rows: list):
+    """COPY via asyncpg, na mesma conexão/transação da sessão"""
+    columns = list(rows[0].keys())
+    conn = await session.connection()
+    raw = await conn.get_raw_connection()
+    await raw.driver_connection.copy_records_to_table(
+        table.name,
+        records=[tuple(row[c] for c in columns) for row in rows],
+        columns=columns,
+    )
+
+
+async def bulk_insert(session: AsyncSession, table, rows: list) -> int:
+    """Insere `rows` (lista de dicts com as mesmas chaves) em um único round trip"""
+    if not rows:
+        return 0
+    if len(rows) >= COPY_THRESHOLD and await _dialect(session) == "postgresql":
+        # Garante transação aberta antes do COPY (o asyncpg abre sob demanda)
+        await session.exec(select(literal(1)))
+        await _copy_rows(session, table, rows)
+    else:
+        await session.exec(insert(table), params=rows)
+    return len(rows)
+
+
+async def upsert(session: AsyncSession, table, rows: list, key, update_columns=(), key_where=None) -> int:
+    """
+    INSERT ... ON CONFLICT (key) em lote: atualiza `update_columns` da linha
+    existente ou, sem colunas, ignora a linha duplicada.
+    """
+    if not rows:
+        return 0
+    stmt = _DIALECT_INSERT[await _dialect(session)](table)
+    if update_columns:
+        stmt = stmt.on_conflict_do_update(
+            index_elements=list(key),
+            index_where=key_where,
+            set_={column: stmt.excluded[column] for column in update_columns},
+        )
+    else:
+        stmt = stmt.on_conflict_do_nothing(index_elements=list(key), index_where=key_where)
+    await session.exec(stmt, params=rows)
+    return len(rows)
+
+
+def insert_ignoring(dialect: str, table, key):
+    """INSERT ... ON CONFLICT (key) DO NOTHING do dialeto (para uso com Session síncrona)"""
+    return _DIALECT_INSERT[dialect](table).on_conflict_do_nothing(index_elements=list(key))
+
+
+async def replace_allocations(session: AsyncSession, date: date_type, shift: str, allocations: dict) -> int:
+    """Substitui as alocações do dia/turno: 1 DELETE + 1 INSERT em lote"""
+    await session.exec(
+        delete(_allocations)
+        .where(_allocations.c.date == date)
+        .where(_allocations.c.shift == shift)
+    )
+    return await upsert_allocations(session, date, shift, allocations)
+
+
+async def upsert_routines(session: AsyncSession, date: date_type, shift: str, routines: dict) -> int:
+    """Cria/atualiza as rotinas do dia/turno em um único INSERT ... ON CONFLICT DO UPDATE"""
+    now = datetime.now()
+    rows = [
+        {"date": date, "shift": shift, "employee_id": emp_id, "routine": routine, "created_at": now, "updated_at": now}
+        for emp_id, routine in routines.items()
+    ]
+    return await upsert(session, _routines, rows, DAY_KEY, update_columns=("routine", "updated_at"))
+
+
+async def upsert_allocations(session: AsyncSession, date: date_type, shift: str, allocations: dict) -> int:
+    """Grava só as alocações informadas ({employee_id: subsector_id}) com INSERT ... ON CONFLICT DO UPDATE"""
+    now = datetime.now()
+    rows = [
+        {"date": date, "shift": shift, "employee_id": emp_id, "subsector_id": subsector_id, "created_at": now}
+        for emp_id, subsector_id in allocations.items()
+    ]
+    return await upsert(session, _allocations, rows, DAY_KEY, update_columns=("subsector_id", "created_at"))
+
+
+async def delete_allocations(session: AsyncSession, date: date_type, shift: str, employee_ids: list) -> int:
+    if not employee_ids:
+        return 0
+    result = await session.exec(
+        delete(_allocations)
+        .where(_allocations.c.date == date)
+        .where(_allocations.c.shift == shift)
+        .where(_allocations.c.employee_id.in_(employee_ids))
+    )
+    return result.rowcount
+
+
+async def delete_routines(session: AsyncSession, date: date_type, shift: str, employee_ids: list) -> int:
+    if not employee_ids:
+        return 0
+    result = await session.exec(
+        delete(_routines)
+        .where(_routines.c.date == date)
+        .where(_routines.c.shift == shift)
+        .where(_routines.c.employee_id.in_(employee_ids))
+    )
+    return result.rowcount
+
+
+async def copy_allocations(session: AsyncSession, source_date: date_type, target_date: date_type, shift: str) -> int:
+    """Copia a escala de `source_date` para `target_date` com um INSERT ... SELECT (sem sobrescrever)"""
+    result = await session.exec(
+        _DIALECT_INSERT[await _dialect(session)](_allocations).from_select(
+            ["date", "shift", "employee_id", "subsector_id", "created_at"],
+            select(
+                literal(target_date),
+                _allocations.c.shift,
+                _allocations.c.employee_id,
+                _allocations.c.subsector_id,
+                literal(datetime.now()),
+            )
+            .where(_allocations.c.date == source_date)
+            .where(_allocations.c.shift == shift),
+        ).on_conflict_do_nothing(index_elements=list(DAY_KEY))
+    )
+    return result.rowcount
+
+
+async def copy_persistent_routines(session: AsyncSession, source_date: date_type, target_date: date_type, shift: str) -> int:
+    """Copia só as rotinas persistentes (férias/afastado/atestado) com um INSERT ... SELECT"""
+    now = datetime.now()
+    result = await session.exec(
+        _DIALECT_INSERT[await _dialect(session)](_routines).from_select(
+            ["date", "shift", "employee_id", "routine", "created_at", "updated_at"],
+            select(
+                literal(target_date),
+                _routines.c.shift,
+                _routines.c.employee_id,
+                _routines.c.routine,
+                literal(now),
+                literal(now),
+            )
+            .where(_routines.c.date == source_date)
+            .where(_routines.c.shift == shift)
+            .where(_routines.c.routine.in_(PERSISTENT_ROUTINES)),
+        ).on_conflict_do_nothing(index_elements=list(DAY_KEY))
+    )
+    return result.rowcount
+
+
+async def insert_day_events(session: AsyncSession, rows: list) -> int:
+    """
+    Eventos com `day` preenchido (falta/atestado/afastamento, transições de
+    férias): um por (colaborador, tipo, dia), duplicados são ignorados pelo
+    índice único parcial.
+    """
+    return await upsert(session, _events, rows, ("employee_id", "type", "day"), key_where=_events.c.day.isnot(None))
+
+
+async def sync_attendance_events(session: AsyncSession, day: date_type, attendance_log: dict) -> int:
+    """
+    Faltas/atestados/afastamentos do log de presença viram eventos do dia:
+    um SELECT ... IN para os colaboradores do lote e um INSERT em lote
+    (o índice único de insert_day_events descarta os que já existem).
+    """
+    flagged = {
+        str(reg_id): entry.get("status")
+        for reg_id, entry in (attendance_log or {}).items()
+        if isinstance(entry, dict) and entry.get("status") in ATTENDANCE_EVENT_TYPES
+    }
+    if not flagged:
+        return 0
+    employees = (await session.exec(
+        select(_employees.c.id, _employees.c.registration_id, _employees.c.cost_center)
+        .where(_employees.c.registration_id.in_(list(flagged)))
+    )).all()
+    now = datetime.now()  # Registrado agora; texto e `day` se referem ao dia da operação
+    return await insert_day_events(session, [
+        {
+            "timestamp": now,
+            "text": f"Registro: {flagged[reg_id].upper()} em {day.isoformat()}",
+            "type": ATTENDANCE_EVENT_TYPES[flagged[reg_id]],
+            "category": "pessoas",
+            "sector": cost_center or "Geral",
+            "impact": "medium",
+            "employee_id": emp_id,
+            "day": day,
+        }
+        for emp_id, reg_id, cost_center in employees
+    ])
+
+
+# --- Períodos de ausência (AbsencePeriod) ---
+
+def absence_overlaps(start: date_type, end: date_type, kind: str = None):
+    """Condição: o período cobre algum dia de [start, end] (fim nulo = em aberto)"""
+    condition = (_absences.c.start_date <= end) & (_absences.c.end_date.is_(None) | (_absences.c.end_date >= start))
+    if kind:
+        condition = condition & (_absences.c.kind == kind)
+    return condition
+
+
+async def upsert_absence_periods(session: AsyncSession, rows: list) -> int:
+    """
+    Grava períodos {employee_id, kind, start_date, end_date, note} em lote;
+    mesmo colaborador/tipo/início atualiza o fim (reagendamento).
+    """
+    if not rows:
+        return 0
+    now = datetime.now()
+    rows = [{"note": None, **row, "created_at": now, "updated_at": now} for row in rows]
+    # Período retroativo muda o status histórico a partir do início
+    await invalidate_status_snapshots(session, min(row["start_date"] for row in rows))
+    return await upsert(session, _absences, rows, ABSENCE_KEY, update_columns=("end_date", "note", "updated_at"))
+
+
+async def open_absence_period(session: AsyncSession, employee_id: int, kind: str, day: date_type, note: str = None):
+    """Abre um período em aberto a partir de `day`, se não houver um do mesmo tipo cobrindo o dia"""
+    ongoing = (await session.exec(
+        select(_absences.c.id)
+        .where(_absences.c.employee_id == employee_id)
+        .where(absence_overlaps(day, day, kind))
+        .limit(1)
+    )).first()
+    if ongoing is None:
+        await upsert_absence_periods(session, [
+            {"employee_id": employee_id, "kind": kind, "start_date": day, "end_date": None, "note": note}
+        ])
+
+
+async def end_absence_periods(session: AsyncSession, employee_id: int, kinds, day: date_type, drop_future: bool = False) -> int:
+    """
+    Encerra em `day - 1` os períodos dos tipos `kinds` que cobrem `day`
+    (os que começam em `day` são removidos). drop_future também remove os agendados para depois.
+    """
+    ongoing = (
+        (_absences.c.employee_id == employee_id)
+        & _absences.c.kind.in_(list(kinds))
+        & (_absences.c.end_date.is_(None) | (_absences.c.end_date >= day))
+    )
+    truncated = await session.exec(
+        update(_absences)
+        .where(ongoing & (_absences.c.start_date < day))
+        .values(end_date=day - timedelta(days=1), updated_at=datetime.now())
+    )
+    removed = await session.exec(
+        delete(_absences).where(ongoing & ((_absences.c.start_date >= day) if drop_future else (_absences.c.start_date == day)))
+    )
+    await invalidate_status_snapshots(session, day - timedelta(days=1))
+    return truncated.rowcount + removed.rowcount
+
+
+async def invalidate_status_snapshots(session: AsyncSession, since: date_type) -> int:
+    """Descarta o status histórico memoizado a partir de `since` (recalculado na próxima leitura)"""
+    result = await session.exec(delete(_snapshots).where(_snapshots.c.date >= since))
+    return result.rowcount
+
+
+async def schedule_vacations(session: AsyncSession, rows: list) -> int:
+    """
+    Programação de férias em lote. `rows`: {employee_id, vacation_start,
+    vacation_end (datetime), status (novo status), sector}.
+    1 UPDATE (executemany) em employee + upsert dos períodos + INSERT dos eventos de histórico.
+    """
+    if not rows:
+        return 0
+    await session.exec(
+        update(_employees)
+        .where(_employees.c.id == bindparam("b_id"))
+        .values(vacation_start=bindparam("b_start"), vacation_end=bindparam("b_end"), status=bindparam("b_status")),
+        params=[
+            {"b_id": row["employee_id"], "b_start": row["vacation_start"], "b_end": row["vacation_end"], "b_status": row["status"]}
+            for row in rows
+        ],
+    )
+    await upsert_absence_periods(session, [
+        {
+            "employee_id": row["employee_id"],
+            "kind": "vacation",
+            "start_date": row["vacation_start"].date(),
+            "end_date": row["vacation_end"].date(),
+        }
+        for row in rows
+    ])
+    now = datetime.now()
+    await bulk_insert(session, _events, [
+        {
+            "timestamp": now,
+            "text": f"Férias Agendadas: {row['vacation_start']:%d/%m/%Y} a {row['vacation_end']:%d/%m/%Y}",
+            "type": "ferias_hist",
+            "category": "pessoas",
+            "sector": row["sector"] or "Geral",
+            "impact": "low",
+            "employee_id": row["employee_id"],
+        }
+        for row in rows
+    ])
+    return len(rows)
+
+
+# --- Presença (Attendance) ---
+
+async def replace_attendance(session: AsyncSession, date: date_type, shift: str, entries: dict) -> int:
+    """
+    Regrava a presença do dia/turno: 1 DELETE + 1 INSERT em lote.
+    `entries`: {employee_id: {"sector": sector_key, "status": status}}
+    """
+    await session.exec(
+        delete(_attendance)
+        .where(_attendance.c.date == date)
+        .where(_attendance.c.shift == shift)
+    )
+    now = datetime.now()
+    rows = [
+        {
+            "date": date,
+            "shift": shift,
+            "employee_id": emp_id,
+            "sector_key": entry.get("sector"),
+            "status": entry.get("status") or "present",
+            "updated_at": now,
+        }
+        for emp_id, entry in entries.items()
+    ]
+    return await upsert(session, _attendance, rows, DAY_KEY, update_columns=("sector_key", "status", "updated_at"))
+
+
+def sector_key(sector_name: str) -> str:
+    """Chave do setor usada na presença: minúsculas, sem acentos, espaços viram '_'"""
+    normalized = unicodedata.normalize('NFD', sector_name.lower().strip())
+    return normalized.encode('ascii', 'ignore').decode('utf-8').replace(' ', '_')
+
+
+async def refresh_attendance(session: AsyncSession, date: date_type, shift: str, employee_ids: list = None) -> int:
+    """
+    Atualiza a presença só dos colaboradores informados, a partir das alocações
+    e rotinas já gravadas: alocado -> linha com setor e rotina (ou 'present');
+    sem alocação -> linha removida. `employee_ids=None` regrava o dia/turno inteiro.
+    """
+    if employee_ids is not None and not employee_ids:
+        return 0
+
+    def scoped(stmt, table):
+        return stmt if employee_ids is None else stmt.where(table.c.employee_id.in_(employee_ids))
+
+    allocated = (await session.exec(scoped(
+        select(_allocations.c.employee_id, models.Sector.name)
+        .join(models.SubSector, models.SubSector.id == _allocations.c.subsector_id)
+        .join(models.Sector, models.Sector.id == models.SubSector.sector_id)
+        .where(_allocations.c.date == date)
+        .where(_allocations.c.shift == shift),
+        _allocations,
+    ))).all()
+    routines = dict((await session.exec(scoped(
+        select(_routines.c.employee_id, _routines.c.routine)
+        .where(_routines.c.date == date)
+        .where(_routines.c.shift == shift),
+        _routines,
+    ))).all())
+
+    await session.exec(scoped(
+        delete(_attendance)
+        .where(_attendance.c.date == date)
+        .where(_attendance.c.shift == shift),
+        _attendance,
+    ))
+    now = datetime.now()
+    rows = [
+        {
+            "date": date,
+            "shift": shift,
+            "employee_id": emp_id,
+            "sector_key": sector_key(sector_name),
+            "status": routines.get(emp_id, "present"),
+            "updated_at": now,
+        }
+        for emp_id, sector_name in allocated
+    ]
+    return await upsert(session, _attendance, rows, DAY_KEY, update_columns=("sector_key", "status", "updated_at"))
+
+
+async def attendance_entries_from_log(session: AsyncSession, attendance_log: dict) -> dict:
+    """
+    Converte o formato da API ({matrícula: {"status", "sector"}}) para
+    {employee_id: entry} com uma única consulta IN. Matrículas desconhecidas são ignoradas.
+    """
+    if not attendance_log:
+        return {}
+    reg_ids = [str(reg_id) for reg_id in attendance_log]
+    id_by_reg = dict((await session.exec(
+        select(models.Employee.registration_id, models.Employee.id)
+        .where(models.Employee.registration_id.in_(reg_ids))
+    )).all())
+    return {
+        id_by_reg[str(reg_id)]: entry
+        for reg_id, entry in attendance_log.items()
+        if str(reg_id) in id_by_reg and isinstance(entry, dict)
+    }
+
+
+def attendance_log_query(date: date_type, shift: str):
+    """SELECT (matrícula, setor, status) da presença do dia/turno"""
+    return (
+        select(models.Employee.registration_id, _attendance.c.sector_key, _attendance.c.status)
+        .join(models.Employee, models.Employee.id == _attendance.c.employee_id)
+        .where(_attendance.c.date == date)
+        .where(_attendance.c.shift == shift)
+    )
+
+
+def to_attendance_log(rows) -> dict:
+    """Monta o formato da API ({matrícula: {"status", "sector"}}) a partir de attendance_log_query"""
+    return {str(reg_id): {"status": status, "sector": sector_key} for reg_id, sector_key, status in rows}
+
+
+# --- Histórico da operação (OperationLog) ---
+
+def _parse_ts(value, default: datetime) -> datetime:
+    if isinstance(value, datetime):
+        return value
+    if isinstance(value, str):
+        try:
+            return datetime.fromisoformat(value.replace("Z", "+00:00")).replace(tzinfo=None)
+        except ValueError:
+            pass
+    return default
+
+
+def operation_log_rows(daily_operation_id: int, entries: list, default_ts: datetime = None) -> list:
+    """
+    Entradas da API ({kind, ts, payload}) ou do JSON legado DailyOperation.logs
+    (o item inteiro vira o payload) -> linhas de OperationLog
+    """
+    default_ts = default_ts or datetime.now()
+    rows = []
+    for entry in entries or []:
+        if isinstance(entry, dict) and "payload" in entry:
+            kind, ts, payload = entry.get("kind"), entry.get("ts"), entry["payload"]
+        elif isinstance(entry, dict):
+            kind, ts, payload = entry.get("kind") or entry.get("type"), entry.get("ts") or entry.get("timestamp"), entry
+        else:
+            kind, ts, payload = None, None, {"value": entry}
+        kind = str(kind or "snapshot")[:50]
+        rows.append({
+            "daily_operation_id": daily_operation_id,
+            "ts": _parse_ts(ts, default_ts),
+            "kind": kind,
+            "payload": payload,
+            "entry_hash": operation_log_hash(kind, payload),
+        })
+    return rows
+
+
+def operation_log_hash(kind: str, payload) -> str:
+    """Identidade do conteúdo da entrada (kind + payload), usada para deduplicar reenvios"""
+    content = json.dumps([kind, payload], sort_keys=True, ensure_ascii=False, separators=(",", ":"), default=str)
+    return hashlib.sha1(content.encode("utf-8")).hexdigest()
+
+
+async def append_operation_logs(session: AsyncSession, daily_operation_id: int, entries: list) -> int:
+    """Acrescenta entradas ao histórico do dia/turno (só INSERT, sem reescrever as anteriores)"""
+    rows = operation_log_rows(daily_operation_id, entries)
+    if not rows:
+        return 0
+    # executemany (sem COPY): payload JSON e lotes pequenos
+    await session.exec(insert(_operation_logs), params=rows)
+    return len(rows)
+
+
+async def append_resent_operation_logs(session: AsyncSession, daily_operation_id: int, entries: list) -> int:
+    """
+    Clientes antigos reenviam a lista completa a cada salvamento: grava só as
+    entradas cujo conteúdo ainda não está na tabela (comparação por entry_hash,
+    contando repetições), independente da ordem ou de entradas vindas de outros clientes.
+    """
+    rows = operation_log_rows(daily_operation_id, entries)
+    if not rows:
+        return 0
+    stored = Counter((await session.exec(
+        select(_operation_logs.c.entry_hash).where(_operation_logs.c.daily_operation_id == daily_operation_id)
+    )).scalars())
+    new_rows = []
+    for row in rows:
+        if stored[row["entry_hash"]] > 0:
+            stored[row["entry_hash"]] -= 1
+        else:
+            new_rows.append(row)
+    if new_rows:
+        await session.exec(insert(_operation_logs), params=new_rows)
+    return len(new_rows)
+
+
+def operation_log_page_query(daily_operation_id: int, after_id: int = 0, limit: int = 100):
+    """Página do histórico em ordem de gravação (cursor = último id recebido)"""
+    return (
+        select(_operation_logs.c.id, _operation_logs.c.ts, _operation_logs.c.kind, _operation_logs.c.payload)
+        .where(_operation_logs.c.daily_operation_id == daily_operation_id)
+        .where(_operation_logs.c.id > after_id)
+        .order_by(_operation_logs.c.id)
+        .limit(limit)
+    )
+
+
+# --- Marcadores de versão (ETag dos GETs do Smart Flow) ---
+
+def _day(table, date: date_type, shift: str):
+    return (table.c.date == date) & (table.c.shift == shift)
+
+
+def allocations_version_query(date: date_type, shift: str):
+    """
+    SELECT de uma linha que muda sempre que alocações/rotinas do dia/turno mudam:
+    INSERT gera id novo, DELETE muda a contagem, upsert muda created_at/updated_at.
+    """
+    return select(
+        select(func.count()).select_from(_allocations).where(_day(_allocations, date, shift)).scalar_subquery(),
+        select(func.max(_allocations.c.id)).where(_day(_allocations, date, shift)).scalar_subquery(),
+        select(func.max(_allocations.c.created_at)).where(_day(_allocations, date, shift)).scalar_subquery(),
+        select(func.count()).select_from(_routines).where(_day(_routines, date, shift)).scalar_subquery(),
+        select(func.max(_routines.c.updated_at)).where(_day(_routines, date, shift)).scalar_subquery(),
+        select(func.max(_daily.c.updated_at)).where(_day(_daily, date, shift)).scalar_subquery(),
+    )
+
+
+def employees_version_query():
+    """SELECT de uma linha que muda a cada inclusão/edição/exclusão de colaborador"""
+    return select(
+        select(func.count()).select_from(_employees).scalar_subquery(),
+        select(func.max(_employees.c.id)).scalar_subquery(),
+        select(func.max(_employees.c.updated_at)).scalar_subquery(),
+    )
+
+
+def attendance_version_query(date: date_type, shift: str):
+    """SELECT de uma linha que muda sempre que a presença ou a DailyOperation do dia/turno mudam"""
+    return select(
+        select(func.count()).select_from(_attendance).where(_day(_attendance, date, shift)).scalar_subquery(),
+        select(func.max(_attendance.c.updated_at)).where(_day(_attendance, date, shift)).scalar_subquery(),
+        select(func.max(_daily.c.updated_at)).where(_day(_daily, date, shift)).scalar_subquery(),
+    )
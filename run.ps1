@@ -3,7 +3,7 @@
 # Verifica se o arquivo uvicorn existe no venv
 if (Test-Path ".venv\Scripts\python.exe") {
     Write-Host "Iniciando servidor FastAPI..."
-    & ".\.venv\Scripts\python" -m uvicorn main:app --reload
+    & ".\.venv\Scripts\python" -m uvicorn main:app --reload --timeout-graceful-shutdown 5
 }
 else {
     Write-Error "Ambiente virtual não encontrado ou incompleto. execute 'python -m venv .venv' e instale as dependências."
@@ -0,0 +1,372 @@
+"""
+Jobs agendados (rodam dentro do processo do servidor).
+
+- Scheduler: executa funções async uma vez por dia no horário configurado.
+- run_once: guarda de execução única por (job, chave) na tabela `jobrun`.
+  A constraint única garante que, com vários workers/instâncias, só um
+  executa; execuções que falharam (ou travaram) podem ser retomadas.
+- rollover_shift / rollover_allocations: copia a escala e as rotinas
+  persistentes de um turno para o dia seguinte em lote, quando o turno fecha
+  (/routine/update com status "closed"); o job diário e o startup só copiam
+  turnos já fechados, e o primeiro acesso a um dia/turno sem escala copia o que
+  houver. Só conta como feito quando a origem tem linhas.
+- vacation_transitions: aplica início/fim de férias do dia com dois UPDATEs
+  em lote (as telas não alteram mais status ao serem abertas).
+- snapshot_statuses: grava o status de cada colaborador no dia anterior
+  (employee_status), para relatórios históricos lerem linhas prontas.
+- backfill_status_snapshots: a cada STATUS_BACKFILL_SECONDS recalcula os dias
+  passados sem memo (descartados por edição de histórico ou nunca calculados).
+"""
+import asyncio
+import logging
+import os
+from datetime import datetime, time, timedelta, date as date_type
+
+from sqlalchemy import delete, distinct, func, update
+from sqlalchemy.exc import IntegrityError
+from sqlmodel import select
+
+import employee_status
+import models
+import persistence
+from database import async_session_maker
+
+# Filho do logger de main.py (herda o RotatingFileHandler de logs.txt)
+logger = logging.getLogger("main.scheduler")
+
+# Execução "running" mais antiga que isso é considerada travada e pode ser retomada
+STALE_RUN = timedelta(hours=1)
+
+
+def _parse_time(value: str) -> time:
+    hour, minute = value.split(":")
+    return time(int(hour), int(minute))
+
+
+# --- Guarda de execução única ---
+
+async def _claim(session, job: str, run_key: str, force: bool) -> bool:
+    """Registra a execução (job, run_key); False se outra já rodou ou está rodando"""
+    session.add(models.JobRun(job=job, run_key=run_key))
+    try:
+        await session.commit()
+        return True
+    except IntegrityError:
+        await session.rollback()
+
+    # Já existe: só retoma se falhou, travou ou se foi forçada
+    table = models.JobRun.__table__
+    claim = (
+        update(table)
+        .where(table.c.job == job)
+        .where(table.c.run_key == run_key)
+        .values(status="running", started_at=datetime.now(), finished_at=None, detail=None)
+    )
+    if not force:
+        claim = claim.where(
+            (table.c.status == "failed")
+            | ((table.c.status == "running") & (table.c.started_at < datetime.now() - STALE_RUN))
+        )
+    result = await session.exec(claim)
+    await session.commit()
+    return result.rowcount == 1
+
+
+async def _finish(session, job: str, run_key: str, status: str, detail: str):
+    table = models.JobRun.__table__
+    await session.exec(
+        update(table)
+        .where(table.c.job == job)
+        .where(table.c.run_key == run_key)
+        .values(status=status, detail=detail[:2000], finished_at=datetime.now())
+    )
+    await session.commit()
+
+
+async def _release(session, job: str, run_key: str):
+    table = models.JobRun.__table__
+    await session.exec(delete(table).where(table.c.job == job).where(table.c.run_key == run_key))
+    await session.commit()
+
+
+async def run_once(job: str, run_key: str, fn, force: bool = False):
+    """
+    Executa `fn(session)` uma única vez para (job, run_key).
+    Retorna o resultado de fn, ou None se a execução já foi feita/está em andamento.
+    Se fn retornar None (nada a fazer ainda), a chave é liberada para uma nova tentativa.
+    """
+    async with async_session_maker() as session:
+        if not await _claim(session, job, run_key, force):
+            logger.info(f"Job {job}[{run_key}] já executado ou em andamento; ignorando")
+            return None
+        try:
+            result = await fn(session)
+            await session.commit()
+        except Exception as e:
+            await session.rollback()
+            logger.exception(f"Job {job}[{run_key}] falhou")
+            await _finish(session, job, run_key, "failed", f"{type(e).__name__}: {e}")
+            raise
+        if result is None:
+            await _release(session, job, run_key)
+            logger.info(f"Job {job}[{run_key}] sem nada a fazer; chave liberada")
+            return None
+        await _finish(session, job, run_key, "done", str(result))
+        logger.info(f"Job {job}[{run_key}] concluído: {result}")
+        return result
+
+
+# --- Jobs ---
+
+def _day_exists(table, day: date_type, shift: str):
+    return select(table.id).where(table.date == day).where(table.shift == shift).exists()
+
+
+def _rollover_key(target_date: date_type, shift: str) -> str:
+    return f"{target_date.isoformat()}|{shift}"
+
+
+async def _rollover_shift(session, target_date: date_type, shift: str):
+    """
+    Copia a escala do turno de target_date - 1 para target_date, onde ainda não houver.
+    None se a origem não tem alocações (a chave fica livre para uma passada posterior).
+    """
+    source_date = target_date - timedelta(days=1)
+    allocation = models.EmployeeAllocation
+    has_source, filled, has_routines = (await session.exec(select(
+        _day_exists(allocation, source_date, shift),
+        _day_exists(allocation, target_date, shift),
+        _day_exists(models.EmployeeRoutine, target_date, shift),
+    ))).one()
+    if not has_source:
+        return None
+    copied = 0
+    if not filled:
+        copied = await persistence.copy_allocations(session, source_date, target_date, shift)
+    routines = 0
+    if not has_routines:
+        routines = await persistence.copy_persistent_routines(session, source_date, target_date, shift)
+    return {"allocations": copied, "routines": routines}
+
+
+async def rollover_shift(target_date: date_type, shift: str, force: bool = False):
+    """Prepara o turno em `target_date` (alocações + rotinas persistentes do dia anterior), uma vez por dia/turno"""
+    return await run_once(
+        "rollover", _rollover_key(target_date, shift),
+        lambda session: _rollover_shift(session, target_date, shift),
+        force=force,
+    )
+
+
+async def rollover_allocations(target_date: date_type, force: bool = False, closed_only: bool = True) -> dict:
+    """
+    Rollover de cada turno com escala em target_date - 1. Com closed_only, só os
+    turnos já fechados (os demais ficam para o fechamento ou o primeiro acesso).
+    """
+    source_date = target_date - timedelta(days=1)
+    allocation, daily = models.EmployeeAllocation, models.DailyOperation
+    async with async_session_maker() as session:
+        shifts = (await session.exec(
+            select(distinct(allocation.shift)).where(allocation.date == source_date)
+        )).all()
+        if closed_only:
+            closed = set((await session.exec(
+                select(daily.shift).where(daily.date == source_date).where(daily.status == "closed")
+            )).all())
+            shifts = [shift for shift in shifts if shift in closed]
+    return {shift: await rollover_shift(target_date, shift, force=force) for shift in shifts}
+
+
+async def rollover_on_first_load(target_date: date_type, shift: str) -> bool:
+    """
+    Primeiro acesso a um dia/turno sem escala (hoje ou futuro): copia a do dia
+    anterior se o rollover do turno ainda não rodou. True se copiou algo.
+    """
+    if target_date < datetime.now().date():
+        return False
+    job = models.JobRun
+    async with async_session_maker() as session:
+        has_source, ran = (await session.exec(select(
+            _day_exists(models.EmployeeAllocation, target_date - timedelta(days=1), shift),
+            select(job.id).where(job.job == "rollover").where(job.run_key == _rollover_key(target_date, shift)).exists(),
+        ))).one()
+    if not has_source or ran:
+        return False
+    result = await rollover_shift(target_date, shift)
+    return bool(result and (result["allocations"] or result["routines"]))
+
+
+async def _vacation_transitions(session, day: date_type) -> dict:
+    """
+    Colaboradores com período de férias (AbsencePeriod) cobrindo `day` passam a
+    'vacation'; os que estão em 'vacation' com períodos que não cobrem mais `day`
+    voltam a 'active'. Demitidos e quem não tem período não são alterados.
+    """
+    employee = models.Employee.__table__
+    absence = models.AbsencePeriod.__table__
+    vacations = select(absence.c.id).where(absence.c.employee_id == employee.c.id).where(absence.c.kind == "vacation")
+    scheduled = vacations.exists()
+    in_period = vacations.where(persistence.absence_overlaps(day, day)).exists()
+
+    started = (await session.exec(
+        update(employee)
+        .where(scheduled & in_period)
+        .where(employee.c.status.notin_(("vacation", "fired")))
+        .values(status="vacation")
+        .returning(employee.c.id, employee.c.name)
+    )).all()
+    ended = (await session.exec(
+        update(employee)
+        .where(scheduled & ~in_period)
+        .where(employee.c.status == "vacation")
+        .values(status="active")
+        .returning(employee.c.id, employee.c.name)
+    )).all()
+
+    # Histórico em lote (um evento por colaborador/dia; reexecuções não duplicam)
+    now = datetime.now()
+    await persistence.insert_day_events(session, [
+        {
+            "timestamp": now,
+            "text": text_format.format(name),
+            "type": "routine_change",
+            "category": category,
+            "sector": "Geral",
+            "impact": "low",
+            "employee_id": emp_id,
+            "day": day,
+        }
+        for rows, category, text_format in (
+            (started, "vacation", "{} entrou de férias (automático)"),
+            (ended, "present", "{} retornou das férias (automático)"),
+        )
+        for emp_id, name in rows
+    ])
+    return {"started": len(started), "ended": len(ended)}
+
+
+async def vacation_transitions(day: date_type, force: bool = False):
+    """Aplica as transições de férias de `day`, uma vez por data"""
+    return await run_once("vacation", day.isoformat(), lambda session: _vacation_transitions(session, day), force=force)
+
+
+async def snapshot_statuses(day: date_type, force: bool = False):
+    """Memo do status dos colaboradores em `day` (employeestatussnapshot), uma vez por data"""
+    return await run_once(
+        "status_snapshot", day.isoformat(),
+        lambda session: session.run_sync(employee_status.snapshot_statuses, day),
+        force=force,
+    )
+
+
+async def backfill_status_snapshots(days: int = None) -> dict:
+    """Memo dos dias passados sem linhas, de ontem até `days` dias atrás"""
+    days = days or STATUS_BACKFILL_DAYS
+    end = datetime.now().date() - timedelta(days=1)
+    start = end - timedelta(days=days - 1)
+    async with async_session_maker() as session:
+        filled = await session.run_sync(employee_status.backfill_snapshots, start, end)
+    if filled:
+        logger.info(f"Memo de status recalculado para {len(filled)} dia(s): {filled}")
+    return filled
+
+
+# --- Agendador ---
+
+class Scheduler:
+    """Executa jobs diários e periódicos em tarefas asyncio (uma por job)"""
+
+    def __init__(self, enabled: bool = True):
+        self.enabled = enabled
+        self._jobs = []  # (nome, horário, função async sem argumentos)
+        self._periodic = []  # (nome, intervalo em segundos, função async sem argumentos)
+        self._tasks = []
+
+    def daily(self, name: str, at: time, fn):
+        self._jobs.append((name, at, fn))
+
+    def every(self, name: str, seconds: float, fn):
+        if seconds > 0:
+            self._periodic.append((name, seconds, fn))
+
+    def start(self):
+        if not self.enabled:
+            return
+        for name, at, fn in self._jobs:
+            self._tasks.append(asyncio.create_task(self._loop(name, at, fn), name=f"scheduler:{name}"))
+        for name, seconds, fn in self._periodic:
+            self._tasks.append(asyncio.create_task(self._loop_every(name, seconds, fn), name=f"scheduler:{name}"))
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        for task in self._tasks:
+            try:
+                await task
+            except asyncio.CancelledError:
+                pass
+        self._tasks = []
+
+    async def _loop(self, name: str, at: time, fn):
+        while True:
+            now = datetime.now()
+            next_run = datetime.combine(now.date(), at)
+            if next_run <= now:
+                next_run += timedelta(days=1)
+            await asyncio.sleep((next_run - now).total_seconds())
+            try:
+                await fn()
+            except Exception:
+                logger.exception(f"Job agendado {name} falhou")
+
+    async def _loop_every(self, name: str, seconds: float, fn):
+        while True:
+            await asyncio.sleep(seconds)
+            try:
+                await fn()
+            except Exception:
+                logger.exception(f"Job periódico {name} falhou")
+
+    def snapshot(self) -> dict:
+        return {
+            "enabled": self.enabled,
+            "jobs": [{"name": name, "at": at.strftime("%H:%M")} for name, at, _ in self._jobs]
+            + [{"name": name, "every_seconds": seconds} for name, seconds, _ in self._periodic],
+        }
+
+
+ROLLOVER_AT = _parse_time(os.environ.get("ROLLOVER_AT", "23:30"))
+VACATION_AT = _parse_time(os.environ.get("VACATION_TRANSITIONS_AT", "00:05"))
+STATUS_SNAPSHOT_AT = _parse_time(os.environ.get("STATUS_SNAPSHOT_AT", "00:15"))
+# Repasse do memo de status: intervalo (0 desliga) e quantos dias para trás
+STATUS_BACKFILL_SECONDS = float(os.environ.get("STATUS_BACKFILL_SECONDS", 300))
+STATUS_BACKFILL_DAYS = int(os.environ.get("STATUS_BACKFILL_DAYS", 90))
+
+scheduler = Scheduler(enabled=os.environ.get("SCHEDULER_ENABLED", "true").lower() == "true")
+scheduler.daily("rollover", ROLLOVER_AT, lambda: rollover_allocations(datetime.now().date() + timedelta(days=1)))
+scheduler.daily("vacation", VACATION_AT, lambda: vacation_transitions(datetime.now().date()))
+scheduler.daily("status_snapshot", STATUS_SNAPSHOT_AT, lambda: snapshot_statuses(datetime.now().date() - timedelta(days=1)))
+scheduler.every("status_backfill", STATUS_BACKFILL_SECONDS, backfill_status_snapshots)
+
+
+async def catch_up():
+    """
+    No startup: garante o dia de hoje (caso o servidor estivesse fora no horário)
+    e o rollover dos turnos já fechados para hoje e amanhã.
+    """
+    if not scheduler.enabled:
+        return
+    today = datetime.now().date()
+    try:
+        await vacation_transitions(today)
+    except Exception:
+        logger.exception("Falha nas transições de férias de startup")
+    try:
+        await snapshot_statuses(today - timedelta(days=1))
+    except Exception:
+        logger.exception("Falha no snapshot de status de startup")
+    try:
+        await rollover_allocations(today)
+        await rollover_allocations(today + timedelta(days=1))
+    except Exception:
+        logger.exception("Falha no rollover de startup")
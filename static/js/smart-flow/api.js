@@ -4,6 +4,9 @@
  */
 
 const API = {
+    // Identifica esta aba nas gravações; o stream em tempo real ignora o próprio eco
+    clientId: (window.crypto && crypto.randomUUID) ? crypto.randomUUID() : `${Date.now()}-${Math.random().toString(36).slice(2)}`,
+
     /**
      * Carrega a rotina do dia/turno
      */
@@ -62,6 +65,40 @@ const API = {
         }
     },
 
+    /**
+     * Carrega tudo que a tela precisa (setores, alocações, rotinas,
+     * colaboradores e KPIs) em uma única requisição
+     */
+    async bootstrap(date, shift) {
+        try {
+            const response = await fetch(`/api/smart-flow/bootstrap?date=${date}&shift=${shift}`);
+            if (!response.ok) throw new Error('Erro ao carregar Smart Flow');
+            return await response.json();
+        } catch (error) {
+            console.error('API Error:', error);
+            return { sectors: [], allocations: {}, routines: {}, roster_version: null, kpi: { tonnage: 0 } };
+        }
+    },
+
+    /**
+     * Lista de colaboradores da versão informada pelo bootstrap.
+     * A URL versionada fica no cache do navegador; só baixa de novo quando a versão muda.
+     */
+    roster: null,
+    async loadRoster(version) {
+        if (!version) return null;
+        if (this.roster && this.roster.version === version) return this.roster;
+        try {
+            const response = await fetch(`/api/roster?v=${encodeURIComponent(version)}`);
+            if (!response.ok) throw new Error('Erro ao carregar colaboradores');
+            this.roster = await response.json();
+            return this.roster;
+        } catch (error) {
+            console.error('API Error:', error);
+            return null; // Mantém a lista já carregada
+        }
+    },
+
     /**
      * Carrega setores e sub-setores do turno
      */
@@ -97,7 +134,7 @@ const API = {
         try {
             const response = await fetch('/api/smart-flow/allocations/save', {
                 method: 'POST',
-                headers: { 'Content-Type': 'application/json' },
+                headers: { 'Content-Type': 'application/json', 'X-Client-Id': API.clientId },
                 body: JSON.stringify(payload)
             });
             if (!response.ok) throw new Error('Erro ao salvar alocações');
@@ -108,6 +145,24 @@ const API = {
         }
     },
 
+    /**
+     * Envia só as mudanças de alocações/rotinas (null = remover)
+     */
+    async patchAllocations(payload) {
+        try {
+            const response = await fetch('/api/smart-flow/allocations', {
+                method: 'PATCH',
+                headers: { 'Content-Type': 'application/json', 'X-Client-Id': API.clientId },
+                body: JSON.stringify(payload)
+            });
+            if (!response.ok) throw new Error('Erro ao salvar alterações');
+            return await response.json();
+        } catch (error) {
+            console.error('API Error:', error);
+            return { success: false };
+        }
+    },
+
     /**
      * Define férias de um colaborador
      */
@@ -137,7 +192,7 @@ const API = {
         try {
             const response = await fetch('/api/employees/routine', {
                 method: 'POST',
-                headers: { 'Content-Type': 'application/json' },
+                headers: { 'Content-Type': 'application/json', 'X-Client-Id': API.clientId },
                 body: JSON.stringify({
                     employee_id: employeeId,
                     routine: routine
@@ -7,12 +7,8 @@ const App = {
     async init() {
         console.log('🚀 Smart Flow V2 Starting...');
 
-        // 1. Inicializar Store com dados injetados
-        if (typeof INITIAL_DATA !== 'undefined') {
-            Store.init(INITIAL_DATA);
-        } else {
-            console.error('CRITICAL: INITIAL_DATA not found.');
-        }
+        // 1. Inicializar Store (dados chegam em loadData via bootstrap)
+        Store.init({});
 
         // 2. Inicializar Renderizador
         Render.init();
@@ -34,18 +30,24 @@ const App = {
     async loadData() {
         const { currentDate, currentShift } = Store.state;
 
-        // Carregar setores
-        const sectorsData = await API.loadSectors(currentShift);
+        // Setores, alocações, rotinas e KPIs em uma requisição
+        const data = await API.bootstrap(currentDate, currentShift);
 
-        // Carregar alocações e rotinas
-        const allocData = await API.loadAllocations(currentDate, currentShift);
+        // Colaboradores: recurso versionado (cache do navegador até mudar)
+        const roster = await API.loadRoster(data.roster_version);
 
         // Atualizar Store
         Store.setData({
-            sectors: sectorsData.sectors || [],
-            allocations: allocData.allocations || {},
-            routines: allocData.routines || {}
+            // Substituídos já têm alguém no lugar e não entram na escala
+            employees: roster ? roster.employees.filter(e => !e.is_substituted) : null,
+            sectors: data.sectors || [],
+            allocations: data.allocations || {},
+            routines: data.routines || {},
+            tonnage: (data.kpi || {}).tonnage || 0
         });
+
+        // Receber mudanças de outras abas no mesmo dia/turno
+        Realtime.connect(currentDate, currentShift);
     }
 };
 
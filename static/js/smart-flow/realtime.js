@@ -0,0 +1,73 @@
+/**
+ * Realtime Module - Smart Flow V2
+ * Recebe via Server-Sent Events as mudanças gravadas por outras abas
+ * no mesmo dia/turno e aplica no Store (sem recarregar tudo).
+ */
+
+const Realtime = {
+    source: null,
+    key: null,          // "data|turno" do stream aberto
+    needsResync: false, // Reconectou: pode ter perdido eventos
+
+    // Abre (ou reaproveita) o stream do dia/turno
+    connect(date, shift) {
+        if (!window.EventSource) return;
+        const key = `${date}|${shift}`;
+        if (this.source && this.key === key) return;
+
+        this.close();
+        this.key = key;
+        this.needsResync = false;
+        this.source = new EventSource(`/api/smart-flow/stream?date=${encodeURIComponent(date)}&shift=${encodeURIComponent(shift)}`);
+
+        this.source.addEventListener('open', () => {
+            if (this.needsResync) {
+                this.needsResync = false;
+                this.resync();
+            }
+        });
+
+        this.source.addEventListener('error', () => {
+            // O EventSource reconecta sozinho; ao voltar, recarrega o estado
+            this.needsResync = true;
+        });
+
+        this.source.addEventListener('allocations', (e) => {
+            const delta = JSON.parse(e.data);
+            if (delta.origin === API.clientId) return; // Eco da própria aba
+            console.log('🔄 Alocações alteradas por outro usuário');
+            Store.applyRemote(delta);
+        });
+
+        this.source.addEventListener('employee', (e) => {
+            const msg = JSON.parse(e.data);
+            if (msg.origin === API.clientId) return;
+            Store.applyEmployeeStatus(msg.employee_id, msg.status);
+        });
+
+        this.source.addEventListener('resync', () => this.resync());
+    },
+
+    close() {
+        if (this.source) this.source.close();
+        this.source = null;
+        this.key = null;
+    },
+
+    // Recarrega alocações/rotinas do servidor mantendo as mudanças locais pendentes
+    async resync() {
+        const { currentDate, currentShift } = Store.state;
+        const allocData = await API.loadAllocations(currentDate, currentShift);
+        const routines = { ...(allocData.routines || {}) };
+        Object.keys(Store.state.routines).forEach(id => {
+            if (!(id in routines)) routines[id] = null; // Removida no servidor
+        });
+        Store.applyRemote({
+            replace: true,
+            allocations: allocData.allocations || {},
+            routines
+        });
+    }
+};
+
+window.Realtime = Realtime; // Expor globalmente
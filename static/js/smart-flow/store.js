@@ -19,7 +19,11 @@ const Store = {
             status: 'all' // all, present, missing
         },
         tonnage: 0,
-        isDirty: false      // Se houve alteração não salva
+        isDirty: false,     // Se houve alteração não salva
+        dirty: {            // Colaboradores alterados desde o último salvamento
+            allocations: new Set(),
+            routines: new Set()
+        }
     },
 
     // --- Listeners ---
@@ -46,11 +50,13 @@ const Store = {
 
     // Carregar dados completos
     setData(data) {
+        if (data.employees) this.state.employees = data.employees;
         this.state.sectors = data.sectors || [];
         this.state.allocations = data.allocations || {};
         this.state.routines = data.routines || {};
         this.state.tonnage = data.tonnage || 0;
         this.state.isDirty = false;
+        this.clearDirty();
         this.notify(); // Importante: notificar mudanças!
     },
 
@@ -69,10 +75,21 @@ const Store = {
         this.notify();
     },
 
+    // Marcar colaboradores alterados (enviados no próximo autoSave)
+    markDirty(kind, empId) {
+        this.state.dirty[kind].add(String(empId));
+        this.state.isDirty = true;
+    },
+
+    clearDirty() {
+        this.state.dirty.allocations.clear();
+        this.state.dirty.routines.clear();
+    },
+
     // Alocar colaborador em sub-setor
     allocateEmployee(employeeId, subsectorId) {
         this.state.allocations[employeeId] = subsectorId;
-        this.state.isDirty = true;
+        this.markDirty('allocations', employeeId);
         this.notify();
         this.autoSave(); // Reabilitado - erro 500 resolvido
     },
@@ -83,7 +100,8 @@ const Store = {
         if (wasAllocated) {
             delete this.state.allocations[empId];
             delete this.state.routines[empId]; // Também remover rotina
-            this.state.isDirty = true;
+            this.markDirty('allocations', empId);
+            this.markDirty('routines', empId);
             this.notify();
             this.autoSave(); // Reabilitado - erro 500 resolvido
             console.log(`🗑️ Colaborador ${empId} removido (alocação e rotina)`);
@@ -93,11 +111,43 @@ const Store = {
     // Atualizar rotina do colaborador
     updateRoutine(empId, routine) {
         this.state.routines[empId] = routine;
-        this.state.isDirty = true;
+        this.markDirty('routines', empId);
         this.notify();
         this.autoSave(); // Reabilitado - erro 500 resolvido
     },
 
+    // Aplicar mudanças gravadas por outra aba (stream em tempo real).
+    // Não marca como alterado; mudanças locais ainda não salvas têm prioridade.
+    applyRemote(delta) {
+        const { dirty } = this.state;
+        if (delta.replace) {
+            const kept = {};
+            dirty.allocations.forEach(id => {
+                if (this.state.allocations[id] !== undefined) kept[id] = this.state.allocations[id];
+            });
+            this.state.allocations = kept;
+        }
+        Object.entries(delta.allocations || {}).forEach(([id, subsectorId]) => {
+            if (dirty.allocations.has(id)) return;
+            if (subsectorId === null) delete this.state.allocations[id];
+            else this.state.allocations[id] = subsectorId;
+        });
+        Object.entries(delta.routines || {}).forEach(([id, routine]) => {
+            if (dirty.routines.has(id)) return;
+            if (routine === null) delete this.state.routines[id];
+            else this.state.routines[id] = routine;
+        });
+        this.notify();
+    },
+
+    // Status do colaborador alterado por outra aba
+    applyEmployeeStatus(employeeId, status) {
+        const emp = this.state.employees.find(e => e.id == employeeId);
+        if (!emp) return;
+        emp.status = status;
+        this.notify();
+    },
+
     // Atualizar Tonelagem
     updateTonnage(val) {
         this.state.tonnage = val;
@@ -208,6 +258,8 @@ const Store = {
     // Debounce Save - Otimizado para evitar salvamentos excessivos
     saveTimeout: null,
     isSaving: false,
+    saveFailures: 0,        // Falhas seguidas (backoff exponencial até 60s)
+    saveErrorShown: false,  // Aviso de falha já exibido nesta queda
     autoSave() {
         // Evitar múltiplos salvamentos simultâneos
         if (this.isSaving) {
@@ -217,41 +269,68 @@ const Store = {
 
         if (this.saveTimeout) clearTimeout(this.saveTimeout);
 
-        // Debounce de 5 segundos (aumentado de 2s para reduzir requests)
+        // Debounce de 5 segundos; depois de falhas, 10s, 20s, 40s... até 60s
+        const delay = Math.min(5000 * 2 ** this.saveFailures, 60000);
         this.saveTimeout = setTimeout(async () => {
+            const { dirty } = this.state;
+            if (dirty.allocations.size === 0 && dirty.routines.size === 0) return;
+
             this.isSaving = true;
 
+            // Envia só os colaboradores alterados (null = removido)
+            const changedAllocations = [...dirty.allocations];
+            const changedRoutines = [...dirty.routines];
+            this.clearDirty();
+
             const payload = {
                 date: this.state.currentDate,
                 shift: this.state.currentShift,
-                allocations: this.state.allocations,
-                routines: this.state.routines
+                allocations: Object.fromEntries(changedAllocations.map(id => [id, this.state.allocations[id] ?? null])),
+                routines: Object.fromEntries(changedRoutines.map(id => [id, this.state.routines[id] ?? null]))
             };
 
-            console.log('💾 Salvando alocações:', {
+            console.log('💾 Salvando alterações:', {
                 date: payload.date,
                 shift: payload.shift,
-                allocations: Object.keys(payload.allocations).length,
-                routines: Object.keys(payload.routines).length
+                allocations: changedAllocations.length,
+                routines: changedRoutines.length
             });
 
+            let saved = false;
             try {
-                const result = await API.saveAllocations(payload);
+                const result = await API.patchAllocations(payload);
 
                 if (result.success) {
-                    console.log('✅ Alocações salvas com sucesso');
-                    this.state.isDirty = false;
+                    console.log('✅ Alterações salvas com sucesso');
+                    saved = true;
                 } else {
-                    console.error('❌ Erro ao salvar alocações:', result);
-                    alert('Erro ao salvar alocações. Verifique o console para mais detalhes.');
+                    console.error('❌ Erro ao salvar alterações:', result);
                 }
             } catch (error) {
                 console.error('❌ Exceção ao salvar:', error);
-                alert('Erro de conexão ao salvar. Tente novamente.');
             } finally {
                 this.isSaving = false;
             }
-        }, 5000); // Aumentado de 2000ms para 5000ms
+
+            if (saved) {
+                if (this.saveErrorShown) console.log('✅ Salvamento restabelecido');
+                this.saveFailures = 0;
+                this.saveErrorShown = false;
+                this.state.isDirty = dirty.allocations.size > 0 || dirty.routines.size > 0;
+            } else {
+                // Devolve as mudanças para a fila e tenta de novo com backoff
+                changedAllocations.forEach(id => dirty.allocations.add(id));
+                changedRoutines.forEach(id => dirty.routines.add(id));
+                this.saveFailures++;
+                if (!this.saveErrorShown) {
+                    // Um aviso por queda (até o próximo salvamento bem-sucedido)
+                    this.saveErrorShown = true;
+                    alert('Erro ao salvar alocações. As alterações ficam pendentes e serão reenviadas automaticamente.');
+                }
+            }
+            // Mudanças feitas durante o envio (ou pendentes após falha)
+            if (this.state.isDirty) this.autoSave();
+        }, delay);
     }
 };
 
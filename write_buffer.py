@@ -0,0 +1,476 @@
+"""
+Buffer de escrita (write-behind) dos autosaves do Smart Flow.
+
+As tablets chamam /api/smart-flow/allocations (PATCH e /save) e /routine/update
+várias vezes por minuto. Em vez de uma transação por requisição, as mudanças
+já validadas pelos endpoints ficam em memória por (data, turno), mescladas, e
+são gravadas em uma transação por dia/turno:
+
+- a cada WRITE_BUFFER_FLUSH_SECONDS (tarefa do lifespan);
+- no fechamento do turno (/routine/update com status "closed");
+- no shutdown (flush de durabilidade no lifespan).
+
+O volume de escrita passa a depender do intervalo, não da atividade dos
+usuários. As leituras não gravam: GET de alocações, bootstrap, presença
+(/smart-flow/load), separação e relatório do turno aplicam o estado pendente sobre o banco
+(`overlay`, `attendance`, `daily_fields`) e incluem `version()` no ETag.
+
+O buffer é por processo: com vários workers, as abas dos outros workers recebem
+as mudanças pelo broker de tempo real (SSE) e o banco no próximo flush.
+WRITE_BUFFER_FLUSH_SECONDS=0 desliga o buffer (cada requisição grava na hora).
+
+Mudanças já confirmadas ao cliente nunca são descartadas: flush que falha é
+repetido com backoff e, enquanto um dia/turno estiver falhando, novas gravações
+dele recebem 503 (WriteBufferUnavailable) para que as tablets reenviem depois.
+Se o banco continuar fora no shutdown, o pendente vai para um arquivo em
+WRITE_BUFFER_SPILL_DIR e é recarregado no próximo startup.
+"""
+import asyncio
+import glob
+import itertools
+import json
+import logging
+import os
+import time
+from datetime import datetime, date as date_type
+
+from sqlmodel import select
+
+import models
+import persistence
+from database import async_session_maker
+
+# Filho do logger de main.py (herda o RotatingFileHandler de logs.txt)
+logger = logging.getLogger("main.write_buffer")
+
+FLUSH_SECONDS = float(os.environ.get("WRITE_BUFFER_FLUSH_SECONDS", 5))
+
+# Espera máxima entre novas tentativas de um flush que falhou (backoff exponencial)
+MAX_RETRY_SECONDS = 60
+
+# Shutdown: por quanto tempo insistir em gravar o pendente antes de salvar em arquivo
+SHUTDOWN_FLUSH_SECONDS = float(os.environ.get("WRITE_BUFFER_SHUTDOWN_SECONDS", 30))
+
+# Diretório dos arquivos de pendências não gravadas no shutdown (um por processo)
+SPILL_DIR = os.environ.get("WRITE_BUFFER_SPILL_DIR", ".")
+SPILL_PATTERN = "write_buffer_pending.*.json"
+
+
+class WriteBufferUnavailable(Exception):
+    """O dia/turno tem mudanças que não conseguem ser gravadas; o cliente deve reenviar depois"""
+
+
+class DayChanges:
+    """Mudanças pendentes de um dia/turno (a mais nova vence)"""
+
+    def __init__(self, version: int):
+        self.version = version
+        self.replace = False  # Alocações substituídas por inteiro (/allocations/save)
+        self.allocations = {}  # employee_id -> subsector_id | None (remover)
+        self.routines = {}  # employee_id -> rotina | None (remover)
+        self.daily = {}  # Campos de DailyOperation (tonnage, report, status, ...)
+        self.attendance_log = None  # Último log de presença de /routine/update
+        # Ordem entre presença (attendance_log) e alocações: a gravada por último prevalece
+        self.allocations_seq = 0
+        self.attendance_seq = 0
+        self.attempts = 0  # Flushes seguidos que falharam
+        self.retry_at = 0.0  # time.monotonic() da próxima tentativa automática
+
+    def merge(self, newer: "DayChanges"):
+        if newer.replace:
+            self.replace = True
+            self.allocations = dict(newer.allocations)
+        else:
+            for emp_id, subsector_id in newer.allocations.items():
+                if self.replace and subsector_id is None:
+                    self.allocations.pop(emp_id, None)
+                else:
+                    self.allocations[emp_id] = subsector_id
+        self.routines.update(newer.routines)
+        self.daily.update(newer.daily)
+        if newer.attendance_log is not None:
+            self.attendance_log = newer.attendance_log
+        self.allocations_seq = max(self.allocations_seq, newer.allocations_seq)
+        self.attendance_seq = max(self.attendance_seq, newer.attendance_seq)
+        self.version = max(self.version, newer.version)
+
+    def to_json(self) -> dict:
+        """Formato do arquivo de pendências (chaves inteiras viram pares)"""
+        return {
+            "replace": self.replace,
+            "allocations": list(self.allocations.items()),
+            "routines": list(self.routines.items()),
+            "daily": self.daily,
+            "attendance_log": self.attendance_log,
+            "allocations_seq": self.allocations_seq,
+            "attendance_seq": self.attendance_seq,
+        }
+
+    @classmethod
+    def from_json(cls, data: dict, versions) -> "DayChanges":
+        changes = cls(0)
+        changes.replace = data["replace"]
+        changes.allocations = {emp_id: sub for emp_id, sub in data["allocations"]}
+        changes.routines = {emp_id: routine for emp_id, routine in data["routines"]}
+        changes.daily = data["daily"]
+        changes.attendance_log = data["attendance_log"]
+        # Versões novas neste processo, mantendo a ordem entre presença e alocações
+        for _, name in sorted((data[name], name) for name in ("allocations_seq", "attendance_seq") if data[name]):
+            setattr(changes, name, next(versions))
+        changes.version = next(versions)
+        return changes
+
+
+async def _write_attendance_log(session, date: date_type, shift: str, changes: DayChanges):
+    entries = await persistence.attendance_entries_from_log(session, changes.attendance_log)
+    await persistence.replace_attendance(session, date, shift, entries)
+
+
+async def _write_allocations(session, date: date_type, shift: str, changes: DayChanges):
+    # Revalida: colaborador ou sub-setor excluído desde a requisição não trava o flush
+    employee_ids = set(changes.allocations) | set(changes.routines)
+    known_employees = set((await session.exec(
+        select(models.Employee.id).where(models.Employee.id.in_(employee_ids))
+    )).all()) if employee_ids else set()
+    subsector_ids = {sub for sub in changes.allocations.values() if sub is not None}
+    known_subsectors = set((await session.exec(
+        select(models.SubSector.id).where(models.SubSector.id.in_(subsector_ids))
+    )).all()) if subsector_ids else set()
+
+    allocate = {
+        emp_id: sub for emp_id, sub in changes.allocations.items()
+        if sub is not None and emp_id in known_employees and sub in known_subsectors
+    }
+    if changes.replace:
+        await persistence.replace_allocations(session, date, shift, allocate)
+    else:
+        await persistence.delete_allocations(session, date, shift, [e for e, sub in changes.allocations.items() if sub is None])
+        await persistence.upsert_allocations(session, date, shift, allocate)
+    await persistence.delete_routines(session, date, shift, [e for e, r in changes.routines.items() if r is None])
+    await persistence.upsert_routines(session, date, shift, {
+        emp_id: routine for emp_id, routine in changes.routines.items()
+        if routine is not None and emp_id in known_employees
+    })
+    # Presença: dia inteiro quando as alocações foram substituídas, senão só os afetados
+    await persistence.refresh_attendance(session, date, shift, None if changes.replace else sorted(employee_ids))
+
+
+async def write_changes(session, date: date_type, shift: str, changes: DayChanges):
+    """Grava as mudanças de um dia/turno na transação de `session` (sem commit)"""
+    daily = (await session.exec(
+        select(models.DailyOperation)
+        .where(models.DailyOperation.date == date)
+        .where(models.DailyOperation.shift == shift)
+    )).first()
+    if not daily:
+        daily = models.DailyOperation(date=date, shift=shift)
+        session.add(daily)
+    for name, value in changes.daily.items():
+        setattr(daily, name, value)
+
+    steps = [(changes.attendance_seq, _write_attendance_log), (changes.allocations_seq, _write_allocations)]
+    for seq, step in sorted(steps, key=lambda s: s[0]):
+        if seq:
+            await step(session, date, shift, changes)
+    daily.updated_at = datetime.now()
+    session.add(daily)
+
+
+def _apply_allocations(changes: DayChanges, allocations: dict, routines: dict):
+    """Aplica alocações/rotinas de `changes` sobre os mapas (no lugar)"""
+    if changes.replace:
+        allocations.clear()
+        allocations.update(changes.allocations)
+    else:
+        for emp_id, subsector_id in changes.allocations.items():
+            if subsector_id is None:
+                allocations.pop(emp_id, None)
+            else:
+                allocations[emp_id] = subsector_id
+    for emp_id, routine in changes.routines.items():
+        if routine is None:
+            routines.pop(emp_id, None)
+        else:
+            routines[emp_id] = routine
+
+
+class WriteBuffer:
+    """Mudanças pendentes por (data, turno), gravadas em lote por uma tarefa asyncio"""
+
+    def __init__(self, interval_seconds: float = FLUSH_SECONDS):
+        self.interval = interval_seconds
+        self.enabled = interval_seconds > 0
+        self._epoch = format(int(time.time()), "x")
+        self._versions = itertools.count(1)
+        self._pending = {}  # (data, turno) -> DayChanges
+        self._inflight = {}  # (data, turno) -> DayChanges sendo gravado (ainda visível nas leituras)
+        self._locks = {}  # (data, turno) -> asyncio.Lock
+        self._task = None
+        self.staged = 0
+        self.flushes = 0
+        self.failures = 0
+        self.rejected = 0
+        self.spilled = 0
+
+    # --- Ciclo de vida ---
+
+    def start(self):
+        # Pendências salvas em arquivo por um shutdown anterior (com ou sem buffer ativo)
+        self._restore_spilled()
+        if self._pending and not self.enabled:
+            self._task = asyncio.create_task(self._retry_until_empty(), name="write-buffer")
+        if not self.enabled or self._task:
+            return
+        self._task = asyncio.create_task(self._loop(), name="write-buffer")
+        logger.info(f"Buffer de escrita ativo (flush a cada {self.interval:g}s)")
+
+    async def stop(self, timeout: float = SHUTDOWN_FLUSH_SECONDS):
+        """
+        Cancela a tarefa periódica e grava tudo que estiver pendente (shutdown).
+        Insiste com backoff por até `timeout` segundos; o que sobrar vai para arquivo.
+        """
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        deadline = time.monotonic() + timeout
+        delay = 0.5
+        await self.flush_all(force=True)
+        while self._pending and time.monotonic() + delay < deadline:
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, MAX_RETRY_SECONDS)
+            await self.flush_all(force=True)
+        if self._pending:
+            self._spill()
+
+    async def _loop(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            await self.flush_all()
+
+    async def _retry_until_empty(self):
+        """Buffer desligado: só grava as pendências recarregadas do arquivo"""
+        while self._pending:
+            await self.flush_all()
+            await asyncio.sleep(1)
+
+    # --- Arquivo de pendências (banco fora no shutdown) ---
+
+    def _spill(self):
+        path = os.path.join(SPILL_DIR, f"write_buffer_pending.{os.getpid()}.json")
+        entries = [
+            {"date": date.isoformat(), "shift": shift, "changes": changes.to_json()}
+            for (date, shift), changes in self._pending.items()
+        ]
+        with open(path + ".tmp", "w", encoding="utf-8") as f:
+            json.dump(entries, f, ensure_ascii=False, default=str)
+        os.replace(path + ".tmp", path)
+        self.spilled += len(entries)
+        logger.error(f"Banco indisponível no shutdown: {len(entries)} dia(s)/turno(s) pendentes salvos em {path} (gravados no próximo startup)")
+
+    def _restore_spilled(self):
+        for path in sorted(glob.glob(os.path.join(SPILL_DIR, SPILL_PATTERN))):
+            # Renomear primeiro: com vários workers, só um carrega cada arquivo
+            claimed = f"{path}.{os.getpid()}.loading"
+            try:
+                os.rename(path, claimed)
+            except OSError:
+                continue
+            with open(claimed, encoding="utf-8") as f:
+                entries = json.load(f)
+            for entry in entries:
+                key = (date_type.fromisoformat(entry["date"]), entry["shift"])
+                changes = DayChanges.from_json(entry["changes"], self._versions)
+                pending = self._pending.get(key)
+                if pending is not None:
+                    changes.merge(pending)
+                self._pending[key] = changes
+            os.remove(claimed)
+            logger.warning(f"{len(entries)} dia(s)/turno(s) pendentes recarregados de {path}")
+
+    # --- Escrita ---
+
+    def _changes(self) -> DayChanges:
+        return DayChanges(next(self._versions))
+
+    async def stage_allocations(self, date: date_type, shift: str, allocations: dict, routines: dict, replace: bool = False):
+        """
+        Alocações/rotinas validadas ({employee_id: valor | None}). replace=True:
+        `allocations` é o mapa completo do dia/turno.
+        """
+        changes = self._changes()
+        changes.replace = replace
+        changes.allocations = {e: s for e, s in allocations.items() if not (replace and s is None)}
+        changes.routines = dict(routines)
+        changes.allocations_seq = changes.version
+        await self._stage(date, shift, changes)
+
+    async def stage_daily(self, date: date_type, shift: str, fields: dict, attendance_log: dict = None):
+        """Campos de DailyOperation e log de presença (substitui o do dia)"""
+        changes = self._changes()
+        changes.daily = dict(fields)
+        if attendance_log is not None:
+            changes.attendance_log = attendance_log
+            changes.attendance_seq = changes.version
+        await self._stage(date, shift, changes)
+
+    async def _stage(self, date: date_type, shift: str, changes: DayChanges):
+        if any(c.attempts for c in self._buffered(date, shift)):
+            # Banco recusando as gravações deste dia/turno: não aceita mais nada até voltar
+            self.rejected += 1
+            raise WriteBufferUnavailable(f"Gravações de {date.isoformat()} {shift} pendentes; tente novamente")
+        self.staged += 1
+        if not self.enabled:
+            # Sem buffer: grava na hora e propaga o erro para a requisição
+            async with async_session_maker() as session:
+                await write_changes(session, date, shift, changes)
+                await session.commit()
+            self.flushes += 1
+            return
+        pending = self._pending.get((date, shift))
+        if pending is None:
+            self._pending[(date, shift)] = changes
+        else:
+            pending.merge(changes)
+
+    async def flush(self, date: date_type, shift: str) -> bool:
+        """Grava o pendente de um dia/turno; em caso de erro mantém e tenta de novo com backoff"""
+        key = (date, shift)
+        lock = self._locks.setdefault(key, asyncio.Lock())
+        async with lock:
+            changes = self._pending.pop(key, None)
+            if changes is None:
+                return False
+            self._inflight[key] = changes
+            try:
+                async with async_session_maker() as session:
+                    await write_changes(session, date, shift, changes)
+                    await session.commit()
+                self.flushes += 1
+                return True
+            except Exception:
+                self.failures += 1
+                changes.attempts += 1
+                delay = min(max(self.interval, 1) * 2 ** (changes.attempts - 1), MAX_RETRY_SECONDS)
+                changes.retry_at = time.monotonic() + delay
+                logger.exception(f"Falha ao gravar mudanças de {date}|{shift} (tentativa {changes.attempts}); nova tentativa em {delay:g}s")
+                newer = self._pending.pop(key, None)
+                if newer is not None:
+                    changes.merge(newer)
+                self._pending[key] = changes
+                return False
+            finally:
+                self._inflight.pop(key, None)
+
+    async def flush_all(self, force: bool = False):
+        """Grava todos os dias/turnos pendentes (sem force, respeita o backoff dos que falharam)"""
+        now = time.monotonic()
+        for (date, shift), changes in list(self._pending.items()):
+            if force or changes.retry_at <= now:
+                await self.flush(date, shift)
+
+    # --- Leitura ---
+
+    def _buffered(self, date: date_type, shift: str) -> list:
+        key = (date, shift)
+        return [c for c in (self._inflight.get(key), self._pending.get(key)) if c is not None]
+
+    def version(self, date: date_type, shift: str) -> str:
+        """Marcador para o ETag: muda a cada mudança pendente ('' sem pendências)"""
+        buffered = self._buffered(date, shift)
+        return f"{self._epoch}.{max(c.version for c in buffered)}" if buffered else ""
+
+    def overlay(self, date: date_type, shift: str, allocations: dict, routines: dict) -> tuple:
+        """Aplica o pendente sobre os mapas {employee_id: ...} lidos do banco"""
+        allocations, routines = dict(allocations), dict(routines)
+        for changes in self._buffered(date, shift):
+            _apply_allocations(changes, allocations, routines)
+        return allocations, routines
+
+    def attendance(self, session, date: date_type, shift: str) -> dict:
+        """
+        Presença do dia/turno ({employee_id: {"status", "sector"}}) lida do banco com o
+        pendente aplicado como o flush gravaria (sessão síncrona)
+        """
+        attendance = {
+            emp_id: {"status": status, "sector": sector}
+            for emp_id, sector, status in session.exec(
+                select(models.Attendance.employee_id, models.Attendance.sector_key, models.Attendance.status)
+                .where(models.Attendance.date == date)
+                .where(models.Attendance.shift == shift)
+            ).all()
+        }
+        buffered = self._buffered(date, shift)
+        if not buffered:
+            return attendance
+        allocations = dict(session.exec(
+            select(models.EmployeeAllocation.employee_id, models.EmployeeAllocation.subsector_id)
+            .where(models.EmployeeAllocation.date == date)
+            .where(models.EmployeeAllocation.shift == shift)
+        ).all())
+        routines = dict(session.exec(
+            select(models.EmployeeRoutine.employee_id, models.EmployeeRoutine.routine)
+            .where(models.EmployeeRoutine.date == date)
+            .where(models.EmployeeRoutine.shift == shift)
+        ).all())
+        # Setor de cada sub-setor e id de cada matrícula citados (1 consulta IN cada)
+        subsector_ids = set(allocations.values()) | {sub for c in buffered for sub in c.allocations.values() if sub is not None}
+        sector_by_subsector = dict(session.exec(
+            select(models.SubSector.id, models.Sector.name)
+            .join(models.Sector, models.Sector.id == models.SubSector.sector_id)
+            .where(models.SubSector.id.in_(subsector_ids))
+        ).all()) if subsector_ids else {}
+        reg_ids = {str(reg_id) for c in buffered if c.attendance_log for reg_id in c.attendance_log}
+        id_by_reg = dict(session.exec(
+            select(models.Employee.registration_id, models.Employee.id)
+            .where(models.Employee.registration_id.in_(reg_ids))
+        ).all()) if reg_ids else {}
+
+        for changes in buffered:
+            # Mesma ordem de write_changes: log de presença e alocações pela sequência
+            steps = sorted((seq, step) for seq, step in ((changes.attendance_seq, "log"), (changes.allocations_seq, "allocations")) if seq)
+            for _, step in steps:
+                if step == "log":
+                    attendance = {
+                        id_by_reg[str(reg_id)]: {"status": entry.get("status") or "present", "sector": entry.get("sector")}
+                        for reg_id, entry in (changes.attendance_log or {}).items()
+                        if str(reg_id) in id_by_reg and isinstance(entry, dict)
+                    }
+                    continue
+                # Substituição regrava o dia inteiro; delta só os colaboradores citados
+                touched = set(attendance) if changes.replace else set(changes.routines)
+                touched |= set(changes.allocations)
+                _apply_allocations(changes, allocations, routines)
+                for emp_id in touched:
+                    sector_name = sector_by_subsector.get(allocations.get(emp_id))
+                    if sector_name is None:
+                        attendance.pop(emp_id, None)
+                    else:
+                        attendance[emp_id] = {"status": routines.get(emp_id, "present"), "sector": persistence.sector_key(sector_name)}
+        return attendance
+
+    def daily_fields(self, date: date_type, shift: str) -> dict:
+        """Campos de DailyOperation ainda não gravados"""
+        fields = {}
+        for changes in self._buffered(date, shift):
+            fields.update(changes.daily)
+        return fields
+
+    def stats(self) -> dict:
+        return {
+            "enabled": self.enabled,
+            "interval_seconds": self.interval,
+            "pending": [f"{d.isoformat()}|{s}" for d, s in self._pending],
+            "retrying": {f"{d.isoformat()}|{s}": c.attempts for (d, s), c in self._pending.items() if c.attempts},
+            "staged": self.staged,
+            "flushes": self.flushes,
+            "failures": self.failures,
+            "rejected": self.rejected,
+            "spilled": self.spilled,
+        }
+
+
+write_buffer = WriteBuffer()